@@ -0,0 +1,169 @@
+import math
+import time
+
+import numpy as np
+import pygame
+
+import tile
+
+COLOR_KEY = (1, 1, 1)
+
+# paletted mode: surfaces hold indices, not colors. Index 0 is the universal
+# background color, then three colors for each of the four background
+# palettes, then black for undrawn transforms and the transparent key.
+# Every 8-bit surface carries INDEX_PALETTE, which has no repeated entries,
+# so blits between them copy indices unchanged; real colors are only
+# applied when the view is presented.
+BACKGROUND_INDEX = 0
+BLACK_INDEX = 13
+KEY_INDEX = 14
+INDEX_PALETTE = [(idx, idx, idx) for idx in range(0, 256)]
+
+
+def index_lut():
+    # [palette, color] -> index, the paletted counterpart of background_color_lut
+    lut = np.full((16, 256), BACKGROUND_INDEX, dtype=np.uint8)
+    for palette in range(0, 4):
+        lut[palette, 1:4] = 1 + palette * 3 + np.arange(0, 3)
+    return lut
+
+
+def palette_colors(cartridge):
+    # the 256 real colors for INDEX_PALETTE indices of this cart
+    colors = [(0, 0, 0)] * 256
+    colors[BACKGROUND_INDEX] = cartridge.lookup_universal_background_color()
+    for palette in range(0, 4):
+        for color in range(1, 4):
+            colors[1 + palette * 3 + color - 1] = cartridge.lookup_background_color(palette, color)
+    colors[KEY_INDEX] = COLOR_KEY
+    return colors
+
+
+def render_tile_pixels(cartridge, tile_numbers, attrs, paletted=False):
+    # vectorized (tile_number, attr) -> (K, 8, 8, 3) rgb, indexed [k, row, col],
+    # or (K, 8, 8) palette indices when paletted
+    tile_numbers = np.asarray(tile_numbers, dtype=np.intp)
+    attrs = np.asarray(attrs, dtype=np.intp)
+    transforms = (attrs >> 4) & 0xF
+    palettes = attrs & 0xF
+    patterns = cartridge.tile_catalog.patterns(tile_numbers - 1, transforms % tile.TRANSFORM_COUNT)
+    lut = index_lut() if paletted else cartridge.background_color_lut()
+    pixels = lut[palettes[:, np.newaxis, np.newaxis], patterns]
+    pixels[patterns == 0] = KEY_INDEX if paletted else COLOR_KEY
+    # only the flips (transforms 0 to 3) are drawn, anything else is left blank
+    pixels[transforms >= tile.TRANSFORM_COUNT] = BLACK_INDEX if paletted else 0
+    return pixels
+
+
+def render_section_pixels(cartridge, tile_data, attr_data, paletted=False):
+    # a whole (rows, cols) block of map tiles as one (rows * 8, cols * 8, 3)
+    # image, or (rows * 8, cols * 8) indices, drawn over the universal
+    # background like tile surfaces blitted onto a filled one
+    rows, cols = tile_data.shape
+    tile_numbers = tile_data.astype(np.intp).ravel()
+    attrs = attr_data.astype(np.intp).ravel()
+    drawn = (tile_numbers > 0) & (tile_numbers <= len(cartridge.tile_catalog))
+    channels = () if paletted else (3,)
+    pixels = np.empty((rows * cols, tile.TILE_SIZE, tile.TILE_SIZE) + channels, dtype=np.uint8)
+    pixels[:] = BACKGROUND_INDEX if paletted else cartridge.lookup_universal_background_color()
+    if drawn.any():
+        tile_pixels = render_tile_pixels(cartridge, tile_numbers[drawn], attrs[drawn], paletted)
+        key = KEY_INDEX if paletted else COLOR_KEY
+        transparent = (tile_pixels == key) if paletted else (tile_pixels == key).all(axis=-1)
+        tile_pixels[transparent] = pixels[0, 0, 0]
+        pixels[drawn] = tile_pixels
+    pixels = pixels.reshape((rows, cols, tile.TILE_SIZE, tile.TILE_SIZE) + channels)
+    return pixels.swapaxes(1, 2).reshape((rows * tile.TILE_SIZE, cols * tile.TILE_SIZE) + channels)
+
+
+def new_surface(size, paletted=False):
+    if not paletted:
+        return pygame.Surface(size)
+    surface = pygame.Surface(size, depth=8)
+    surface.set_palette(INDEX_PALETTE)
+    return surface
+
+
+def surface_from_pixels(pixels):
+    # (h, w, 3) rgb or (h, w) palette indices
+    paletted = pixels.ndim == 2
+    surface = new_surface((pixels.shape[1], pixels.shape[0]), paletted)
+    pygame.surfarray.blit_array(surface, pixels.swapaxes(0, 1))
+    surface.set_colorkey(KEY_INDEX if paletted else COLOR_KEY)
+    return surface
+
+
+class TileAtlas:
+    columns = 32
+
+    def __init__(self, cartridge, paletted=False):
+        self.cartridge = cartridge
+        self.paletted = paletted
+        self.surface = None
+        self.rects = {}
+        self.build_time = 0
+
+    def used_tiles(self):
+        # every (tile_number, attr) pair placed on the map
+        keys = self.cartridge.map.used_tiles()
+        keys = keys[(keys >> 8) <= len(self.cartridge.tile_catalog)]
+        return [(int(key >> 8), int(key & 0xFF)) for key in keys]
+
+    def build(self, tile_lookups=None):
+        start_time = time.perf_counter()
+        if tile_lookups is None:
+            tile_lookups = self.used_tiles()
+        # copies and flips of a tile share one entry
+        catalog = self.cartridge.tile_catalog
+        tile_lookups = sorted(set(catalog.canonical_lookup(tile_number, attr) for tile_number, attr in tile_lookups))
+        self.rects = {}
+        count = len(tile_lookups)
+        rows = max(math.ceil(count / TileAtlas.columns), 1)
+        channels = () if self.paletted else (3,)
+        pixels = np.zeros((rows * TileAtlas.columns, tile.TILE_SIZE, tile.TILE_SIZE) + channels, dtype=np.uint8)
+        if count > 0:
+            tile_numbers, attrs = zip(*tile_lookups)
+            pixels[0:count] = render_tile_pixels(self.cartridge, tile_numbers, attrs, self.paletted)
+        # (rows * columns, 8, 8, 3) -> one (rows * 8, columns * 8, 3) image
+        pixels = pixels.reshape((rows, TileAtlas.columns, tile.TILE_SIZE, tile.TILE_SIZE) + channels)
+        pixels = pixels.swapaxes(1, 2).reshape(
+            (rows * tile.TILE_SIZE, TileAtlas.columns * tile.TILE_SIZE) + channels
+        )
+        self.surface = surface_from_pixels(pixels)
+        for idx, tile_lookup in enumerate(tile_lookups):
+            row, col = divmod(idx, TileAtlas.columns)
+            self.rects[tile_lookup] = pygame.Rect(
+                col * tile.TILE_SIZE,
+                row * tile.TILE_SIZE,
+                tile.TILE_SIZE,
+                tile.TILE_SIZE
+            )
+        self.build_time = time.perf_counter() - start_time
+
+    def subsurface(self, tile_number, attr):
+        rect = self.rects.get(self.cartridge.tile_catalog.canonical_lookup(tile_number, attr))
+        if rect is None:
+            return None
+        return self.surface.subsurface(rect)
+
+    def discard(self, tile_numbers):
+        # stop handing out entries of these tiles; their space is not reused
+        # until the next build
+        for tile_lookup in [tile_lookup for tile_lookup in self.rects if tile_lookup[0] in tile_numbers]:
+            del self.rects[tile_lookup]
+
+    def memory_size(self):
+        if self.surface is None:
+            return 0
+        return self.surface.get_pitch() * self.surface.get_height()
+
+    def report(self):
+        return {
+            'tiles': len(self.rects),
+            'build_ms': self.build_time * 1000,
+            'bytes': self.memory_size()
+        }
+
+    def __str__(self):
+        report = self.report()
+        return f'atlas: {report["tiles"]} tiles, built in {report["build_ms"]:.2f} ms, {report["bytes"]} bytes'
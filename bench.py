@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+import cart
+import game
+import map
+import physics
+import renderer
+import tile
+
+HEADER_SIZE = 20
+SECTION_SIZE = map.Map.section_width * map.Map.section_height
+TILE_DATA_SIZE = tile.TILE_SIZE * tile.TILE_SIZE
+SPRITE_TILES = [0xD, 0xE, 0xF, 0x10, 0x11, 0x12]
+
+
+def synthetic_tile_data(tile_count):
+    return bytes((idx * 7 + idx // TILE_DATA_SIZE) % 4 for idx in range(0, tile_count * TILE_DATA_SIZE))
+
+
+def synthetic_cart_data(section_count, tile_count=32):
+    # a cart of section_count map sections laid out in one long row,
+    # with a repeating pattern of tiles and palettes
+    palette = bytes([0x0F, 0x20, 0x10, 0x00, 0x0F, 0x3D, 0x2D, 0x17, 0x37, 0x27, 0x07, 0x08, 0x09])
+    tiles = synthetic_tile_data(tile_count)
+    tile_map = bytes((idx * 13) % (tile_count + 1) for idx in range(0, section_count * SECTION_SIZE))
+    attr_map = bytes((idx // 3) % 4 | ((idx // 5) % 2) << 4 for idx in range(0, section_count * SECTION_SIZE))
+    map_map = section_count.to_bytes(2, byteorder='big') + (1).to_bytes(2, byteorder='big') + bytes(
+        idx % 256 for idx in range(0, section_count)
+    )
+    offsets = [HEADER_SIZE]
+    for section in [palette, tiles, tile_map, attr_map]:
+        offsets.append(offsets[-1] + len(section))
+    header = b''.join(offset.to_bytes(4, byteorder='big') for offset in offsets)
+    return header + palette + tiles + tile_map + attr_map + map_map
+
+
+def write_synthetic_cart(directory, section_count, tile_count=32):
+    filepath = os.path.join(directory, f'synthetic_{section_count}.cart')
+    with open(filepath, 'wb') as cart_file:
+        cart_file.write(synthetic_cart_data(section_count, tile_count))
+    return filepath
+
+
+def started_renderer(cartridge):
+    r = renderer.Renderer(cartridge)
+    r.start()
+    return r
+
+
+def sprite_area():
+    return map.TiledArea(tile_data=SPRITE_TILES, attr_data=[2] * len(SPRITE_TILES), width=2, height=3)
+
+
+# each bench_ function takes the shared context and returns a list of
+# (name, operation) pairs; setup happens before the operation is timed
+
+def bench_cart_load(context):
+    cases = []
+    for section_count in context['section_counts']:
+        filepath = write_synthetic_cart(context['temp_dir'], section_count)
+        cases.append((f'cart_load[sections={section_count}]', lambda filepath=filepath: cart.Cart(filepath)))
+    return cases
+
+
+def bench_tile_catalog_load(context):
+    cases = []
+    for tile_count in [256, 4096]:
+        raw_data = synthetic_tile_data(tile_count)
+        cases.append((f'tile_catalog_load[tiles={tile_count}]', lambda raw_data=raw_data: tile.TileCatalog().load(raw_data)))
+    return cases
+
+
+def bench_map_load(context):
+    cases = []
+    for section_count in context['section_counts']:
+        raw_data = bytes(section_count * SECTION_SIZE)
+        mapmap_data = section_count.to_bytes(2, byteorder='big') + (1).to_bytes(2, byteorder='big')
+
+        def load(raw_data=raw_data, mapmap_data=mapmap_data):
+            game_map = map.Map()
+            game_map.load(raw_data)
+            game_map.load_attr_map(raw_data)
+            game_map.load_mapmap(mapmap_data)
+        cases.append((f'map_load[sections={section_count}]', load))
+    return cases
+
+
+def bench_tiled_area(context):
+    game_map = context['cartridge'].map
+    rows = range(0, map.Map.section_height)
+    cols = range(0, map.Map.section_width)
+
+    def screen_hitbox():
+        return game_map.get_tiles_in_area(rows, cols).hitbox
+
+    def sprite_hitbox():
+        return sprite_area().hitbox
+    return [('tiled_area[screen]', screen_hitbox), ('tiled_area[sprite]', sprite_hitbox)]
+
+
+def bench_tile_surfaces(context):
+    # building the surfaces of flipped sprite tiles, cold and cached
+    r = renderer.Renderer(context['cartridge'], prefetch_workers=0)
+    lookups = [(tile_number, 2 | tile.FLIP_HORIZONTAL << 4) for tile_number in SPRITE_TILES]
+
+    def cold():
+        r.tile_surface_cache.clear()
+        for tile_number, attr in lookups:
+            r.surface_for_tile(tile_number, attr)
+
+    def cached():
+        for tile_number, attr in lookups:
+            r.surface_for_tile(tile_number, attr)
+    return [('tile_surfaces[cold]', cold), ('tile_surfaces[cached]', cached)]
+
+
+def bench_draw_rect(context):
+    r = started_renderer(context['cartridge'])
+    scroll_buffer = r.scroll_buffer
+    upper_left = scroll_buffer.coord
+    lower_right = upper_left.moved(
+        (map.Map.section_width + 1) * tile.TILE_SIZE,
+        (map.Map.section_height + 1) * tile.TILE_SIZE
+    )
+    return [('scroll_buffer_draw_rect[full]', lambda: scroll_buffer.draw_rect(upper_left, lower_right))]
+
+
+def bench_scroll(context):
+    cases = []
+    directions = [
+        ('right', tile.TILE_SIZE, 0),
+        ('left', -tile.TILE_SIZE, 0),
+        ('down', 0, tile.TILE_SIZE),
+        ('up', 0, -tile.TILE_SIZE)
+    ]
+    for direction, delta_x, delta_y in directions:
+        r = started_renderer(context['cartridge'])
+        # start far enough in so left and up scrolls have room to move
+        r.scroll_buffer.scroll(map.Map.section_width * tile.TILE_SIZE * 4, map.Map.section_height * tile.TILE_SIZE * 4)
+
+        start_coord = r.scroll_buffer.coord
+
+        def scroll(scroll_buffer=r.scroll_buffer, start_coord=start_coord, delta_x=delta_x, delta_y=delta_y):
+            # jump back without drawing so every run scrolls the same strip
+            scroll_buffer.coord = start_coord.moved(0, 0)
+            for step in range(0, 8):
+                scroll_buffer.scroll(delta_x, delta_y)
+        cases.append((f'scroll_buffer_scroll[{direction}, 8 tiles]', scroll))
+    return cases
+
+
+def bench_render_entities(context):
+    cases = []
+    for entity_count in [1, 10, 100, 1000]:
+        r = started_renderer(context['cartridge'])
+        for idx in range(1, entity_count):
+            r.game.add_entity(game.Entity(
+                renderer.LocalCoord().moved((idx * 17) % 240, (idx * 29) % 216),
+                tiled_area=sprite_area()
+            ))
+        cases.append((
+            f'render_entities[entities={entity_count}]',
+            lambda r=r: r.render_entities(r.view_surface)
+        ))
+    return cases
+
+
+def bench_game_advance(context):
+    cases = []
+    for entity_count in [1, 100, 1000, 10000]:
+        g = game.Game(context['cartridge'])
+        for idx in range(0, entity_count):
+            entity = game.Entity(renderer.LocalCoord().moved(idx % 512, idx % 480), tiled_area=None)
+            entity.vector = physics.Vector(x=(idx % 3) - 1, y=(idx % 5) - 2)
+            g.add_entity(entity)
+        cases.append((f'game_advance[entities={entity_count}]', g.advance))
+    return cases
+
+
+def bench_collisions(context):
+    cases = []
+    for entity_count in [100, 1000]:
+        g = game.Game(context['cartridge'])
+        for idx in range(0, entity_count):
+            entity = game.Entity(renderer.LocalCoord().moved((idx * 17) % 1024, (idx * 29) % 960), tiled_area=sprite_area())
+            entity.vector = physics.Vector(x=(idx % 3) - 1, y=(idx % 5) - 2)
+            g.add_entity(entity)
+
+        def step(g=g):
+            g.advance()
+            g.colliding_pairs()
+        cases.append((f'collisions[entities={entity_count}]', step))
+    return cases
+
+
+def bench_map_collisions(context):
+    # entities moving over a large map where every fourth tile number is solid
+    cases = []
+    section_count = max(context['section_counts'])
+    filepath = write_synthetic_cart(context['temp_dir'], section_count)
+    cartridge = cart.Cart(filepath, solid_tiles=range(1, 33, 4))
+    for entity_count in [100, 1000]:
+        g = game.Game(cartridge)
+        for idx in range(0, entity_count):
+            entity = game.Entity(renderer.LocalCoord().moved((idx * 17) % 4096, (idx * 29) % 240), tiled_area=sprite_area())
+            g.add_entity(entity)
+
+        velocities = [((idx % 7) - 3, (idx % 5) - 2) for idx in range(0, entity_count)]
+
+        def step(g=g, velocities=velocities):
+            # collisions shorten velocities, so put them back every step
+            g.store.velocities[0:g.store.count] = velocities
+            g.advance()
+        cases.append((f'map_collisions[entities={entity_count}]', step))
+    return cases
+
+
+def bench_present(context):
+    # presenting the same view again, the common case for a paused game
+    cases = []
+    view_size = (renderer.ScrollBuffer.quad_width, renderer.ScrollBuffer.quad_height)
+    for name, mode, dirty_rects in [('stretch', 'stretch', False), ('letterbox', 'letterbox', False), ('letterbox, dirty', 'letterbox', True)]:
+        presenter = renderer.Presenter(pygame.display.get_surface(), view_size, mode=mode, dirty_rects=dirty_rects)
+        view_surface = pygame.Surface(view_size)
+
+        def present(presenter=presenter, view_surface=view_surface):
+            presenter.scale(view_surface)
+            presenter.update()
+        cases.append((f'present[{name}]', present))
+    return cases
+
+
+def bench_full_frame(context):
+    cases = []
+    for name, paletted in [('full_frame', False), ('full_frame[paletted]', True)]:
+        r = renderer.Renderer(context['cartridge'], paletted=paletted)
+        r.start()
+        r.press_key(pygame.K_RIGHT)
+
+        def frame(r=r):
+            r.apply_input()
+            r.draw_frame()
+        cases.append((name, frame))
+    return cases
+
+
+BENCHMARKS = [
+    bench_cart_load,
+    bench_tile_catalog_load,
+    bench_map_load,
+    bench_tiled_area,
+    bench_tile_surfaces,
+    bench_draw_rect,
+    bench_scroll,
+    bench_render_entities,
+    bench_game_advance,
+    bench_collisions,
+    bench_map_collisions,
+    bench_present,
+    bench_full_frame
+]
+
+
+def time_operation(operation, repeat, min_time):
+    # calibrate the loop count so each sample runs for at least min_time
+    number = 1
+    while True:
+        start_time = time.perf_counter()
+        for _ in range(0, number):
+            operation()
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(1, repeat):
+        start_time = time.perf_counter()
+        for _ in range(0, number):
+            operation()
+        samples.append((time.perf_counter() - start_time) / number)
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'number': number,
+        'repeat': repeat
+    }
+
+
+def run_benchmarks(cart_file, pattern=None, repeat=5, min_time=0.05, section_counts=(4, 64, 512)):
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        context = {
+            'cartridge': cart.Cart(cart_file),
+            'temp_dir': temp_dir,
+            'section_counts': section_counts
+        }
+        pygame.init()
+        pygame.display.set_mode(renderer.Renderer.display_size)
+        for bench in BENCHMARKS:
+            for name, operation in bench(context):
+                if pattern and pattern not in name:
+                    continue
+                results[name] = time_operation(operation, repeat, min_time)
+        pygame.quit()
+    return {
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'benchmarks': results
+    }
+
+
+def compare(results, baseline, threshold):
+    # a benchmark regresses when its median is more than threshold slower
+    regressions = []
+    rows = []
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            rows.append((name, result['median'], None, None))
+            continue
+        ratio = result['median'] / base['median'] if base['median'] > 0 else 1
+        rows.append((name, result['median'], base['median'], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def format_time(seconds):
+    if seconds >= 1:
+        return f'{seconds:.3f} s'
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.3f} ms'
+    return f'{seconds * 1e6:.1f} us'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cart_file', nargs='?', default='testcart.cart', help='Cartridge used by the render benchmarks')
+    parser.add_argument('-k', '--pattern', help='Only run benchmarks whose name contains this')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a previously saved JSON result')
+    parser.add_argument('--save-baseline', help='Write results to this file for later comparison')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown against the baseline (0.25 = 25%%)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='Minimum seconds per sample')
+    args = parser.parse_args()
+    results = run_benchmarks(args.cart_file, pattern=args.pattern, repeat=args.repeat, min_time=args.min_time)
+    for filepath in [args.output, args.save_baseline]:
+        if filepath:
+            with open(filepath, 'w') as output_file:
+                json.dump(results, output_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        rows, regressions = compare(results, baseline, args.threshold)
+        for name, median, base_median, ratio in rows:
+            if base_median is None:
+                print(f'{name:<45} {format_time(median):>12}    (new)')
+            else:
+                flag = '  REGRESSION' if name in regressions else ''
+                print(f'{name:<45} {format_time(median):>12} {format_time(base_median):>12} {ratio:6.2f}x{flag}')
+        return 1 if regressions else 0
+    for name, result in results['benchmarks'].items():
+        print(f'{name:<45} {format_time(result["median"]):>12}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
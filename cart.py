@@ -1,12 +1,16 @@
 import math
+import mmap
+import os
 
+import numpy as np
 import pygame
 
+import cartformat
 import tile
 import map
 
 class Cart:
-    def __init__(self, filepath):
+    def __init__(self, filepath, max_resident_sections=64, solid_tiles=(), solid_attr_mask=0):
         self.map = None
         self.tile_catalog = None
         self.palette = [
@@ -40,31 +44,97 @@ class Cart:
             ( 6,  7,  8),
             ( 9, 10, 11)
         ]
-        # load the cart file
+        # map the cart file; map sections are read straight out of the
+        # mapping and only decoded when they are touched, so keep the cart
+        # open (or use it in a with block) for as long as the map is in use
         with open(filepath, 'rb') as cart_file:
-            cart_data = cart_file.read()
-            header = cart_data[0:20]
-            palette_offset = int.from_bytes(header[0:4], byteorder='big')
-            tile_offset = int.from_bytes(header[4:8], byteorder='big')
-            map_offset = int.from_bytes(header[8:12], byteorder='big')
-            attr_offset = int.from_bytes(header[12:16], byteorder='big')
-            mapmap_offset = int.from_bytes(header[16:20], byteorder='big')
-            palette_data = cart_data[palette_offset:tile_offset]
-            self.background_color = palette_data[0]
-            self.background_palettes[0] = (palette_data[1], palette_data[2], palette_data[3])
-            self.background_palettes[1] = (palette_data[4], palette_data[5], palette_data[6])
-            self.background_palettes[2] = (palette_data[7], palette_data[8], palette_data[9])
-            self.background_palettes[3] = (palette_data[10], palette_data[11], palette_data[12])
-            tile_data = cart_data[tile_offset:map_offset]
-            self.tile_catalog = tile.TileCatalog()
-            self.tile_catalog.load(tile_data)
-            map_data = cart_data[map_offset:attr_offset]
-            self.map = map.Map()
-            self.map.load(map_data)
-            attr_data = cart_data[attr_offset:mapmap_offset]
-            self.map.load_attr_map(attr_data)
-            mapmap_data = cart_data[mapmap_offset:len(cart_data)]
-            self.map.load_mapmap(mapmap_data)
+            size = os.fstat(cart_file.fileno()).st_size
+            if size < cartformat.PREAMBLE.size:
+                raise ValueError(f'{filepath} is not a cart, it is only {size} bytes long')
+            self.cart_mmap = mmap.mmap(cart_file.fileno(), 0, access=mmap.ACCESS_READ)
+        cart_data = memoryview(self.cart_mmap)
+        self.toc = []
+        self.tile_catalog = tile.TileCatalog()
+        self.map = map.Map(
+            max_resident_sections=max_resident_sections,
+            solid_tiles=solid_tiles,
+            solid_attr_mask=solid_attr_mask
+        )
+        if cartformat.is_v2(cart_data):
+            self.load_v2(cart_data)
+        else:
+            self.load_v1(cart_data)
+        self.map.build_solidity()
+
+    def load_v1(self, cart_data):
+        if len(cart_data) < cartformat.V1_HEADER_SIZE:
+            raise ValueError(f'cart is {len(cart_data)} bytes, too short for its header')
+        header = cart_data[0:cartformat.V1_HEADER_SIZE]
+        palette_offset = int.from_bytes(header[0:4], byteorder='big')
+        tile_offset = int.from_bytes(header[4:8], byteorder='big')
+        map_offset = int.from_bytes(header[8:12], byteorder='big')
+        attr_offset = int.from_bytes(header[12:16], byteorder='big')
+        mapmap_offset = int.from_bytes(header[16:20], byteorder='big')
+        offsets = [palette_offset, tile_offset, map_offset, attr_offset, mapmap_offset, len(cart_data)]
+        if offsets != sorted(offsets) or palette_offset < cartformat.V1_HEADER_SIZE:
+            raise ValueError(f'cart is truncated or corrupt, section offsets {offsets[0:-1]} in {len(cart_data)} bytes')
+        self.load_palette(cart_data[palette_offset:tile_offset])
+        # tiles are copied out, so closing the cart only affects the map
+        self.tile_catalog.load(bytes(cart_data[tile_offset:map_offset]))
+        self.map.load(cart_data[map_offset:attr_offset])
+        self.map.load_attr_map(cart_data[attr_offset:mapmap_offset])
+        self.map.load_mapmap(cart_data[mapmap_offset:len(cart_data)])
+
+    def load_v2(self, cart_data):
+        self.toc = cartformat.read_toc(cart_data)
+        entries = {}
+        for entry in self.toc:
+            entries.setdefault(entry.kind, []).append(entry)
+        self.load_palette(self.read_section(cartformat.KIND_PALETTE))
+        tile_index = self.read_section(cartformat.KIND_TILE_INDEX) if cartformat.KIND_TILE_INDEX in entries else None
+        self.tile_catalog.load(bytes(self.read_section(cartformat.KIND_TILES)), tile_index)
+        # map and attr sections stay compressed until they are touched
+        self.map.load_sections(TocSectionStore(
+            cart_data,
+            entries.get(cartformat.KIND_MAP, []),
+            max_resident=self.map.max_resident_sections
+        ))
+        self.map.load_attr_sections(TocSectionStore(
+            cart_data,
+            entries.get(cartformat.KIND_ATTR, []),
+            max_resident=self.map.max_resident_sections
+        ))
+        self.map.load_mapmap(self.read_section(cartformat.KIND_MAPMAP))
+
+    def close(self):
+        # resident map sections and everything else the cart loaded stay
+        # usable; sections not yet touched can no longer be read
+        if self.cart_mmap is None:
+            return
+        self.map.sections.close()
+        self.map.attr_sections.close()
+        self.cart_mmap.close()
+        self.cart_mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_section(self, kind, index=0):
+        # random access to one section of a v2 cart
+        for entry in self.toc:
+            if entry.kind == kind and entry.index == index:
+                return cartformat.read_entry(memoryview(self.cart_mmap), entry)
+        raise KeyError((kind, index))
+
+    def load_palette(self, palette_data):
+        self.background_color = palette_data[0]
+        self.background_palettes[0] = (palette_data[1], palette_data[2], palette_data[3])
+        self.background_palettes[1] = (palette_data[4], palette_data[5], palette_data[6])
+        self.background_palettes[2] = (palette_data[7], palette_data[8], palette_data[9])
+        self.background_palettes[3] = (palette_data[10], palette_data[11], palette_data[12])
 
     def lookup_universal_background_color(self):
         return self.palette[self.background_color]
@@ -74,3 +144,29 @@ class Cart:
             background_palette = self.background_palettes[palette]
             return self.palette[background_palette[color-1]]
         return self.palette[self.background_color]
+
+    def background_color_lut(self):
+        # [palette, color] -> rgb for every attr palette nibble and pixel value,
+        # matching lookup_background_color
+        lut = np.empty((16, 256, 3), dtype=np.uint8)
+        lut[:, :] = self.lookup_universal_background_color()
+        for palette, background_palette in enumerate(self.background_palettes):
+            for color, palette_color in enumerate(background_palette, 1):
+                lut[palette, color] = self.palette[palette_color]
+        return lut
+
+
+class TocSectionStore(map.SectionStore):
+    # map sections of a v2 cart, each one read and decompressed on its own
+    def __init__(self, cart_data, entries, max_resident=None):
+        super().__init__(max_resident=max_resident)
+        self.cart_data = cart_data
+        self.entries = sorted(entries, key=lambda entry: entry.index)
+        self.count = len(self.entries)
+
+    def raw(self, idx):
+        return cartformat.read_entry(self.cart_data, self.entries[idx])
+
+    def close(self):
+        super().close()
+        self.cart_data.release()
@@ -1,69 +1,248 @@
 #!/usr/bin/env python3
 
 import argparse
-import functools
-import sys
+import concurrent.futures
+import hashlib
 import os
+import pickle
+import sys
+import time
+
+import cartformat
+import tile
+
+SECTIONS = ['palette', 'tiles', 'map', 'attr', 'mapmap']
+HEADER_SIZE = 4 * len(SECTIONS)
+CACHE_DIR = '.cartcache'
+# build cache keys are one of these and a content hash; a section of a
+# single block hashes the same as the block
+SECTION_KEY = b'S'
+BLOCK_KEY = b'B'
+
+
+def compile_cart(filepath, cache_dir=None, cart_format=cartformat.VERSION, compression='auto', dedup_tiles=True):
+    # blocks (runs of data lines) whose text is unchanged since the last
+    # build are taken from the build cache instead of being re-encoded
+    start_time = time.perf_counter()
+    sections, line_count = parse_source(filepath)
+    cache = BuildCache(cache_dir, filepath) if cache_dir else None
+    section_data = []
+    block_count = encoded_count = cached_sections = 0
+    for section in SECTIONS:
+        blocks = sections[section]
+        block_count += len(blocks)
+        section_key = SECTION_KEY + content_hash(''.join(''.join(block) for block in blocks))
+        cached = cache.get(section_key) if cache else None
+        if cached is not None:
+            cached_sections += 1
+            data, block_keys = cached
+            for block_key in block_keys:
+                cache.keep(block_key)
+        else:
+            data = bytearray()
+            block_keys = []
+            for block in blocks:
+                encoded = None
+                if cache:
+                    block_key = BLOCK_KEY + content_hash(''.join(block))
+                    block_keys.append(block_key)
+                    encoded = cache.get(block_key)
+                if encoded is None:
+                    encoded = encode_block(block)
+                    encoded_count += 1
+                if cache:
+                    cache.put(block_key, encoded)
+                data += encoded
+            data = bytes(data)
+        if cache:
+            cache.put(section_key, (data, block_keys))
+        section_data.append(data)
+    filename, _ = os.path.splitext(filepath)
+    if cart_format == 1:
+        byte_count = write_cart(filename + '.cart', section_data)
+    else:
+        byte_count = write_cart_v2(filename + '.cart', section_data, compression, dedup_tiles)
+    if cache:
+        cache.save()
+    elapsed = time.perf_counter() - start_time
+    tile_catalog = tile.TileCatalog()
+    tile_catalog.load(section_data[1])
+    return {
+        'cart': filename + '.cart',
+        'lines': line_count,
+        'bytes': byte_count,
+        'blocks': block_count,
+        'encoded_blocks': encoded_count,
+        'cached_sections': cached_sections,
+        'tiles': tile_catalog.report(),
+        'seconds': elapsed
+    }
+
 
-def compile_cart(filepath):
-    header = b''
-    palette = b''
-    tiles = b''
-    tile_map = b''
-    attr_map = b''
-    map_map = b''
+def compile_carts(filepaths, jobs=None, cache_dir=None, cart_format=cartformat.VERSION, compression='auto',
+                  dedup_tiles=True):
+    # independent carts build in parallel, one process per cart
+    if jobs == 1 or len(filepaths) <= 1:
+        return [
+            compile_cart(filepath, cache_dir_for(filepath, cache_dir), cart_format, compression, dedup_tiles)
+            for filepath in filepaths
+        ]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                compile_cart, filepath, cache_dir_for(filepath, cache_dir), cart_format, compression, dedup_tiles
+            )
+            for filepath in filepaths
+        ]
+        return [future.result() for future in futures]
+
+
+def cache_dir_for(filepath, cache_dir):
+    if cache_dir is None:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(filepath)), cache_dir)
+
+
+def parse_source(filepath):
+    # section name -> list of blocks, each block a list of data lines;
+    # blank lines, comments and section headers end a block
+    sections = {section: [] for section in SECTIONS}
+    line_count = 0
     with open(filepath, 'r') as cart_source:
-        current_section = ''
+        current_blocks = None
+        block = None
         for line in cart_source:
+            line_count += 1
             if line.startswith('-'):
-                section = line[1:].strip()
-                current_section = section
-            elif line.startswith('#'):
-                pass
-            elif len(line.strip()) == 0:
-                pass
-            else:
-                raw_bytes = convert_to_bytes(line.strip())
-                if current_section == 'palette':
-                    palette += raw_bytes
-                elif current_section == 'tiles':
-                    tiles += raw_bytes
-                elif current_section == 'map':
-                    tile_map += raw_bytes
-                elif current_section == 'attr':
-                    attr_map += raw_bytes
-                elif current_section == 'mapmap':
-                    map_map += raw_bytes
-    # populating these feels really in-elegant, but I'm too stupid right now
-    # to do it right
-    header_values = [20]
-    header_values.append(len(palette) + header_values[0])
-    header_values.append(len(tiles) + header_values[1])
-    header_values.append(len(tile_map) + header_values[2])
-    header_values.append(len(attr_map) + header_values[3])
-    header_bytes = [x.to_bytes(4, byteorder='big') for x in header_values]
-    header = functools.reduce(lambda x,y: x + y, header_bytes)
-    filename, _ = os.path.splitext(filepath)
-    with open(filename + '.cart', 'wb') as output_cart:
-        output_cart.write(header
-            + palette
-            + tiles
-            + tile_map
-            + attr_map
-            + map_map)
+                # lines in unknown sections are skipped
+                current_blocks = sections.get(line[1:].strip())
+                block = None
+            elif line.startswith('#') or len(line.strip()) == 0:
+                block = None
+            elif current_blocks is not None:
+                if block is None:
+                    block = []
+                    current_blocks.append(block)
+                block.append(line)
+    return sections, line_count
+
+
+def encode_block(block):
+    try:
+        return bytes.fromhex(''.join(block))
+    except ValueError:
+        return b''.join(convert_to_bytes(line) for line in block)
+
+
+def content_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class BuildCache:
+    # encoded blocks and sections from the previous build of one source file,
+    # keyed by content hash
+    def __init__(self, cache_dir, filepath):
+        source_key = content_hash(os.path.abspath(filepath)).hex()
+        name = os.path.basename(filepath)
+        self.filepath = os.path.join(cache_dir, f'{name}.{source_key[0:16]}.cache')
+        self.entries = {}
+        self.live_entries = {}
+        try:
+            with open(self.filepath, 'rb') as cache_file:
+                self.entries = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, data):
+        self.live_entries[key] = data
+
+    def keep(self, key):
+        if key in self.entries:
+            self.live_entries[key] = self.entries[key]
+
+    def save(self):
+        # only what this build used is kept, so the cache does not grow
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        temp_path = f'{self.filepath}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump(self.live_entries, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.filepath)
+
+
+def write_cart(filepath, section_data):
+    # v1: header of big-endian section offsets, then every section, in one pass
+    offset = HEADER_SIZE
+    header = bytearray()
+    for data in section_data[0:-1]:
+        header += offset.to_bytes(4, byteorder='big')
+        offset += len(data)
+    header += offset.to_bytes(4, byteorder='big')
+    replace_file(filepath, [header] + list(section_data))
+    return len(header) + sum(len(data) for data in section_data)
+
+
+def write_cart_v2(filepath, section_data, compression='auto', dedup_tiles=True):
+    cart_data = cartformat.build_v2(*section_data, compression=compression, dedup_tiles=dedup_tiles)
+    replace_file(filepath, cart_data)
+    return sum(len(data) for data in cart_data)
+
+
+def replace_file(filepath, chunks):
+    # written beside the old file and swapped in, never rewritten in place:
+    # a running Cart maps the old file and keeps reading its bytes
+    temp_path = f'{filepath}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as output_file:
+        output_file.writelines(chunks)
+    os.replace(temp_path, filepath)
 
 
 def convert_to_bytes(line):
-    int_values = [int(x, base=16) for x in line.split(' ')]
-    byte_values = bytes(int_values)
-    return byte_values
+    try:
+        return bytes.fromhex(line)
+    except ValueError:
+        # single digit values like 'F' are not valid for fromhex
+        int_values = [int(x, base=16) for x in line.split()]
+        return bytes(int_values)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('cart_file')
+    parser.add_argument('cart_files', nargs='+')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print compile throughput')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of carts to build in parallel')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Build cache directory, relative to each source file')
+    parser.add_argument('--no-cache', action='store_true', help='Re-encode every block')
+    parser.add_argument('--format', type=int, choices=[1, 2], default=cartformat.VERSION,
+        help='Cart format version; v2 carts that store a tile index are marked v3')
+    parser.add_argument('--compression', choices=['auto'] + list(cartformat.COMPRESSION_NAMES), default='auto',
+        help='Section compression for format 2, auto picks the smallest per section')
+    parser.add_argument('--no-dedup', action='store_true', help='Store repeated and flipped tiles in full (format 2)')
     args = parser.parse_args()
-    compile_cart(args.cart_file)
+    cache_dir = None if args.no_cache else args.cache_dir
+    start_time = time.perf_counter()
+    all_stats = compile_carts(
+        args.cart_files,
+        jobs=args.jobs,
+        cache_dir=cache_dir,
+        cart_format=args.format,
+        compression=args.compression,
+        dedup_tiles=not args.no_dedup
+    )
+    elapsed = time.perf_counter() - start_time
+    if args.verbose:
+        for stats in all_stats:
+            seconds = max(stats['seconds'], 1e-9)
+            print(f'{stats["cart"]}: {stats["lines"]} lines, {stats["bytes"]} bytes in {seconds * 1000:.2f} ms '
+                  f'({stats["lines"] / seconds:.0f} lines/s, {stats["bytes"] / seconds:.0f} bytes/s), '
+                  f'{stats["encoded_blocks"]}/{stats["blocks"]} blocks encoded')
+            tiles = stats['tiles']
+            print(f'  {tiles["tiles"]} tiles, {tiles["distinct"]} distinct ({tiles["duplicates"]} duplicates, '
+                  f'{tiles["flipped"]} flipped, {tiles["repeat_bytes"]} bytes of repeats)')
+        if len(all_stats) > 1:
+            print(f'{len(all_stats)} carts in {elapsed * 1000:.2f} ms')
     return 0
 
 
@@ -0,0 +1,181 @@
+import struct
+import zlib
+
+import numpy as np
+
+import tile
+
+# v1: five big-endian u32 offsets (palette, tiles, map, attr, mapmap)
+# followed by the raw sections.
+#
+# v2: magic, version, entry count, then a table of contents with one
+# entry per section. Map and attr sections get an entry each so any one
+# of them can be read on its own; identical sections share their data.
+# When tiles repeat, possibly flipped, the tiles section holds each pattern
+# once and a tile index section says which pattern and flips every tile
+# number uses (see tile.encode_index). Such carts are written as v3, so
+# a v2-only reader refuses them rather than drawing the packed patterns.
+
+V1_HEADER_SIZE = 20
+
+MAGIC = b'REPC'
+VERSION = 2
+VERSION_TILE_INDEX = 3
+PREAMBLE = struct.Struct('>4sHHI')
+TOC_ENTRY = struct.Struct('>BBHIIII')
+
+KIND_PALETTE = 0
+KIND_TILES = 1
+KIND_MAP = 2
+KIND_ATTR = 3
+KIND_MAPMAP = 4
+KIND_TILE_INDEX = 5
+# section kinds each version may hold
+VERSION_KINDS = {
+    VERSION: {KIND_PALETTE, KIND_TILES, KIND_MAP, KIND_ATTR, KIND_MAPMAP},
+    VERSION_TILE_INDEX: {KIND_PALETTE, KIND_TILES, KIND_MAP, KIND_ATTR, KIND_MAPMAP, KIND_TILE_INDEX}
+}
+
+# map.Map.section_width * map.Map.section_height
+MAP_SECTION_SIZE = 32 * 30
+
+COMPRESSION_NONE = 0
+COMPRESSION_RLE = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NAMES = {
+    'none': COMPRESSION_NONE,
+    'rle': COMPRESSION_RLE,
+    'zlib': COMPRESSION_ZLIB
+}
+
+
+class TocEntry:
+    def __init__(self, kind, index, offset, length, raw_length, compression):
+        self.kind = kind
+        self.index = index
+        self.offset = offset
+        self.length = length
+        self.raw_length = raw_length
+        self.compression = compression
+
+
+def is_v2(cart_data):
+    return bytes(cart_data[0:len(MAGIC)]) == MAGIC
+
+
+def rle_encode(data):
+    # (count, value) byte pairs, runs longer than 255 are split
+    values = np.frombuffer(data, dtype=np.uint8)
+    if len(values) == 0:
+        return b''
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+    pieces = (lengths + 254) // 255
+    run_lengths = np.full(int(pieces.sum()), 255, dtype=np.uint8)
+    run_lengths[np.cumsum(pieces) - 1] = lengths - 255 * (pieces - 1)
+    encoded = np.empty(len(run_lengths) * 2, dtype=np.uint8)
+    encoded[0::2] = run_lengths
+    encoded[1::2] = np.repeat(values[starts], pieces)
+    return encoded.tobytes()
+
+
+def rle_decode(data):
+    pairs = np.frombuffer(data, dtype=np.uint8).reshape((-1, 2))
+    return np.repeat(pairs[:, 1], pairs[:, 0]).tobytes()
+
+
+def compress(data, compression):
+    if compression == COMPRESSION_RLE:
+        return rle_encode(data)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data)
+    return bytes(data)
+
+
+def decompress(data, compression):
+    if compression == COMPRESSION_RLE:
+        return rle_decode(data)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+def smallest_compression(data):
+    candidates = [(compress(data, compression), compression) for compression in COMPRESSION_NAMES.values()]
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def pack(data, compression='auto'):
+    # compressed data and the method used, by name or the smallest for auto
+    if compression == 'auto':
+        return smallest_compression(data)
+    method = COMPRESSION_NAMES[compression]
+    return compress(data, method), method
+
+
+def read_toc(cart_data):
+    magic, version, _, entry_count = PREAMBLE.unpack_from(cart_data, 0)
+    if magic != MAGIC or version not in VERSION_KINDS:
+        raise ValueError(f'unsupported cart version {version}')
+    if PREAMBLE.size + entry_count * TOC_ENTRY.size > len(cart_data):
+        raise ValueError(f'cart is truncated, {entry_count} toc entries do not fit in {len(cart_data)} bytes')
+    entries = []
+    for idx_entry in range(0, entry_count):
+        kind, compression, _, index, offset, length, raw_length = TOC_ENTRY.unpack_from(
+            cart_data,
+            PREAMBLE.size + idx_entry * TOC_ENTRY.size
+        )
+        if kind not in VERSION_KINDS[version]:
+            raise ValueError(f'unknown section kind {kind} in a v{version} cart')
+        if offset + length > len(cart_data):
+            raise ValueError(f'cart is truncated, section {kind}/{index} ends past {len(cart_data)} bytes')
+        entries.append(TocEntry(kind, index, offset, length, raw_length, compression))
+    return entries
+
+
+def read_entry(cart_data, entry):
+    # uncompressed entries come back as a zero-copy slice of cart_data
+    data = cart_data[entry.offset:entry.offset + entry.length]
+    return decompress(data, entry.compression)
+
+
+def build_v2(palette, tiles, tile_map, attr_map, map_map, compression='auto', section_size=MAP_SECTION_SIZE,
+             dedup_tiles=True):
+    # returns the list of byte strings making up a v2 cart
+    tile_index = None
+    if dedup_tiles:
+        distinct_tiles, tile_index = tile.pack_distinct(tiles)
+        # the index costs bytes and a toc entry of its own, keep it only when
+        # it makes the cart smaller
+        if tile_index is not None and (
+            len(pack(distinct_tiles, compression)[0]) + len(pack(tile_index, compression)[0]) + TOC_ENTRY.size <
+            len(pack(tiles, compression)[0])
+        ):
+            tiles = distinct_tiles
+        else:
+            tile_index = None
+    sections = [(KIND_PALETTE, 0, palette), (KIND_TILES, 0, tiles)]
+    if tile_index is not None:
+        sections.append((KIND_TILE_INDEX, 0, tile_index))
+    for kind, data in [(KIND_MAP, tile_map), (KIND_ATTR, attr_map)]:
+        for idx_section in range(0, len(data) // section_size):
+            sections.append((kind, idx_section, data[idx_section * section_size:(idx_section + 1) * section_size]))
+    sections.append((KIND_MAPMAP, 0, map_map))
+    offset = PREAMBLE.size + TOC_ENTRY.size * len(sections)
+    version = VERSION if tile_index is None else VERSION_TILE_INDEX
+    toc = bytearray(PREAMBLE.pack(MAGIC, version, 0, len(sections)))
+    blobs = []
+    stored = {}
+    for kind, index, data in sections:
+        data = bytes(data)
+        # identical sections are stored once
+        location = stored.get(data)
+        if location is None:
+            packed, method = pack(data, compression)
+            location = (offset, len(packed), method)
+            stored[data] = location
+            blobs.append(packed)
+            offset += len(packed)
+        entry_offset, length, method = location
+        toc += TOC_ENTRY.pack(kind, method, 0, index, entry_offset, length, len(data))
+    return [bytes(toc)] + blobs
@@ -0,0 +1,170 @@
+import itertools
+from collections import defaultdict
+
+import numpy as np
+
+import tile
+
+# span that covers no cells at all
+NO_CELLS = (1, 1, 0, 0)
+
+
+def rects_overlap(rect_a, rect_b):
+    # same rule as pygame.Rect.colliderect: touching edges and empty rects
+    # never collide
+    ax, ay, aw, ah = rect_a
+    bx, by, bw, bh = rect_b
+    if aw <= 0 or ah <= 0 or bw <= 0 or bh <= 0:
+        return False
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def overlapping(rects_a, rects_b):
+    # rects_overlap over two (n, 4) arrays at once
+    return (
+        (rects_a[:, 2] > 0) & (rects_a[:, 3] > 0) & (rects_b[:, 2] > 0) & (rects_b[:, 3] > 0) &
+        (rects_a[:, 0] < rects_b[:, 0] + rects_b[:, 2]) & (rects_b[:, 0] < rects_a[:, 0] + rects_a[:, 2]) &
+        (rects_a[:, 1] < rects_b[:, 1] + rects_b[:, 3]) & (rects_b[:, 1] < rects_a[:, 1] + rects_a[:, 3])
+    )
+
+
+def cell_spans(rects, cell_size):
+    # (n, 4) x, y, width, height -> (n, 4) inclusive cell ranges
+    # first col, first row, last col, last row
+    rects = np.asarray(rects, dtype=np.float64).reshape((-1, 4))
+    spans = np.empty((len(rects), 4), dtype=np.int64)
+    spans[:, 0:2] = np.floor(rects[:, 0:2] / cell_size)
+    spans[:, 2:4] = np.maximum(np.ceil((rects[:, 0:2] + rects[:, 2:4]) / cell_size) - 1, spans[:, 0:2])
+    return spans
+
+
+def cells_in(span):
+    first_col, first_row, last_col, last_row = span
+    for row in range(first_row, last_row + 1):
+        for col in range(first_col, last_col + 1):
+            yield (col, row)
+
+
+class SpatialHash:
+    # uniform grid broad phase; each cell holds the handles of everything
+    # whose rect touches it, rects themselves come from rect_of(handle)
+    def __init__(self, cell_size=tile.TILE_SIZE, rect_of=None):
+        self.cell_size = cell_size
+        self.rect_of = rect_of
+        self.cells = defaultdict(set)
+        self.spans = {}
+        self.checks_done = 0
+        self.checks_skipped = 0
+
+    def __len__(self):
+        return len(self.spans)
+
+    def insert(self, handle, span):
+        if handle in self.spans:
+            self.remove(handle)
+        self.spans[handle] = span
+        for cell in cells_in(span):
+            self.cells[cell].add(handle)
+
+    def remove(self, handle):
+        span = self.spans.pop(handle, None)
+        if span is None:
+            return
+        for cell in cells_in(span):
+            bucket = self.cells[cell]
+            bucket.discard(handle)
+            if not bucket:
+                del self.cells[cell]
+
+    def query(self, rect):
+        # handles whose rect overlaps rect
+        span = tuple(int(n) for n in cell_spans(rect, self.cell_size)[0])
+        candidates = set()
+        for cell in cells_in(span):
+            candidates.update(self.cells.get(cell, ()))
+        self.checks_done += len(candidates)
+        self.checks_skipped += len(self.spans) - len(candidates)
+        return [handle for handle in candidates if rects_overlap(rect, self.rect_of(handle))]
+
+    def candidate_pairs(self):
+        # pairs sharing at least one cell, each once with the smaller handle first
+        candidates = set()
+        for bucket in self.cells.values():
+            if len(bucket) > 1:
+                candidates.update(itertools.combinations(sorted(bucket), 2))
+        count = len(self.spans)
+        self.checks_done += len(candidates)
+        self.checks_skipped += count * (count - 1) // 2 - len(candidates)
+        return candidates
+
+    def colliding_pairs(self):
+        return [
+            (handle_a, handle_b) for handle_a, handle_b in self.candidate_pairs()
+            if rects_overlap(self.rect_of(handle_a), self.rect_of(handle_b))
+        ]
+
+    def reset_counters(self):
+        self.checks_done = 0
+        self.checks_skipped = 0
+
+    def stats(self):
+        return {
+            'entities': len(self.spans),
+            'cells': len(self.cells),
+            'checks_done': self.checks_done,
+            'checks_skipped': self.checks_skipped
+        }
+
+
+def sweep_axis(solid_at, rects, deltas, axis, cell_size):
+    # move (n, 4) rects along one axis by deltas, stopping flush against the
+    # first solid cell the leading edge crosses; only the crossed cells are
+    # tested. Returns the allowed deltas and which rects were stopped.
+    other = 1 - axis
+    starts = rects[:, axis]
+    ends = starts + rects[:, axis + 2]
+    first = np.floor(starts / cell_size).astype(np.int64)
+    last = np.maximum(np.ceil(ends / cell_size).astype(np.int64) - 1, first)
+    forward = deltas > 0
+    # first crossed cell and how many lie beyond it in the direction of motion
+    entry = np.where(forward, last + 1, first - 1)
+    target = np.where(forward, np.ceil((ends + deltas) / cell_size) - 1, np.floor((starts + deltas) / cell_size))
+    crossed = np.where(deltas != 0, np.abs(target.astype(np.int64) - entry) + 1, 0)
+    crossed = np.where(np.where(forward, target >= entry, target <= entry), crossed, 0)
+    # the cells the rect covers across the motion
+    across_first = np.floor(rects[:, other] / cell_size).astype(np.int64)
+    across_last = np.maximum(np.ceil((rects[:, other] + rects[:, other + 2]) / cell_size).astype(np.int64) - 1, across_first)
+    allowed = deltas.astype(np.float64)
+    stopped = np.zeros(len(rects), dtype=bool)
+    if len(rects) == 0 or crossed.max() == 0:
+        return allowed, stopped
+    steps = np.arange(0, crossed.max())
+    spans = np.arange(0, (across_last - across_first).max() + 1)
+    step_cells = entry[:, np.newaxis] + np.where(forward, 1, -1)[:, np.newaxis] * steps
+    across_cells = across_first[:, np.newaxis] + spans
+    valid = (
+        (steps < crossed[:, np.newaxis])[:, :, np.newaxis] &
+        (across_cells <= across_last[:, np.newaxis])[:, np.newaxis, :]
+    )
+    if axis == 0:
+        solid = solid_at(across_cells[:, np.newaxis, :], step_cells[:, :, np.newaxis])
+    else:
+        solid = solid_at(step_cells[:, :, np.newaxis], across_cells[:, np.newaxis, :])
+    hits = (solid & valid).any(axis=2)
+    stopped = hits.any(axis=1)
+    hit_cells = step_cells[np.arange(len(rects)), hits.argmax(axis=1)]
+    flush = np.where(forward, hit_cells * cell_size - ends, (hit_cells + 1) * cell_size - starts)
+    allowed[stopped] = flush[stopped]
+    return allowed, stopped
+
+
+def resolve_tile_motion(solid_at, rects, deltas, cell_size=tile.TILE_SIZE):
+    # swept rects against a grid of solid cells, x first then y from the
+    # new x position; solid_at(rows, cols) reports solidity of many cells
+    rects = np.asarray(rects, dtype=np.float64).reshape((-1, 4))
+    deltas = np.asarray(deltas, dtype=np.float64).reshape((-1, 2))
+    allowed_x, stopped_x = sweep_axis(solid_at, rects, deltas[:, 0], 0, cell_size)
+    moved = rects.copy()
+    moved[:, 0] += allowed_x
+    allowed_y, stopped_y = sweep_axis(solid_at, moved, deltas[:, 1], 1, cell_size)
+    return np.stack((allowed_x, allowed_y), axis=1), np.stack((stopped_x, stopped_y), axis=1)
@@ -1,34 +1,454 @@
 import math
 
+import numpy as np
 import pygame
 
 import cart
+import collision
+import map
 import tile
 import physics
 
+class StoreCoord:
+    # mixed into an entity's coord class so that x and y are the entity's
+    # slot in the store, and in place changes like move() write through
+    __slots__ = ()
+
+    @property
+    def x(self):
+        return self.store.position(self.handle)[0]
+
+    @x.setter
+    def x(self, x):
+        self.store.set_position(self.handle, x, self.y)
+
+    @property
+    def y(self):
+        return self.store.position(self.handle)[1]
+
+    @y.setter
+    def y(self, y):
+        self.store.set_position(self.handle, self.x, y)
+
+
+# coord class -> the same class with StoreCoord mixed in
+store_coord_types = {}
+
+
+def store_coord(coord_type, store, handle):
+    bound_type = store_coord_types.get(coord_type)
+    if bound_type is None:
+        bound_type = type(f'Store{coord_type.__name__}', (StoreCoord, coord_type), {'__slots__': ('store', 'handle')})
+        store_coord_types[coord_type] = bound_type
+    coord = bound_type.__new__(bound_type)
+    coord.store = store
+    coord.handle = handle
+    return coord
+
+
+class StoreVector(physics.Vector):
+    # the velocity of an entity's slot in the store, written through
+    def __init__(self, store, handle):
+        self.store = store
+        self.handle = handle
+
+    @property
+    def x(self):
+        return self.store.velocity(self.handle)[0]
+
+    @x.setter
+    def x(self, x):
+        self.store.set_velocity(self.handle, x, self.y)
+
+    @property
+    def y(self):
+        return self.store.velocity(self.handle)[1]
+
+    @y.setter
+    def y(self, y):
+        self.store.set_velocity(self.handle, self.x, y)
+
+
 class Entity:
+    # thin view of one slot of an EntityStore; before it is added to a
+    # game (or after it is removed) it keeps its own state. While attached,
+    # coord and vector are views of the slot, so changing them in place
+    # changes the entity.
     def __init__(self, coord, tiled_area):
-        self.coord = coord
-        self.tiled_area = tiled_area
-        self.vector = physics.Vector()
+        self.store = None
+        self.handle = None
+        self._coord = coord
+        self._tiled_area = tiled_area
+        self._vector = physics.Vector()
+        self._store_coord = None
+        self._store_vector = None
+
+    @property
+    def coord(self):
+        if self.store is not None:
+            return self._store_coord
+        return self._coord
+
+    @coord.setter
+    def coord(self, coord):
+        if self.store is not None:
+            self.store.set_position(self.handle, coord.x, coord.y)
+        else:
+            self._coord = coord
+
+    @property
+    def vector(self):
+        if self.store is not None:
+            return self._store_vector
+        return self._vector
+
+    @vector.setter
+    def vector(self, vector):
+        if self.store is not None:
+            self.store.set_velocity(self.handle, vector.x, vector.y)
+        else:
+            self._vector = vector
+
+    @property
+    def tiled_area(self):
+        if self.store is not None:
+            return self.store.tiled_areas[self.store.slots[self.handle]]
+        return self._tiled_area
+
+    @tiled_area.setter
+    def tiled_area(self, tiled_area):
+        self._tiled_area = tiled_area
+        if self.store is not None:
+            self.store.set_tiled_area(self.handle, tiled_area)
+
+    def interpolated_coord(self, alpha):
+        # where to draw the entity alpha of the way from its previous tick
+        if self.store is not None:
+            x, y = self.store.interpolated_position(self.handle, alpha)
+            return type(self._coord)(x, y)
+        return self.coord
+
+    def accelerate(self, delta_x, delta_y):
+        # change velocity in place, without building a new Vector
+        if self.store is not None:
+            self.store.accelerate(self.handle, delta_x, delta_y)
+        else:
+            self._vector = self._vector.add(physics.Vector(x=delta_x, y=delta_y))
 
     def move(self):
-        self.coord = self.coord.moved(self.vector.x, self.vector.y)
+        if self.store is not None:
+            self.store.move(self.handle)
+        else:
+            self._coord.move(self._vector.x, self._vector.y)
+
+    def attach(self, store, handle):
+        self.store = store
+        self.handle = handle
+        self._store_coord = store_coord(type(self._coord), store, handle)
+        self._store_vector = StoreVector(store, handle)
+
+    def detach(self):
+        # take a copy of the store's state before the slot goes away
+        x, y = self.store.position(self.handle)
+        self._coord = type(self._coord)(x, y)
+        velocity_x, velocity_y = self.store.velocity(self.handle)
+        self._vector = physics.Vector(x=velocity_x, y=velocity_y)
+        self._tiled_area = self.tiled_area
+        self.store = None
+        self.handle = None
+        self._store_coord = None
+        self._store_vector = None
+
+
+class Controls:
+    # held keys steering one entity; shared by the renderer and the
+    # rendering-free simulator so both play a session the same way
+    def __init__(self, entity):
+        self.entity = entity
+        self.pressed_keys = set()
+
+    def press(self, key):
+        if key == pygame.K_RIGHT:
+            self.pressed_keys.discard(pygame.K_LEFT)
+        elif key == pygame.K_LEFT:
+            self.pressed_keys.discard(pygame.K_RIGHT)
+        elif key == pygame.K_UP:
+            self.pressed_keys.discard(pygame.K_DOWN)
+        elif key == pygame.K_DOWN:
+            self.pressed_keys.discard(pygame.K_UP)
+        elif key == pygame.K_SPACE:
+            self.entity.accelerate(0, -25)
+        self.pressed_keys.add(key)
+
+    def release(self, key):
+        self.pressed_keys.discard(key)
+
+    def hold(self, frame_keys):
+        # release and press whatever differs from the keys held this frame
+        for key in self.pressed_keys - frame_keys:
+            self.release(key)
+        for key in frame_keys - self.pressed_keys:
+            self.press(key)
+
+    def apply(self):
+        for key in self.pressed_keys:
+            if key == pygame.K_RIGHT:
+                self.entity.accelerate(1, 0)
+            elif key == pygame.K_LEFT:
+                self.entity.accelerate(-1, 0)
+            elif key == pygame.K_DOWN:
+                self.entity.accelerate(0, 1)
+            elif key == pygame.K_UP:
+                self.entity.accelerate(0, -1)
+
+
+class EntityStore:
+    # positions, velocities and tiled areas of every entity in parallel
+    # arrays; live entities are packed into the first count slots and are
+    # addressed from outside through stable handles
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.positions = np.zeros((capacity, 2), dtype=np.float64)
+        # positions as of the start of the last tick, for interpolation
+        self.previous_positions = np.zeros((capacity, 2), dtype=np.float64)
+        self.velocities = np.zeros((capacity, 2), dtype=np.float64)
+        self.tiled_areas = [None] * capacity
+        # hitbox offset and size within the entity, and the spatial hash
+        # cells it was last filed under
+        self.hitboxes = np.zeros((capacity, 4), dtype=np.float64)
+        # tiled area version each hitbox was copied from
+        self.area_versions = np.full(capacity, -1, dtype=np.int64)
+        self.seen_edit_count = map.TiledArea.edit_count
+        self.cell_spans = np.full((capacity, 4), collision.NO_CELLS, dtype=np.int64)
+        self.handles = np.zeros(capacity, dtype=np.int64)
+        self.slots = {}
+        self.next_handle = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, x, y, velocity_x=0, velocity_y=0, tiled_area=None):
+        if self.count == len(self.positions):
+            self.grow()
+        slot = self.count
+        handle = self.next_handle
+        self.next_handle += 1
+        self.positions[slot] = (x, y)
+        self.previous_positions[slot] = (x, y)
+        self.velocities[slot] = (velocity_x, velocity_y)
+        self.set_tiled_area(handle, tiled_area, slot=slot)
+        # not filed anywhere until the next spatial hash update
+        self.cell_spans[slot] = collision.NO_CELLS
+        self.handles[slot] = handle
+        self.slots[handle] = slot
+        self.count += 1
+        return handle
+
+    def remove(self, handle):
+        # move the last entity into the freed slot to keep the arrays packed
+        slot = self.slots.pop(handle)
+        last = self.count - 1
+        if slot != last:
+            self.positions[slot] = self.positions[last]
+            self.previous_positions[slot] = self.previous_positions[last]
+            self.velocities[slot] = self.velocities[last]
+            self.tiled_areas[slot] = self.tiled_areas[last]
+            self.hitboxes[slot] = self.hitboxes[last]
+            self.area_versions[slot] = self.area_versions[last]
+            self.cell_spans[slot] = self.cell_spans[last]
+            self.handles[slot] = self.handles[last]
+            self.slots[int(self.handles[slot])] = slot
+        self.tiled_areas[last] = None
+        self.count = last
+
+    def grow(self):
+        capacity = len(self.positions) * 2
+        self.positions = np.resize(self.positions, (capacity, 2))
+        self.previous_positions = np.resize(self.previous_positions, (capacity, 2))
+        self.velocities = np.resize(self.velocities, (capacity, 2))
+        self.hitboxes = np.resize(self.hitboxes, (capacity, 4))
+        self.area_versions = np.resize(self.area_versions, capacity)
+        self.cell_spans = np.resize(self.cell_spans, (capacity, 4))
+        self.handles = np.resize(self.handles, capacity)
+        self.tiled_areas.extend([None] * (capacity - len(self.tiled_areas)))
+
+    def position(self, handle):
+        x, y = self.positions[self.slots[handle]]
+        return float(x), float(y)
+
+    def set_position(self, handle, x, y):
+        # a jump, not a move, so there is nothing to interpolate
+        slot = self.slots[handle]
+        self.positions[slot] = (x, y)
+        self.previous_positions[slot] = (x, y)
+
+    def interpolated_position(self, handle, alpha):
+        slot = self.slots[handle]
+        previous = self.previous_positions[slot]
+        x, y = previous + (self.positions[slot] - previous) * alpha
+        return float(x), float(y)
+
+    def interpolated_positions(self, alpha):
+        # (count, 2) positions alpha of the way through the last tick
+        previous = self.previous_positions[0:self.count]
+        return previous + (self.positions[0:self.count] - previous) * alpha
+
+    def snapshot(self):
+        self.previous_positions[0:self.count] = self.positions[0:self.count]
+
+    def set_tiled_area(self, handle, tiled_area, slot=None):
+        if slot is None:
+            slot = self.slots[handle]
+        self.tiled_areas[slot] = tiled_area
+        if tiled_area is not None:
+            hitbox = tiled_area.hitbox
+            self.hitboxes[slot] = (hitbox.x, hitbox.y, hitbox.width, hitbox.height)
+            self.area_versions[slot] = tiled_area.version
+        else:
+            self.hitboxes[slot] = 0
+            self.area_versions[slot] = -1
+
+    def refresh_hitboxes(self):
+        # copy in the hitboxes of tiled areas edited since they were added
+        if map.TiledArea.edit_count == self.seen_edit_count:
+            return
+        self.seen_edit_count = map.TiledArea.edit_count
+        versions = np.fromiter(
+            (-1 if tiled_area is None else tiled_area.version for tiled_area in self.tiled_areas[0:self.count]),
+            dtype=np.int64,
+            count=self.count
+        )
+        for slot in np.flatnonzero(versions != self.area_versions[0:self.count]).tolist():
+            self.set_tiled_area(int(self.handles[slot]), self.tiled_areas[slot], slot=slot)
+
+    def hitbox_rect(self, handle):
+        slot = self.slots[handle]
+        x, y = self.positions[slot] + self.hitboxes[slot, 0:2]
+        return float(x), float(y), float(self.hitboxes[slot, 2]), float(self.hitboxes[slot, 3])
+
+    def hitbox_rects(self, slots=None):
+        # (n, 4) hitboxes in local pixel coordinates, every live entity by default
+        if slots is None:
+            slots = slice(0, self.count)
+        rects = self.hitboxes[slots].copy()
+        rects[:, 0:2] += self.positions[slots]
+        return rects
+
+    def velocity(self, handle):
+        velocity_x, velocity_y = self.velocities[self.slots[handle]]
+        return float(velocity_x), float(velocity_y)
+
+    def set_velocity(self, handle, velocity_x, velocity_y):
+        self.velocities[self.slots[handle]] = (velocity_x, velocity_y)
+
+    def accelerate(self, handle, delta_x, delta_y):
+        velocity = self.velocities[self.slots[handle]]
+        velocity[0] += delta_x
+        velocity[1] += delta_y
+
+    def move(self, handle):
+        slot = self.slots[handle]
+        self.integrate(slice(slot, slot + 1))
+
+    def integrate(self, slots=None):
+        # one step for every live entity; like LocalCoord.move, an axis that
+        # would go below zero stays where it was
+        if slots is None:
+            slots = slice(0, self.count)
+        positions = self.positions[slots]
+        moved = positions + self.velocities[slots]
+        np.copyto(positions, moved, where=moved >= 0)
 
 
 class Game:
-    def __init__(self, cartridge):
-        self.entities = set()
+    def __init__(self, cartridge, cell_size=tile.TILE_SIZE):
+        self.store = EntityStore()
+        self.entities_by_handle = {}
         self.cartridge = cartridge
-        
+        self.spatial_hash = collision.SpatialHash(cell_size, rect_of=self.store.hitbox_rect)
+
+    @property
+    def entities(self):
+        return self.entities_by_handle.values()
+
     def add_entity(self, entity):
-        self.entities.add(entity)
-        
+        if entity.store is self.store:
+            return entity.handle
+        coord = entity.coord
+        vector = entity.vector
+        handle = self.store.add(coord.x, coord.y, vector.x, vector.y, entity.tiled_area)
+        entity.attach(self.store, handle)
+        self.entities_by_handle[handle] = entity
+        slot = self.store.slots[handle]
+        self.update_spatial_hash(slice(slot, slot + 1))
+        return handle
+
     def remove_entity(self, entity):
-        if entity in self.entities:
-            self.entities.remove(entity)
-    
+        if entity.handle in self.entities_by_handle and entity.store is self.store:
+            del self.entities_by_handle[entity.handle]
+            handle = entity.handle
+            entity.detach()
+            self.spatial_hash.remove(handle)
+            self.store.remove(handle)
+
     def advance(self):
-        for entity in self.entities:
-            entity.move()
+        self.store.snapshot()
+        self.store.refresh_hitboxes()
+        self.resolve_map_collisions()
+        self.store.integrate()
+        self.update_spatial_hash()
+
+    def resolve_map_collisions(self):
+        # shorten this step's velocity of anything that would run into a
+        # solid tile so it ends up flush against it
+        game_map = self.cartridge.map if self.cartridge is not None else None
+        if game_map is None or not game_map.has_solidity:
+            return
+        store = self.store
+        velocities = store.velocities[0:store.count]
+        hitboxes = store.hitboxes[0:store.count]
+        moving = np.flatnonzero((velocities != 0).any(axis=1) & (hitboxes[:, 2] > 0) & (hitboxes[:, 3] > 0))
+        if len(moving) == 0:
+            return
+        rects = store.hitbox_rects(moving)
+        # local pixels to map pixels
+        rects[:, 0] -= map.LOCAL_ORIGIN[0] * tile.TILE_SIZE
+        rects[:, 1] -= map.LOCAL_ORIGIN[1] * tile.TILE_SIZE
+        allowed, stopped = collision.resolve_tile_motion(game_map.solid_at, rects, velocities[moving])
+        velocities[moving] = np.where(stopped, allowed, velocities[moving])
+
+    def update_spatial_hash(self, slots=None):
+        # only entities that crossed into different cells are re-filed
+        if slots is None:
+            slots = slice(0, self.store.count)
+        rects = self.store.hitbox_rects(slots)
+        # an empty hitbox never collides, so it is kept out of the hash
+        empty = (rects[:, 2] <= 0) | (rects[:, 3] <= 0)
+        spans = np.empty((len(rects), 4), dtype=np.int64)
+        spans[:] = collision.NO_CELLS
+        filed = np.flatnonzero(~empty)
+        spans[filed] = collision.cell_spans(rects[filed], self.spatial_hash.cell_size)
+        changed = np.flatnonzero((spans != self.store.cell_spans[slots]).any(axis=1))
+        handles = self.store.handles[slots]
+        for idx in changed:
+            if empty[idx]:
+                self.spatial_hash.remove(int(handles[idx]))
+            else:
+                self.spatial_hash.insert(int(handles[idx]), tuple(int(n) for n in spans[idx]))
+        self.store.cell_spans[slots] = spans
+
+    def entities_in_rect(self, rect):
+        return [self.entities_by_handle[handle] for handle in self.spatial_hash.query(rect)]
 
+    def colliding_pairs(self):
+        # the narrow phase runs on every candidate pair at once
+        candidates = self.spatial_hash.candidate_pairs()
+        if not candidates:
+            return []
+        pairs = np.array(sorted(candidates), dtype=np.int64)
+        slots = self.store.slots
+        slots_a = [slots[handle] for handle in pairs[:, 0].tolist()]
+        slots_b = [slots[handle] for handle in pairs[:, 1].tolist()]
+        rects = self.store.hitbox_rects()
+        hits = pairs[collision.overlapping(rects[slots_a], rects[slots_b])].tolist()
+        return [(self.entities_by_handle[handle_a], self.entities_by_handle[handle_b]) for handle_a, handle_b in hits]
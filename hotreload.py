@@ -0,0 +1,165 @@
+import os
+import time
+
+import numpy as np
+
+import cartc
+import map
+import tile
+
+
+class SourceWatcher:
+    # notices changes to a file by polling its size and modification time,
+    # at most once every interval seconds
+    def __init__(self, filepath, interval=0.25, clock=time.perf_counter):
+        self.filepath = filepath
+        self.interval = interval
+        self.clock = clock
+        self.next_poll = clock() + interval
+        self.signature = self.stat()
+
+    def stat(self):
+        try:
+            stat = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def poll(self):
+        now = self.clock()
+        if now < self.next_poll:
+            return False
+        self.next_poll = now + self.interval
+        signature = self.stat()
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+
+class HotReloader:
+    # recompiles the source of a running renderer's cart when it changes and
+    # swaps the new palette, tiles and map sections into the live cart. Only
+    # sections whose text changed are re-encoded, and only the surfaces
+    # drawn from changed tiles or sections are thrown away.
+    def __init__(self, renderer, source_path, interval=0.25, on_reload=None, clock=time.perf_counter):
+        self.renderer = renderer
+        self.source_path = source_path
+        self.on_reload = on_reload
+        self.watcher = SourceWatcher(source_path, interval=interval, clock=clock)
+        self.section_keys = {}
+        self.section_data = {}
+        self.reloads = []
+        self.commit(self.compile())
+
+    def poll(self):
+        if self.watcher.poll():
+            return self.reload()
+        return None
+
+    def compile(self):
+        # section name -> (hash, bytes) for every section whose text changed
+        # since the last commit. Nothing is recorded here: a save that fails
+        # halfway must leave every section still looking changed.
+        sections, _ = cartc.parse_source(self.source_path)
+        compiled = {}
+        for section in cartc.SECTIONS:
+            blocks = sections[section]
+            section_key = cartc.content_hash(''.join(''.join(block) for block in blocks))
+            if section_key == self.section_keys.get(section):
+                continue
+            compiled[section] = (section_key, b''.join(cartc.encode_block(block) for block in blocks))
+        return compiled
+
+    def commit(self, compiled):
+        for section, (section_key, data) in compiled.items():
+            self.section_keys[section] = section_key
+            self.section_data[section] = data
+
+    def reload(self):
+        start_time = time.perf_counter()
+        report = {'sections': [], 'tiles': 0, 'map_sections': 0, 'error': None}
+        try:
+            compiled = self.compile()
+        except (OSError, ValueError) as error:
+            # most likely saved halfway through an edit, the next save retries
+            report['error'] = str(error)
+            compiled = {}
+        changed = {
+            section: data for section, (_, data) in compiled.items() if data != self.section_data.get(section)
+        }
+        report['sections'] = [section for section in cartc.SECTIONS if section in changed]
+        if changed:
+            self.apply(changed, report)
+        self.commit(compiled)
+        report['ms'] = (time.perf_counter() - start_time) * 1000
+        self.reloads.append(report)
+        if self.on_reload is not None:
+            self.on_reload(report)
+        return report
+
+    def apply(self, changed, report):
+        renderer = self.renderer
+        # a warm-up thread still building from the old cart would file
+        # surfaces drawn with the new one under the old keys
+        renderer.wait_for_warm_up()
+        cartridge = renderer.cartridge
+        game_map = cartridge.map
+        scroll_buffer = renderer.scroll_buffer
+        stale_sections = set()
+        redraw_all = False
+        if 'palette' in changed:
+            cartridge.load_palette(changed['palette'])
+            renderer.update_palette()
+        if 'tiles' in changed:
+            tile_catalog = tile.TileCatalog()
+            tile_catalog.load(changed['tiles'])
+            changed_tiles = changed_tile_numbers(cartridge.tile_catalog, tile_catalog)
+            cartridge.tile_catalog = tile_catalog
+            renderer.invalidate_tiles(changed_tiles)
+            report['tiles'] = len(changed_tiles)
+            if scroll_buffer is not None and changed_tiles:
+                # rendered sections that use any of the tiles
+                tile_numbers = np.array(changed_tiles)
+                for idx_section in scroll_buffer.section_cache.sections():
+                    if idx_section >= 0 and np.isin(game_map.decode_section(idx_section)[0], tile_numbers).any():
+                        stale_sections.add(idx_section)
+        if 'mapmap' in changed:
+            game_map.load_mapmap(changed['mapmap'])
+            redraw_all = True
+        for section, load in [('map', game_map.load), ('attr', game_map.load_attr_map)]:
+            if section not in changed:
+                continue
+            store = game_map.sections if section == 'map' else game_map.attr_sections
+            stale_sections.update(changed_sections(store, changed[section]))
+            load(changed[section])
+        if 'map' in changed or 'attr' in changed:
+            game_map.build_solidity()
+        report['map_sections'] = len(stale_sections)
+        if scroll_buffer is None:
+            return
+        if redraw_all:
+            scroll_buffer.redraw()
+        elif stale_sections:
+            scroll_buffer.redraw_sections(stale_sections)
+
+
+def changed_tile_numbers(old_catalog, new_catalog):
+    # tile numbers whose pixels differ, or that exist in only one catalog
+    common = min(len(old_catalog), len(new_catalog))
+    tile_indices = np.arange(0, common)
+    differs = (old_catalog.patterns(tile_indices) != new_catalog.patterns(tile_indices)).any(axis=(1, 2))
+    tile_numbers = (np.flatnonzero(differs) + 1).tolist()
+    return tile_numbers + list(range(common + 1, max(len(old_catalog), len(new_catalog)) + 1))
+
+
+def changed_sections(store, raw_data):
+    # indices of the map sections that differ between a section store and new raw data
+    section_size = map.Map.section_height * map.Map.section_width
+    new_count = len(raw_data) // section_size
+    common = min(len(store), new_count)
+    new_sections = np.frombuffer(raw_data, dtype=np.uint8, count=common * section_size).reshape(
+        (common, map.Map.section_height, map.Map.section_width)
+    )
+    changed = [idx for idx in range(0, common) if not np.array_equal(store.decode(idx), new_sections[idx])]
+    return changed + list(range(common, max(len(store), new_count)))
@@ -1,45 +1,48 @@
 import math
+from collections import OrderedDict
 
+import numpy as np
 import pygame
 
 import tile
 
+# local tile coordinates of map tile (0, 0); the scroll buffer starts with
+# the top left of the map in the middle of its first quadrant
+LOCAL_ORIGIN = (16, 15)
+
 class Map:
     section_width = 32
     section_height = 30
 
-    def __init__(self):
-        self.sections = []
-        self.attr_sections = []
+    def __init__(self, max_resident_sections=64, solid_tiles=(), solid_attr_mask=0):
+        self.max_resident_sections = max_resident_sections
+        self.sections = SectionStore(max_resident=max_resident_sections)
+        self.attr_sections = SectionStore(max_resident=max_resident_sections)
         self.map_map = []
         self.map_width = 0
         self.map_height = 0
+        # a tile is solid when its number is in solid_tiles or its attr byte
+        # has any bit of solid_attr_mask set
+        self.solid_lut = np.zeros(256, dtype=bool)
+        self.solid_lut[list(solid_tiles)] = True
+        self.solid_attr_mask = solid_attr_mask
+        self.solid_bits = np.zeros((0, Map.section_height, Map.section_width // 8), dtype=np.uint8)
+        # section index -> tile_number << 8 | attr of every tile it places
+        self.section_tile_keys = {}
 
     def load(self, raw_data):
-        self.sections = []
-        section_size = Map.section_height * Map.section_width
-        section_count = math.floor(len(raw_data) / section_size)
-        for idx_section in range(0, section_count):
-            section_data = raw_data[idx_section * section_size:(idx_section + 1) * section_size]
-            section = []
-            for row in range(0, Map.section_height):
-                row_data = section_data[row * Map.section_width:(row + 1) * Map.section_width]
-                map_row = [t for t in row_data]
-                section.append(map_row)
-            self.sections.append(section)
+        self.load_sections(SectionStore(raw_data, max_resident=self.max_resident_sections))
 
     def load_attr_map(self, raw_data):
-        self.attr_sections = []
-        section_size = Map.section_height * Map.section_width
-        section_count = math.floor(len(raw_data) / section_size)
-        for idx_section in range(0, section_count):
-            section_data = raw_data[idx_section * section_size:(idx_section + 1) * section_size]
-            section = []
-            for row in range(0, Map.section_height):
-                row_data = section_data[row * Map.section_width:(row + 1) * Map.section_width]
-                map_row = [t for t in row_data]
-                section.append(map_row)
-            self.attr_sections.append(section)
+        self.load_attr_sections(SectionStore(raw_data, max_resident=self.max_resident_sections))
+
+    def load_sections(self, sections):
+        self.sections = sections
+        self.section_tile_keys = {}
+
+    def load_attr_sections(self, attr_sections):
+        self.attr_sections = attr_sections
+        self.section_tile_keys = {}
 
     def load_mapmap(self, raw_data):
         self.map_map = []
@@ -48,6 +51,95 @@ class Map:
         map_data = raw_data[4:len(raw_data)]
         self.map_map = [m for m in map_data]
 
+    @property
+    def tile_layer(self):
+        return self.layers()[0]
+
+    @property
+    def attr_layer(self):
+        return self.layers()[1]
+
+    def layers(self):
+        # the whole map as tile and attr arrays, decoding every section
+        # without making any of them resident
+        tile_data = np.zeros((self.map_height * Map.section_height, self.map_width * Map.section_width), dtype=np.uint8)
+        attr_data = np.zeros_like(tile_data)
+        for idx_section in range(0, self.map_width * self.map_height):
+            section_row, section_col = divmod(idx_section, self.map_width)
+            dest = (
+                slice(section_row * Map.section_height, (section_row + 1) * Map.section_height),
+                slice(section_col * Map.section_width, (section_col + 1) * Map.section_width)
+            )
+            tile_data[dest], attr_data[dest] = self.decode_section(idx_section)
+        return tile_data, attr_data
+
+    def used_tiles(self):
+        # sorted tile_number << 8 | attr keys of every tile placed on the map;
+        # each section is scanned once, without becoming resident
+        section_count = min(self.map_width * self.map_height, len(self.sections))
+        keys = [self.tile_keys(idx_section) for idx_section in range(0, section_count)]
+        if not keys:
+            return np.zeros(0, dtype=np.intp)
+        return np.unique(np.concatenate(keys))
+
+    def tile_keys(self, idx_section):
+        keys = self.section_tile_keys.get(idx_section)
+        if keys is None:
+            tile_data, attr_data = self.decode_section(idx_section)
+            placed = tile_data != 0
+            keys = np.unique((tile_data[placed].astype(np.intp) << 8) | attr_data[placed])
+            self.section_tile_keys[idx_section] = keys
+        return keys
+
+    @property
+    def has_solidity(self):
+        return bool(self.solid_lut.any()) or self.solid_attr_mask != 0
+
+    def set_solidity(self, solid_tiles=(), solid_attr_mask=0):
+        self.solid_lut[:] = False
+        self.solid_lut[list(solid_tiles)] = True
+        self.solid_attr_mask = solid_attr_mask
+        self.build_solidity()
+
+    def build_solidity(self):
+        # one packed bitmap per section, 4 bytes per row, most significant
+        # bit first; sections are decoded without becoming resident
+        section_count = max(len(self.sections), len(self.attr_sections))
+        self.solid_bits = np.zeros((section_count, Map.section_height, Map.section_width // 8), dtype=np.uint8)
+        if not self.has_solidity:
+            return
+        for idx_section in range(0, section_count):
+            solid = np.zeros((Map.section_height, Map.section_width), dtype=bool)
+            if idx_section < len(self.sections):
+                solid |= self.solid_lut[self.sections.decode(idx_section)]
+            if self.solid_attr_mask and idx_section < len(self.attr_sections):
+                solid |= (self.attr_sections.decode(idx_section) & self.solid_attr_mask) != 0
+            self.solid_bits[idx_section] = np.packbits(solid, axis=1)
+
+    def solid_at(self, rows, cols):
+        # solidity of any number of map cells at once, read from the bitmaps;
+        # everything outside the map is open
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if len(self.solid_bits) == 0:
+            return np.zeros(np.broadcast(rows, cols).shape, dtype=bool)
+        section_rows = rows // Map.section_height
+        section_cols = cols // Map.section_width
+        idx_sections = section_rows * self.map_width + section_cols
+        inside = (
+            (section_rows >= 0) & (section_rows < self.map_height) &
+            (section_cols >= 0) & (section_cols < self.map_width) &
+            (idx_sections < len(self.solid_bits))
+        )
+        idx_sections = np.where(inside, idx_sections, 0)
+        section_cols = cols % Map.section_width
+        packed = self.solid_bits[idx_sections, rows % Map.section_height, section_cols // 8]
+        return inside & ((packed >> (7 - section_cols % 8)) & 1).astype(bool)
+
+    def release_cold_sections(self, keep=0):
+        self.sections.release_cold(keep)
+        self.attr_sections.release_cold(keep)
+
     def get_section_address(self, row, col):
         section_row = math.floor(row / Map.section_height)
         section_col = math.floor(col / Map.section_width)
@@ -59,32 +151,58 @@ class Map:
         idx_section = self.get_section_address(row, col)
         if idx_section not in range(0, len(self.sections)):
             return 0
-        tile_row = row % Map.section_height
-        tile_col = col % Map.section_width
-        section = self.sections[idx_section]
-        if not section:
-            return 0
-        return section[tile_row][tile_col]
+        return int(self.sections[idx_section][row % Map.section_height, col % Map.section_width])
 
     def get_attr(self, row, col):
         idx_section = self.get_section_address(row, col)
-        if idx_section < 0:
+        if idx_section not in range(0, len(self.attr_sections)):
             return 0
-        attr_row = row % Map.section_height
-        attr_col = col % Map.section_width
-        section = self.attr_sections[idx_section]
-        return section[attr_row][attr_col]
+        return int(self.attr_sections[idx_section][row % Map.section_height, col % Map.section_width])
+
+    def decode_section(self, idx_section):
+        # tiles and attrs of one section without making it resident, so it is
+        # safe to call from other threads
+        shape = (Map.section_height, Map.section_width)
+        tile_data = self.sections.decode(idx_section) if idx_section < len(self.sections) else np.zeros(shape, dtype=np.uint8)
+        attr_data = self.attr_sections.decode(idx_section) if idx_section < len(self.attr_sections) else np.zeros(shape, dtype=np.uint8)
+        return tile_data, attr_data
+
+    def get_region(self, row, col, height, width):
+        tile_data = np.zeros((height, width), dtype=np.uint8)
+        attr_data = np.zeros((height, width), dtype=np.uint8)
+        # clip the requested rect against the map, anything outside stays 0
+        start_row = max(row, 0)
+        end_row = min(row + height, self.map_height * Map.section_height)
+        start_col = max(col, 0)
+        end_col = min(col + width, self.map_width * Map.section_width)
+        if start_row >= end_row or start_col >= end_col:
+            return tile_data, attr_data
+        # one slice per overlapped section, decoding only those sections
+        for section_row in range(start_row // Map.section_height, (end_row - 1) // Map.section_height + 1):
+            section_top = section_row * Map.section_height
+            top = max(start_row, section_top)
+            bottom = min(end_row, section_top + Map.section_height)
+            for section_col in range(start_col // Map.section_width, (end_col - 1) // Map.section_width + 1):
+                section_left = section_col * Map.section_width
+                left = max(start_col, section_left)
+                right = min(end_col, section_left + Map.section_width)
+                idx_section = section_row * self.map_width + section_col
+                source = (slice(top - section_top, bottom - section_top), slice(left - section_left, right - section_left))
+                dest = (slice(top - row, bottom - row), slice(left - col, right - col))
+                if idx_section < len(self.sections):
+                    tile_data[dest] = self.sections[idx_section][source]
+                if idx_section < len(self.attr_sections):
+                    attr_data[dest] = self.attr_sections[idx_section][source]
+        return tile_data, attr_data
 
     def get_tiles_in_area(self, row_range, col_range):
-        tile_data = []
-        attr_data = []
-        for row in row_range:
-            for col in col_range:
-                tile_number = self.get_tile(row, col)
-                tile_data.append(tile_number)
-                attr = self.get_attr(row, col)
-                attr_data.append(attr)
-        tiled_area = TiledArea(tile_data=tile_data, attr_data=attr_data, width=len(col_range), height=len(row_range))
+        tile_data, attr_data = self.get_region(row_range.start, col_range.start, len(row_range), len(col_range))
+        tiled_area = TiledArea(
+            tile_data=tile_data,
+            attr_data=attr_data,
+            width=len(col_range),
+            height=len(row_range)
+        )
         return tiled_area
 
     def __getitem__(self, idx):
@@ -94,42 +212,127 @@ class Map:
             raise IndexError
 
 
+class SectionStore:
+    # map sections over a bytes-like buffer (usually an mmap of the cart),
+    # decoded the first time they are touched. Decoded sections are copies,
+    # so the buffer is only read while decoding and releasing a resident
+    # section frees it.
+    def __init__(self, raw_data=b'', max_resident=None):
+        self.raw_data = memoryview(raw_data)
+        self.section_size = Map.section_height * Map.section_width
+        self.count = len(self.raw_data) // self.section_size
+        self.max_resident = max_resident
+        self.resident = OrderedDict()
+        self.decode_count = 0
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, idx):
+        # zero-copy view of the section's bytes
+        return self.raw_data[idx * self.section_size:(idx + 1) * self.section_size]
+
+    def decode(self, idx):
+        self.decode_count += 1
+        return np.frombuffer(self.raw(idx), dtype=np.uint8).reshape((Map.section_height, Map.section_width)).copy()
+
+    def __getitem__(self, idx):
+        if idx not in range(0, self.count):
+            raise IndexError
+        section = self.resident.get(idx)
+        if section is None:
+            section = self.decode(idx)
+            self.resident[idx] = section
+            if self.max_resident is not None:
+                self.release_cold(self.max_resident)
+        else:
+            self.resident.move_to_end(idx)
+        return section
+
+    def release(self, idx):
+        self.resident.pop(idx, None)
+
+    def release_cold(self, keep=0):
+        # drop all but the keep most recently touched sections
+        while len(self.resident) > keep:
+            self.resident.popitem(last=False)
+
+    def close(self):
+        # let go of the buffer; resident sections stay readable
+        self.raw_data.release()
+
+
 class TiledArea:
+    # tile numbers and attrs as two (height, width) arrays; bounds, hitbox
+    # and the nested tiles list are only worked out when first asked for.
+    # edit_count counts set_tile calls on every area, so holders of many
+    # areas can skip checking their versions while nothing was edited.
+    edit_count = 0
+
     def __init__(self, tile_data=[], attr_data=[], width=0, height=0):
         self.width = width
         self.height = height
-        self.tiles = [list(zip(tile_data[x:x+width], attr_data[x:x+width])) for x in range(0, len(tile_data), width)]
-        self.bounds = pygame.Rect(0, 0, self.width * tile.TILE_SIZE, self.height * tile.TILE_SIZE)
-        self.hitbox = self.calculate_hitbox()
+        self.tile_array = np.array(tile_data, dtype=np.uint8).reshape((height, width))
+        self.attr_array = np.array(attr_data, dtype=np.uint8).reshape((height, width))
+        # bumped on every change so renderers know to rebuild their surfaces;
+        # change tiles through set_tile, not by editing the arrays
+        self.version = 0
+        self._bounds = None
+        self._hitbox = None
+        self._tiles = None
+        self._content_key = None
+
+    @property
+    def tiles(self):
+        # rows of (tile_number, attr) pairs
+        if self._tiles is None:
+            self._tiles = [
+                list(zip(tile_row, attr_row))
+                for tile_row, attr_row in zip(self.tile_array.tolist(), self.attr_array.tolist())
+            ]
+        return self._tiles
+
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = pygame.Rect(0, 0, self.width * tile.TILE_SIZE, self.height * tile.TILE_SIZE)
+        return self._bounds
+
+    @property
+    def hitbox(self):
+        if self._hitbox is None:
+            self._hitbox = self.calculate_hitbox()
+        return self._hitbox
+
+    def set_tile(self, row, col, tile_number, attr=0):
+        self.tile_array[row, col] = tile_number
+        self.attr_array[row, col] = attr
+        self.version += 1
+        TiledArea.edit_count += 1
+        self._hitbox = None
+        self._tiles = None
+        self._content_key = None
+
+    def content_key(self):
+        # equal for areas with the same size, tiles and attrs
+        if self._content_key is None:
+            self._content_key = (self.width, self.height, self.tile_array.tobytes(), self.attr_array.tobytes())
+        return self._content_key
 
     def is_empty(self):
-        for row_data in self.tiles:
-            for tile_number, attr in row_data:
-                if tile_number > 0:
-                    return False
-        return True
+        return not self.tile_array.any()
 
     def calculate_hitbox(self):
-        end_row = end_col = 0
-        start_row = self.height
-        start_col = self.width
-        for row, row_data in enumerate(self.tiles):
-            for col, tile_and_attr in enumerate(row_data):
-                tile_number, attr = tile_and_attr
-                if tile_number != 0:
-                    if row < start_row:
-                        start_row = row
-                    if row > end_row:
-                        end_row = row
-                    if col < start_col:
-                        start_col = col
-                    if col > end_col:
-                        end_col = col
-        if start_col > end_col or start_row > end_row:
-            start_col = end_col = start_row = end_row = 0
+        # the smallest rect around every non-empty tile
+        rows, cols = np.nonzero(self.tile_array)
+        if len(rows) == 0:
+            return pygame.Rect(0, 0, 0, 0)
+        # rows come back in order, cols do not
+        start_row, end_row = int(rows[0]), int(rows[-1])
+        start_col, end_col = int(cols.min()), int(cols.max())
         return pygame.Rect(
             start_col * tile.TILE_SIZE,
             start_row * tile.TILE_SIZE,
-            (end_col - start_col) * tile.TILE_SIZE,
-            (end_row - start_row) * tile.TILE_SIZE
-        )
\ No newline at end of file
+            (end_col - start_col + 1) * tile.TILE_SIZE,
+            (end_row - start_row + 1) * tile.TILE_SIZE
+        )
@@ -0,0 +1,127 @@
+import csv
+import json
+import time
+
+import numpy as np
+import pygame
+
+PHASES = ['events', 'input', 'advance', 'camera', 'scroll_render', 'entities', 'scale', 'update']
+
+
+class FrameProfiler:
+    # time spent in each phase of the last window frames. Each lap(phase)
+    # charges the time since the previous lap to that phase, so a frame costs
+    # one perf_counter call per phase.
+    enabled = True
+
+    def __init__(self, window=600, phases=PHASES, keep_trace=False, overlay=False, overlay_every=30):
+        self.phases = list(phases)
+        self.phase_index = {phase: idx for idx, phase in enumerate(self.phases)}
+        self.window = window
+        self.samples = np.zeros((window, len(self.phases)), dtype=np.float64)
+        self.frame_count = 0
+        self.current = np.zeros(len(self.phases), dtype=np.float64)
+        self.mark = 0.0
+        self.keep_trace = keep_trace
+        self.trace = []
+        self.overlay = overlay
+        self.overlay_every = overlay_every
+        self.overlay_surface = None
+        self.font = None
+
+    def begin_frame(self):
+        self.current[:] = 0
+        self.mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[self.phase_index[phase]] += now - self.mark
+        self.mark = now
+
+    def end_frame(self):
+        self.samples[self.frame_count % self.window] = self.current
+        if self.keep_trace:
+            self.trace.append(self.current.tolist())
+        self.frame_count += 1
+
+    def recent_samples(self):
+        # the last window frames, oldest first
+        if self.frame_count <= self.window:
+            return self.samples[0:self.frame_count]
+        return np.roll(self.samples, -(self.frame_count % self.window), axis=0)
+
+    def percentiles(self, q=(50, 99)):
+        # phase -> seconds at each percentile of q over the window
+        samples = self.recent_samples()
+        if len(samples) == 0:
+            return {phase: tuple(0.0 for _ in q) for phase in self.phases}
+        values = np.percentile(samples, q, axis=0)
+        return {phase: tuple(float(value) for value in values[:, idx]) for idx, phase in enumerate(self.phases)}
+
+    def histogram(self, phase, bins=20):
+        # counts and bin edges of one phase over the window
+        return np.histogram(self.recent_samples()[:, self.phase_index[phase]], bins=bins)
+
+    def draw_overlay(self, surface):
+        # the text is only re-rendered every overlay_every frames; the time
+        # spent here is not charged to any phase. Returns the area drawn over.
+        if not self.overlay:
+            return None
+        if self.overlay_surface is None or self.frame_count % self.overlay_every == 0:
+            if self.font is None:
+                pygame.font.init()
+                self.font = pygame.font.Font(None, 20)
+            lines = [f'{"phase":<14}{"p50 ms":>9}{"p99 ms":>9}']
+            for phase, (p50, p99) in self.percentiles().items():
+                lines.append(f'{phase:<14}{p50 * 1000:>9.3f}{p99 * 1000:>9.3f}')
+            line_height = self.font.get_linesize()
+            rendered = [self.font.render(line, True, (255, 255, 255)) for line in lines]
+            self.overlay_surface = pygame.Surface((max(line.get_width() for line in rendered) + 8, line_height * len(lines) + 8))
+            self.overlay_surface.set_alpha(192)
+            for idx, line in enumerate(rendered):
+                self.overlay_surface.blit(line, (4, 4 + idx * line_height))
+        rect = surface.blit(self.overlay_surface, (0, 0))
+        self.mark = time.perf_counter()
+        return rect
+
+    def export(self, filepath):
+        # per-frame trace (when kept) and window percentiles; .json writes
+        # both, anything else writes the trace as CSV
+        trace = self.trace if self.keep_trace else self.recent_samples().tolist()
+        if filepath.endswith('.json'):
+            with open(filepath, 'w') as trace_file:
+                json.dump({
+                    'phases': self.phases,
+                    'frames': self.frame_count,
+                    'percentiles': {
+                        phase: {'p50': p50, 'p99': p99} for phase, (p50, p99) in self.percentiles().items()
+                    },
+                    'trace': trace
+                }, trace_file)
+        else:
+            with open(filepath, 'w', newline='') as trace_file:
+                writer = csv.writer(trace_file)
+                writer.writerow(['frame'] + self.phases)
+                first_frame = self.frame_count - len(trace)
+                for idx, frame in enumerate(trace):
+                    writer.writerow([first_frame + idx] + frame)
+
+
+class NullProfiler:
+    # stands in when profiling is off so the frame loop needs no checks
+    enabled = False
+
+    def begin_frame(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw_overlay(self, surface):
+        return None
+
+    def export(self, filepath):
+        pass
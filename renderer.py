@@ -1,106 +1,303 @@
+import concurrent.futures
 import math
-from collections import namedtuple
+import os
+import threading
+import time
+import weakref
+from collections import deque, namedtuple, OrderedDict
 
+import numpy as np
 import pygame
 
+import atlas
 import cart
 import game
 import tile
 import map
-import physics
+import profiler
+import scheduler
 
 Point = namedtuple('Point', ['x', 'y'])
 
 class Renderer:
-    def __init__(self, cartridge):
+    def __init__(self, cartridge, frame_profiler=None, paletted=False, present_mode='stretch', present_scale=None,
+                 dirty_rects=False, prefetch_workers=2, tile_cache_bytes=1 << 20, warm_up_thread=False):
         self.cartridge = cartridge
-        self.tile_surface_cache = {}
+        self.profiler = frame_profiler or profiler.NullProfiler()
+        # paletted keeps every surface up to the view as 8-bit palette indices
+        # and applies palette_colors only when presenting
+        self.paletted = paletted
+        self.palette_colors = atlas.palette_colors(cartridge)
+        self.color_key = atlas.KEY_INDEX if paletted else atlas.COLOR_KEY
+        self.present_mode = present_mode
+        self.present_scale = present_scale
+        self.dirty_rects = dirty_rects
+        self.presenter = None
+        self.prefetch_workers = prefetch_workers
+        self.tile_surface_cache = TileSurfaceCache(max_bytes=tile_cache_bytes)
+        # with warm_up_thread, tile surfaces are built ahead of use on this thread
+        self.warm_up_thread = warm_up_thread
+        self.warm_up_worker = None
+        # tiled area -> (version, surface), and content key -> surface with
+        # the least recently used first, so animation frames are reused but
+        # every frame an area ever showed is not kept
+        self.composite_cache = weakref.WeakKeyDictionary()
+        self.composite_surfaces = OrderedDict()
+        self.max_composite_surfaces = 256
         self.game = None
         self.scroll_buffer = None
+        self.camera = None
+        self.player = None
+        self.controls = None
+        self.pressed_keys = set()
+        self.display_surface = None
+        self.view_surface = None
+        self.present_surface = None
+        self.scheduler = None
+        # a hotreload.HotReloader, polled once a frame
+        self.reloader = None
+        # prerender every tile used by the map so scrolling never builds one mid-frame
+        self.atlas = atlas.TileAtlas(cartridge, paletted=paletted)
+        self.atlas.build()
 
-    def render(self):
-        clock = pygame.time.Clock()
+    display_size = (1024, 768)
+
+    def start(self):
         pygame.init()
-        display_surface = pygame.display.set_mode((1024, 768))
-        # display_surface = pygame.display.set_mode((1440, 900), pygame.FULLSCREEN)
-        view_surface = pygame.Surface((map.Map.section_width * tile.TILE_SIZE, map.Map.section_height * tile.TILE_SIZE))
-        pressed_keys = set()
-        self.scroll_buffer = ScrollBuffer(renderer=self)
-        scroll_x = 0
-        scroll_y = 0
+        view_size = (map.Map.section_width * tile.TILE_SIZE, map.Map.section_height * tile.TILE_SIZE)
+        self.display_surface = pygame.display.set_mode(
+            Presenter.window_size(view_size, Renderer.display_size, self.present_mode, self.present_scale)
+        )
+        # self.display_surface = pygame.display.set_mode((1440, 900), pygame.FULLSCREEN)
+        self.presenter = Presenter(
+            self.display_surface,
+            view_size,
+            mode=self.present_mode,
+            scale=self.present_scale,
+            dirty_rects=self.dirty_rects
+        )
+        self.view_surface = self.new_surface(view_size)
+        # the view in real colors, what gets scaled to the display
+        self.present_surface = pygame.Surface(view_size) if self.paletted else self.view_surface
         # testing sprites
-        camera = Camera(scroll_buffer=self.scroll_buffer, follow_mode=Camera.FOLLOW_CENTER)
         self.game = game.Game(self.cartridge)
-        bob = game.Entity(
-            LocalCoord().moved(map.Map.section_width / 2 * tile.TILE_SIZE, (map.Map.section_height / 2) * tile.TILE_SIZE),
-            # LocalCoord(),
-            tiled_area=map.TiledArea(
-                tile_data=[0xD, 0xE, 0xF, 0x10, 0x11, 0x12],
-                attr_data=[2, 2, 2, 2, 2, 2],
-                width=2,
-                height=3
-            )
-        )
-        
-        self.game.add_entity(bob)
-        # -
+        self.player = new_player()
+        self.game.add_entity(self.player)
+        self.controls = game.Controls(self.player)
+        self.pressed_keys = self.controls.pressed_keys
+        self.warm_up([entity.tiled_area for entity in self.game.entities], background=self.warm_up_thread)
+        self.scroll_buffer = ScrollBuffer(renderer=self, prefetch_workers=self.prefetch_workers)
+        self.camera = Camera(scroll_buffer=self.scroll_buffer, follow_mode=Camera.FOLLOW_CENTER)
+
+    def render(self, tick_rate=60, max_frame_skip=5, frame_rate=60):
+        # the game advances at a fixed tick_rate; frames are drawn as often as
+        # frame_rate allows (0 for no cap) with entities interpolated between ticks
+        clock = pygame.time.Clock()
+        self.start()
+        self.scheduler = scheduler.FixedStepScheduler(tick_rate=tick_rate, max_frame_skip=max_frame_skip)
         is_running = True
         while is_running:
+            self.profiler.begin_frame()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     is_running = False
                 elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_RIGHT:
-                        if pygame.K_LEFT in pressed_keys:
-                            pressed_keys.remove(pygame.K_LEFT)
-                    elif event.key == pygame.K_LEFT:
-                        if pygame.K_RIGHT in pressed_keys:
-                            pressed_keys.remove(pygame.K_RIGHT)
-                    elif event.key == pygame.K_UP:
-                        if pygame.K_DOWN in pressed_keys:
-                            pressed_keys.remove(pygame.K_DOWN)
-                    elif event.key == pygame.K_DOWN:
-                        if pygame.K_UP in pressed_keys:
-                            pressed_keys.remove(pygame.K_UP)
-                    elif event.key == pygame.K_SPACE:
-                        bob.vector = bob.vector.add(physics.Vector(x=0, y=-25))
-                    pressed_keys.add(event.key)
+                    self.press_key(event.key)
                 elif event.type == pygame.KEYUP:
                     if event.key == pygame.K_ESCAPE:
                         is_running = False
-                    if event.key in pressed_keys:
-                        pressed_keys.remove(event.key)
-            for key in pressed_keys:
-                if key == pygame.K_RIGHT:
-                    bob.vector = bob.vector.add(physics.Vector(x=1, y=0))
-                elif key == pygame.K_LEFT:
-                    bob.vector = bob.vector.add(physics.Vector(x=-1, y=0))
-                elif key == pygame.K_DOWN:
-                    bob.vector = bob.vector.add(physics.Vector(x=0, y=1))
-                elif key == pygame.K_UP:
-                    bob.vector = bob.vector.add(physics.Vector(x=0, y=-1))
-            self.game.advance()
-            camera.follow(bob.coord.as_pixels().x, bob.coord.as_pixels().y)
-            self.scroll_buffer.render(view_surface)
-            self.render_entities(view_surface)
-            # may want option for smoothscale
-            pygame.transform.scale(view_surface, (1024, 768), display_surface)
-            pygame.display.update()
-            clock.tick(60)
+                    self.release_key(event.key)
+            if self.reloader is not None:
+                self.reloader.poll()
+            self.profiler.lap('events')
+            for _ in range(0, self.scheduler.ticks_due()):
+                self.apply_input()
+                self.profiler.lap('input')
+                self.game.advance()
+                self.profiler.lap('advance')
+            self.present_frame(self.scheduler.alpha)
+            self.profiler.end_frame()
+            self.scheduler.frame_done()
+            clock.tick(frame_rate)
+        self.stop()
+        return self.scheduler.stats()
+
+    def render_headless(self, frame_count, input_script=None, dump_every=0, dump_dir='.', dump_format='png'):
+        # no window and no frame cap; input comes from a script of per-frame key states
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        self.start()
+        input_script = input_script or []
+        start_time = time.perf_counter()
+        for frame in range(0, frame_count):
+            self.profiler.begin_frame()
+            frame_keys = input_script[frame] if frame < len(input_script) else set()
+            self.controls.hold(frame_keys)
+            if self.reloader is not None:
+                self.reloader.poll()
+            self.profiler.lap('events')
+            self.apply_input()
+            self.profiler.lap('input')
+            self.draw_frame()
+            self.profiler.end_frame()
+            if dump_every > 0 and (frame + 1) % dump_every == 0:
+                self.dump_view(os.path.join(dump_dir, f'frame_{frame + 1:06d}.{dump_format}'))
+        elapsed = time.perf_counter() - start_time
+        self.stop()
+        return elapsed
+
+    def stop(self):
+        self.wait_for_warm_up()
+        self.scroll_buffer.section_cache.shutdown()
         pygame.quit()
 
-    def render_entities(self, view_surface):
+    def dump_view(self, filepath):
+        if filepath.endswith('.png'):
+            pygame.image.save(self.present_surface, filepath)
+        else:
+            with open(filepath, 'wb') as dump_file:
+                dump_file.write(pygame.image.tostring(self.present_surface, 'RGB'))
+
+    def new_surface(self, size):
+        return atlas.new_surface(size, self.paletted)
+
+    def background_fill(self):
+        if self.paletted:
+            return atlas.BACKGROUND_INDEX
+        return self.cartridge.lookup_universal_background_color()
+
+    def update_palette(self):
+        # pick up changes to the cart's palettes; paletted mode only swaps the
+        # colors used to present, otherwise every tile has to be redrawn
+        self.palette_colors = atlas.palette_colors(self.cartridge)
+        if self.paletted:
+            return
+        self.wait_for_warm_up()
+        self.tile_surface_cache.clear()
+        self.composite_cache.clear()
+        self.composite_surfaces.clear()
+        self.atlas.build()
+        if self.scroll_buffer is not None:
+            self.scroll_buffer.redraw()
+
+    def invalidate_tiles(self, tile_numbers):
+        # forget every surface drawn from these tiles, e.g. after they were edited
+        tile_numbers = set(tile_numbers)
+        if not tile_numbers:
+            return
+        self.wait_for_warm_up()
+        self.tile_surface_cache.discard_tiles(tile_numbers)
+        self.atlas.discard(tile_numbers)
+        # content keys hold the tile numbers as bytes
+        for content_key in [key for key in self.composite_surfaces if tile_numbers.intersection(key[2])]:
+            del self.composite_surfaces[content_key]
+        self.composite_cache.clear()
+
+    def cycle_palette(self, palette, step=1):
+        # rotate the three colors of one background palette
+        colors = self.cartridge.background_palettes[palette]
+        step %= len(colors)
+        self.cartridge.background_palettes[palette] = colors[step:] + colors[0:step]
+        self.update_palette()
+
+    def press_key(self, key):
+        self.controls.press(key)
+
+    def release_key(self, key):
+        self.controls.release(key)
+
+    def apply_input(self):
+        self.controls.apply()
+
+    def draw_frame(self):
+        self.game.advance()
+        self.profiler.lap('advance')
+        self.present_frame()
+
+    def present_frame(self, alpha=1.0):
+        # alpha 1 draws the state after the last tick, less than 1 draws
+        # entities part way between the last two ticks
+        player_coord = self.player.interpolated_coord(alpha)
+        self.camera.follow(player_coord.x, player_coord.y)
+        self.profiler.lap('camera')
+        self.scroll_buffer.render(self.view_surface)
+        self.profiler.lap('scroll_render')
+        self.render_entities(self.view_surface, alpha)
+        self.profiler.lap('entities')
+        if self.paletted:
+            # real colors only for this one blit, the view has to keep the
+            # index palette for blits into it to copy indices
+            self.view_surface.set_palette(self.palette_colors)
+            self.present_surface.blit(self.view_surface, (0, 0))
+            self.view_surface.set_palette(atlas.INDEX_PALETTE)
+        # may want option for smoothscale
+        self.presenter.scale(self.present_surface)
+        self.profiler.lap('scale')
+        overlay_rect = self.profiler.draw_overlay(self.display_surface)
+        if overlay_rect:
+            self.presenter.add_overlay(overlay_rect)
+        self.presenter.update()
+        self.profiler.lap('update')
+
+    def render_entities(self, view_surface, alpha=1.0):
+        # one composite surface per entity and a single blits call for all of
+        # them; like the tiles they are made of, entities wrap around the edges
+        # of the view
+        view_width, view_height = view_surface.get_size()
+        store = self.game.store
+        positions = store.interpolated_positions(alpha)
+        blit_sequence = []
         for entity in self.game.entities:
-            for row in range(0, entity.tiled_area.height):
-                for col in range(0, entity.tiled_area.width):
-                    coord = entity.coord.moved(col * tile.TILE_SIZE, row * tile.TILE_SIZE)
-                    tile_number, attr = entity.tiled_area.tiles[row][col]
-                    tile_surface = self.surface_for_tile(tile_number, attr)
-                    if tile_surface:
-                        view_surface.blit(tile_surface, (
-                            coord.tile.x * tile.TILE_SIZE + coord.pixel.x,
-                            coord.tile.y * tile.TILE_SIZE + coord.pixel.y)
-                        )
+            surface = self.composite_surface(entity.tiled_area)
+            if surface is None:
+                continue
+            x, y = positions[store.slots[entity.handle]]
+            left = int(x % LocalCoord.quad_pixel_width)
+            top = int(y % LocalCoord.quad_pixel_height)
+            blit_sequence.append((surface, (left, top)))
+            wraps_x = left + surface.get_width() > view_width
+            wraps_y = top + surface.get_height() > view_height
+            if wraps_x:
+                blit_sequence.append((surface, (left - view_width, top)))
+            if wraps_y:
+                blit_sequence.append((surface, (left, top - view_height)))
+            if wraps_x and wraps_y:
+                blit_sequence.append((surface, (left - view_width, top - view_height)))
+        view_surface.blits(blit_sequence, doreturn=False)
+
+    def composite_surface(self, tiled_area):
+        # the whole tiled area in one surface, rebuilt only when its version
+        # changes; areas with the same tiles share a surface
+        cached = self.composite_cache.get(tiled_area)
+        if cached is not None and cached[0] == tiled_area.version:
+            return cached[1]
+        content_key = tiled_area.content_key()
+        if content_key in self.composite_surfaces:
+            surface = self.composite_surfaces[content_key]
+            self.composite_surfaces.move_to_end(content_key)
+        else:
+            surface = self.build_composite_surface(tiled_area)
+            self.composite_surfaces[content_key] = surface
+            while len(self.composite_surfaces) > self.max_composite_surfaces:
+                self.composite_surfaces.popitem(last=False)
+        self.composite_cache[tiled_area] = (tiled_area.version, surface)
+        return surface
+
+    def build_composite_surface(self, tiled_area):
+        blit_sequence = []
+        rows, cols = np.nonzero(tiled_area.tile_array)
+        tile_numbers = tiled_area.tile_array[rows, cols].tolist()
+        attrs = tiled_area.attr_array[rows, cols].tolist()
+        for row, col, tile_number, attr in zip(rows.tolist(), cols.tolist(), tile_numbers, attrs):
+            tile_surface = self.surface_for_tile(tile_number, attr)
+            if tile_surface:
+                blit_sequence.append((tile_surface, (col * tile.TILE_SIZE, row * tile.TILE_SIZE)))
+        if not blit_sequence:
+            return None
+        surface = self.new_surface((tiled_area.width * tile.TILE_SIZE, tiled_area.height * tile.TILE_SIZE))
+        surface.fill(self.color_key)
+        surface.blits(blit_sequence, doreturn=False)
+        surface.set_colorkey(self.color_key)
+        return surface
 
     def surface_for_map_tile(self, map_col, map_row):
         tile_number = self.cartridge.map.get_tile(map_row, map_col)
@@ -112,30 +309,209 @@ class Renderer:
     def surface_for_tile(self, tile_number, attr=0):
         if tile_number <= 0:
             return None
-        tile_lookup = (tile_number, attr)
-        if tile_lookup in self.tile_surface_cache:
-            return self.tile_surface_cache[tile_lookup]
-        transform = (attr >> 4) & 0xF
-        palette = attr & 0xF
-        tile_data = self.cartridge.tile_catalog[tile_number - 1]
-        surface = pygame.Surface((tile.TILE_SIZE, tile.TILE_SIZE))
-        surface.set_colorkey((1, 1, 1))
-        pix_array = pygame.PixelArray(surface)
-        for row in range(0, tile.TILE_SIZE):
-            for col in range(0, tile.TILE_SIZE):
-                p = tile_data[row][col]
-                if p > 0:
-                    color = self.cartridge.lookup_background_color(palette, p)
-                else:
-                    color = (1, 1, 1)
-                if transform == 0:
-                    pix_array[col, row] = color
-                elif transform == 1:  # vertical axis flip
-                    pix_array[7 - col, row] = color
-        self.tile_surface_cache[tile_lookup] = surface
+        # copies and flips of a tile share surfaces
+        tile_lookup = self.cartridge.tile_catalog.canonical_lookup(tile_number, attr)
+        return self.tile_surface_cache.get(tile_lookup, self.load_tile_surface)
+
+    def load_tile_surface(self, tile_lookup):
+        surface = self.atlas.subsurface(*tile_lookup)
+        if surface is None:
+            surface = self.build_tile_surface(*tile_lookup)
         return surface
 
+    def build_tile_surface(self, tile_number, attr):
+        transform = attr >> 4
+        if 0 < transform < tile.TRANSFORM_COUNT:
+            # a flip is made from the unflipped surface of the same tile
+            surface = self.tile_surface_cache.get((tile_number, attr & 0xF), self.load_tile_surface, counted=False)
+            return pygame.transform.flip(
+                surface,
+                bool(transform & tile.FLIP_HORIZONTAL),
+                bool(transform & tile.FLIP_VERTICAL)
+            )
+        pixels = atlas.render_tile_pixels(self.cartridge, [tile_number], [attr], self.paletted)
+        return atlas.surface_from_pixels(pixels[0])
+
+    def warm_up(self, tiled_areas=(), background=False):
+        # build the surface of every tile the map and tiled_areas place
+        # before a frame needs it, entities first as the map's tiles only
+        # take an atlas subsurface
+        catalog = self.cartridge.tile_catalog
+        tile_lookups = []
+        for tiled_area in tiled_areas:
+            if tiled_area is None:
+                continue
+            tile_numbers = tiled_area.tile_array[tiled_area.tile_array > 0]
+            attrs = tiled_area.attr_array[tiled_area.tile_array > 0]
+            tile_lookups.extend(zip(tile_numbers.tolist(), attrs.tolist()))
+        tile_lookups.extend(self.atlas.used_tiles())
+        tile_lookups = warm_up_order([catalog.canonical_lookup(tile_number, attr) for tile_number, attr in tile_lookups])
+        self.wait_for_warm_up()
+        if background:
+            self.warm_up_worker = threading.Thread(
+                target=self.tile_surface_cache.warm,
+                args=(tile_lookups, self.load_tile_surface),
+                daemon=True
+            )
+            self.warm_up_worker.start()
+        else:
+            self.tile_surface_cache.warm(tile_lookups, self.load_tile_surface)
+
+    def wait_for_warm_up(self):
+        if self.warm_up_worker is not None:
+            self.warm_up_worker.join()
+            self.warm_up_worker = None
+
         
+class Presenter:
+    # copies the view to the display. stretch fills the display whatever the
+    # ratio; integer scales by a whole multiple into a window of exactly that
+    # size; letterbox scales by the largest whole multiple that fits the
+    # display and centers it between black bars. With dirty_rects (integer
+    # and letterbox only) the view is compared with the previous frame in
+    # blocks and only changed blocks are scaled and sent to the display.
+    MODES = ['stretch', 'integer', 'letterbox']
+    block_size = (32, 30)
+
+    def __init__(self, display_surface, view_size, mode='stretch', scale=None, dirty_rects=False):
+        if mode not in Presenter.MODES:
+            raise ValueError(f'unknown present mode {mode}')
+        if dirty_rects and mode == 'stretch':
+            raise ValueError('dirty rects need an integer present mode')
+        self.display_surface = display_surface
+        self.view_size = view_size
+        self.mode = mode
+        self.dirty_rects = dirty_rects
+        view_width, view_height = view_size
+        display_width, display_height = display_surface.get_size()
+        if mode == 'stretch':
+            self.scale_factor = None
+            self.dest_rect = pygame.Rect(0, 0, display_width, display_height)
+        else:
+            self.scale_factor = scale or max(min(display_width // view_width, display_height // view_height), 1)
+            width = view_width * self.scale_factor
+            height = view_height * self.scale_factor
+            if width > display_width or height > display_height:
+                raise ValueError(f'{self.scale_factor}x view does not fit a {display_width}x{display_height} display')
+            self.dest_rect = pygame.Rect((display_width - width) // 2, (display_height - height) // 2, width, height)
+        # preallocated destination; scaling writes straight into the display
+        self.dest_surface = display_surface.subsurface(self.dest_rect)
+        self.previous = None
+        self.forced_blocks = None
+        self.update_rects = []
+        self.full_update = True
+        self.start_time = 0.0
+        self.frame_count = 0
+        self.static_frames = 0
+        self.updated_pixels = 0
+        self.present_times = deque(maxlen=600)
+
+    @staticmethod
+    def window_size(view_size, display_size, mode='stretch', scale=None):
+        if mode == 'integer':
+            return (view_size[0] * (scale or 4), view_size[1] * (scale or 4))
+        return display_size
+
+    def scale(self, view_surface):
+        self.start_time = time.perf_counter()
+        self.update_rects = []
+        if not self.dirty_rects:
+            pygame.transform.scale(view_surface, self.dest_rect.size, self.dest_surface)
+            self.update_rects = [self.display_surface.get_rect()] if self.full_update else [self.dest_rect]
+            self.full_update = False
+            return
+        # raw bytes of each row, compared block by block with the last frame
+        view_width, view_height = self.view_size
+        row_bytes = view_width * view_surface.get_bytesize()
+        pixels = np.frombuffer(view_surface.get_buffer(), dtype=np.uint8).reshape((view_height, -1))[:, 0:row_bytes].copy()
+        block_width, block_height = Presenter.block_size
+        if self.previous is None:
+            dirty = np.ones((view_width // block_width, view_height // block_height), dtype=bool)
+        else:
+            changed = pixels != self.previous
+            dirty = changed.reshape(
+                (view_height // block_height, block_height, view_width // block_width, row_bytes // (view_width // block_width))
+            ).any(axis=(1, 3)).T
+        if self.forced_blocks is not None:
+            dirty |= self.forced_blocks
+            self.forced_blocks = None
+        self.previous = pixels
+        if dirty.all():
+            pygame.transform.scale(view_surface, self.dest_rect.size, self.dest_surface)
+            self.update_rects = [self.dest_rect]
+        else:
+            # one scale per run of dirty blocks along a row of blocks
+            for block_row in range(0, dirty.shape[1]):
+                columns = np.flatnonzero(dirty[:, block_row])
+                if len(columns) == 0:
+                    continue
+                breaks = np.flatnonzero(np.diff(columns) > 1)
+                for first, last in zip(np.concatenate(([0], breaks + 1)), np.concatenate((breaks, [len(columns) - 1]))):
+                    source = pygame.Rect(
+                        columns[first] * block_width,
+                        block_row * block_height,
+                        (columns[last] - columns[first] + 1) * block_width,
+                        block_height
+                    )
+                    dest = pygame.Rect(
+                        source.x * self.scale_factor,
+                        source.y * self.scale_factor,
+                        source.width * self.scale_factor,
+                        source.height * self.scale_factor
+                    )
+                    pygame.transform.scale(view_surface.subsurface(source), dest.size, self.dest_surface.subsurface(dest))
+                    self.update_rects.append(dest.move(self.dest_rect.topleft))
+        if self.full_update:
+            self.update_rects = [self.display_surface.get_rect()]
+            self.full_update = False
+
+    def add_overlay(self, rect):
+        # something drawn over the scaled view this frame; it goes out with
+        # this update and the blocks under it are rescaled next frame
+        self.update_rects.append(pygame.Rect(rect))
+        if self.dirty_rects:
+            block_width, block_height = Presenter.block_size
+            area = pygame.Rect(rect).move(-self.dest_rect.x, -self.dest_rect.y)
+            if self.forced_blocks is None:
+                self.forced_blocks = np.zeros(
+                    (self.view_size[0] // block_width, self.view_size[1] // block_height), dtype=bool
+                )
+            first_col = clamp_block(area.left // (block_width * self.scale_factor), self.forced_blocks.shape[0])
+            last_col = clamp_block((area.right - 1) // (block_width * self.scale_factor), self.forced_blocks.shape[0])
+            first_row = clamp_block(area.top // (block_height * self.scale_factor), self.forced_blocks.shape[1])
+            last_row = clamp_block((area.bottom - 1) // (block_height * self.scale_factor), self.forced_blocks.shape[1])
+            self.forced_blocks[first_col:last_col + 1, first_row:last_row + 1] = True
+
+    def update(self):
+        if self.update_rects:
+            pygame.display.update(self.update_rects)
+        else:
+            self.static_frames += 1
+        self.updated_pixels += sum(rect.width * rect.height for rect in self.update_rects)
+        self.frame_count += 1
+        self.present_times.append(time.perf_counter() - self.start_time)
+
+    def stats(self):
+        times = sorted(self.present_times)
+        return {
+            'frames': self.frame_count,
+            'static_frames': self.static_frames,
+            'pixels_per_frame': self.updated_pixels / self.frame_count if self.frame_count else 0,
+            'present_ms_p50': times[len(times) // 2] * 1000 if times else 0,
+            'present_ms_max': times[-1] * 1000 if times else 0
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f'present: {stats["present_ms_p50"]:.3f} ms p50, {stats["present_ms_max"]:.3f} ms max, '
+                f'{stats["static_frames"]}/{stats["frames"]} static frames, '
+                f'{stats["pixels_per_frame"]:.0f} pixels updated per frame')
+
+
+def clamp_block(idx_block, block_count):
+    return min(max(idx_block, 0), block_count - 1)
+
+
 class Camera:
     FOLLOW_CENTER = 0
     FOLLOW_STATIC = 1
@@ -154,21 +530,25 @@ class Camera:
             self.x = x
             self.y = y
             self.scroll_buffer.scroll(delta_x, 0)
+            self.scroll_buffer.prefetch_ahead(delta_x, 0)
         elif self.follow_mode == Camera.FOLLOW_LEAD:
             view_x, view_y = self.scroll_buffer.map_to_view_coord((x, y))
             if view_x < (map.Map.section_width * tile.TILE_SIZE) * ( 1 / 3 ) or view_x > (map.Map.section_width * tile.TILE_SIZE) * ( 2 / 3 ):
                 delta_x = x - self.x
                 self.x = x - 30
                 self.scroll_buffer.scroll(delta_x - 30, 0)
+                self.scroll_buffer.prefetch_ahead(delta_x - 30, 0)
 
 
 class ScrollBuffer:
     quad_width = map.Map.section_width * tile.TILE_SIZE
     quad_height = map.Map.section_height * tile.TILE_SIZE
 
-    def __init__(self, renderer):
+    def __init__(self, renderer, section_cache_size=16, prefetch_workers=0, lookahead_frames=30):
         self.renderer = renderer
-        quad_surface = lambda: pygame.Surface((map.Map.section_width * tile.TILE_SIZE, map.Map.section_height * tile.TILE_SIZE))
+        self.section_cache = SectionCache(renderer, max_sections=section_cache_size, prefetch_workers=prefetch_workers)
+        self.lookahead_frames = lookahead_frames
+        quad_surface = lambda: renderer.new_surface((map.Map.section_width * tile.TILE_SIZE, map.Map.section_height * tile.TILE_SIZE))
         self.quadrants = [
             [quad_surface(), quad_surface()],
             [quad_surface(), quad_surface()]
@@ -177,9 +557,9 @@ class ScrollBuffer:
         self.quadrants[0][1].fill((0, 255, 0))
         self.quadrants[1][0].fill((0, 0, 255))
         self.quadrants[1][1].fill((255, 0, 255))
-        self.map_offset = (-int(map.Map.section_width / 2), -int(map.Map.section_height / 2))
+        self.map_offset = (-map.LOCAL_ORIGIN[0], -map.LOCAL_ORIGIN[1])
         self.coord = LocalCoord()
-        self.coord = self.coord.moved(int(map.Map.section_width / 2) * tile.TILE_SIZE, int(map.Map.section_height / 2) * tile.TILE_SIZE)
+        self.coord = self.coord.moved(map.LOCAL_ORIGIN[0] * tile.TILE_SIZE, map.LOCAL_ORIGIN[1] * tile.TILE_SIZE)
         # fill in the whole buffer initially
         upper_left = self.coord
         lower_right = upper_left.moved((map.Map.section_width + 1) * tile.TILE_SIZE, (map.Map.section_height + 1) * tile.TILE_SIZE)
@@ -220,130 +600,447 @@ class ScrollBuffer:
         surface.blit(bottom_right, (ScrollBuffer.quad_width - left, ScrollBuffer.quad_height - top), area=(0, 0, right, bottom))
 
     def scroll(self, delta_x, delta_y):
-        old_coord = self.coord
+        old_tiles = self.coord.as_tiles()
         self.coord = self.coord.moved(delta_x, delta_y)
-        delta_x_tiles = self.coord.as_tiles().x - old_coord.as_tiles().x
-        delta_y_tiles = self.coord.as_tiles().y - old_coord.as_tiles().y
-        for x in range(0, abs(delta_x_tiles)):
-            if delta_x_tiles >= 0:
-                top_left = old_coord.moved((map.Map.section_width + x + 1) * tile.TILE_SIZE, 0)
-                bottom_right = top_left.moved(tile.TILE_SIZE, (map.Map.section_height + 1) * tile.TILE_SIZE)
-                self.draw_rect(top_left, bottom_right)
+        new_tiles = self.coord.as_tiles()
+        view_width = map.Map.section_width + 1
+        view_height = map.Map.section_height + 1
+        # draw only the newly exposed columns, then the newly exposed rows
+        delta_x_tiles = new_tiles.x - old_tiles.x
+        if delta_x_tiles != 0:
+            strip_width = min(abs(delta_x_tiles), view_width)
+            if delta_x_tiles > 0:
+                strip_x = new_tiles.x + view_width - strip_width
             else:
-                top_left = old_coord.moved(-x - 1, old_coord.tile.y)
-                bottom_right = top_left.moved(tile.TILE_SIZE, (map.Map.section_height * 2) * tile.TILE_SIZE)
-                self.draw_rect(top_left, bottom_right)
-        for y in range(0, abs(delta_y_tiles)):
-            if delta_y_tiles >= 0:
-                top_left = old_coord.moved(old_coord.tile.x, (map.Map.section_height + y + 1) * tile.TILE_SIZE)
-                bottom_right = top_left.moved((map.Map.section_width * 2) * tile.TILE_SIZE, tile.TILE_SIZE)
-                self.draw_rect(top_left, bottom_right)
+                strip_x = new_tiles.x
+            self.draw_tiles(strip_x, new_tiles.y, strip_width, view_height)
+        delta_y_tiles = new_tiles.y - old_tiles.y
+        if delta_y_tiles != 0:
+            strip_height = min(abs(delta_y_tiles), view_height)
+            if delta_y_tiles > 0:
+                strip_y = new_tiles.y + view_height - strip_height
             else:
-                top_left = old_coord.moved(old_coord.tile.x, -y)
-                bottom_right = top_left.moved((map.Map.section_width *2) * tile.TILE_SIZE, tile.TILE_SIZE)
-                self.draw_rect(top_left, bottom_right)
+                strip_y = new_tiles.y
+            self.draw_tiles(new_tiles.x, strip_y, view_width, strip_height)
+
+    def prefetch_ahead(self, velocity_x, velocity_y):
+        # queue the sections the view will reach within lookahead_frames if
+        # it keeps scrolling at this many pixels per frame
+        if self.section_cache.executor is None or (velocity_x == 0 and velocity_y == 0):
+            return
+        tiles = self.coord.as_tiles()
+        map_offset_x, map_offset_y = self.map_offset
+        ahead_x = int(velocity_x * self.lookahead_frames // tile.TILE_SIZE)
+        ahead_y = int(velocity_y * self.lookahead_frames // tile.TILE_SIZE)
+        first_col = tiles.x + min(ahead_x, 0) + map_offset_x
+        last_col = tiles.x + max(ahead_x, 0) + map.Map.section_width + map_offset_x
+        first_row = tiles.y + min(ahead_y, 0) + map_offset_y
+        last_row = tiles.y + max(ahead_y, 0) + map.Map.section_height + map_offset_y
+        game_map = self.renderer.cartridge.map
+        idx_sections = []
+        # sections in the direction of travel are queued first
+        for section_row in range(first_row // map.Map.section_height, last_row // map.Map.section_height + 1):
+            for section_col in range(first_col // map.Map.section_width, last_col // map.Map.section_width + 1):
+                idx_section = game_map.get_section_address(section_row * map.Map.section_height, section_col * map.Map.section_width)
+                if idx_section >= 0:
+                    idx_sections.append(idx_section)
+        if velocity_x < 0 or velocity_y < 0:
+            idx_sections.reverse()
+        self.section_cache.prefetch(idx_sections)
+
+    def redraw_sections(self, idx_sections):
+        # re-render these map sections and draw only the visible parts of them
+        idx_sections = set(idx_sections)
+        self.section_cache.discard(idx_sections)
+        tiles = self.coord.as_tiles()
+        map_offset_x, map_offset_y = self.map_offset
+        game_map = self.renderer.cartridge.map
+        view_width = map.Map.section_width + 1
+        view_height = map.Map.section_height + 1
+        for piece_y, piece_height in split_span(tiles.y, view_height, map.Map.section_height, map_offset_y):
+            for piece_x, piece_width in split_span(tiles.x, view_width, map.Map.section_width, map_offset_x):
+                if game_map.get_section_address(piece_y + map_offset_y, piece_x + map_offset_x) in idx_sections:
+                    self.draw_tiles(piece_x, piece_y, piece_width, piece_height)
+
+    def redraw(self):
+        # throw away every rendered section and fill the visible area again
+        self.section_cache.clear()
+        tiles = self.coord.as_tiles()
+        self.draw_tiles(tiles.x, tiles.y, map.Map.section_width + 1, map.Map.section_height + 1)
 
     def draw_rect(self, top_left, bottom_right):
+        start_x, start_y = top_left.as_tiles()
+        end_x, end_y = bottom_right.as_tiles()
+        self.draw_tiles(min(start_x, end_x), min(start_y, end_y), abs(end_x - start_x), abs(end_y - start_y))
+
+    def draw_tiles(self, tile_x, tile_y, width, height):
+        # copy a rect of local tiles out of the cached map sections, one blit
+        # per piece that falls within a single quadrant and a single section
         map_offset_x, map_offset_y = self.map_offset
-        width = abs(bottom_right.as_tiles().x - top_left.as_tiles().x)
-        height = abs(bottom_right.as_tiles().y - top_left.as_tiles().y)
-        for row in range(0, height):
-            for col in range(0, width):
-                coord = top_left.moved(col * tile.TILE_SIZE, row * tile.TILE_SIZE)
-                quadrant_x = clamp(coord.quadrant.x, 0, 1)
-                quadrant_y = clamp(coord.quadrant.y, 0, 1)
-                quadrant = self.quadrants[quadrant_y][quadrant_x]
-                quadrant.fill(self.renderer.cartridge.lookup_universal_background_color(),
+        game_map = self.renderer.cartridge.map
+        for piece_y, piece_height in split_span(tile_y, height, map.Map.section_height, map_offset_y):
+            map_row = piece_y + map_offset_y
+            quadrant_row = self.quadrants[clamp(piece_y // map.Map.section_height, 0, 1)]
+            for piece_x, piece_width in split_span(tile_x, width, map.Map.section_width, map_offset_x):
+                map_col = piece_x + map_offset_x
+                section_surface = self.section_cache.get(game_map.get_section_address(map_row, map_col))
+                quadrant_row[clamp(piece_x // map.Map.section_width, 0, 1)].blit(
+                    section_surface,
                     (
-                        coord.tile.x * tile.TILE_SIZE + coord.pixel.x,
-                        coord.tile.y * tile.TILE_SIZE + coord.pixel.y,
-                        tile.TILE_SIZE,
-                        tile.TILE_SIZE
+                        (piece_x % map.Map.section_width) * tile.TILE_SIZE,
+                        (piece_y % map.Map.section_height) * tile.TILE_SIZE
+                    ),
+                    area=(
+                        (map_col % map.Map.section_width) * tile.TILE_SIZE,
+                        (map_row % map.Map.section_height) * tile.TILE_SIZE,
+                        piece_width * tile.TILE_SIZE,
+                        piece_height * tile.TILE_SIZE
                     )
                 )
-                tile_surface = self.renderer.surface_for_map_tile(
-                    (coord.quadrant.x * map.Map.section_width + coord.tile.x) + map_offset_x,
-                    (coord.quadrant.y * map.Map.section_height + coord.tile.y) + map_offset_y
-                )
-                if tile_surface:
-                    quadrant.blit(tile_surface, (
-                        coord.tile.x * tile.TILE_SIZE,
-                        coord.tile.y * tile.TILE_SIZE)
-                    )
+
+
+class TileSurfaceCache:
+    # surfaces of single tiles by canonical (tile_number, attr), least
+    # recently used first. Surfaces the cache owns count against max_bytes;
+    # atlas subsurfaces share the atlas' pixels and cost nothing to keep.
+    # Lookups may come from a warm-up thread, so the dict is only touched
+    # under the lock; builds run outside it.
+    def __init__(self, max_bytes=1 << 20):
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.warmed = 0
+        # seconds spent building on misses, i.e. in the middle of a frame;
+        # a flip's time includes building the surface it is flipped from
+        self.build_time = 0
+        self.warm_up_time = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def __contains__(self, tile_lookup):
+        return tile_lookup in self.surfaces
+
+    def get(self, tile_lookup, build, counted=True):
+        # counted=False for lookups made while building another surface,
+        # whose cost is already part of that surface's miss
+        with self.lock:
+            surface = self.surfaces.get(tile_lookup)
+            if surface is not None:
+                if counted:
+                    self.hits += 1
+                self.surfaces.move_to_end(tile_lookup)
+                return surface
+            if counted:
+                self.misses += 1
+        start_time = time.perf_counter()
+        surface = build(tile_lookup)
+        if counted:
+            self.build_time += time.perf_counter() - start_time
+        self.put(tile_lookup, surface)
+        return surface
+
+    def put(self, tile_lookup, surface):
+        size = 0 if surface.get_parent() is not None else surface.get_pitch() * surface.get_height()
+        with self.lock:
+            self.bytes += size - self.sizes.get(tile_lookup, 0)
+            self.surfaces[tile_lookup] = surface
+            self.sizes[tile_lookup] = size
+            while self.bytes > self.max_bytes and self.surfaces:
+                evicted, _ = self.surfaces.popitem(last=False)
+                self.bytes -= self.sizes.pop(evicted)
+                self.evictions += 1
+
+    def warm(self, tile_lookups, build):
+        # build ahead of use until the budget is spent, without counting misses
+        start_time = time.perf_counter()
+        for tile_lookup in tile_lookups:
+            if self.bytes >= self.max_bytes:
+                break
+            if tile_lookup in self.surfaces:
+                continue
+            self.put(tile_lookup, build(tile_lookup))
+            self.warmed += 1
+        self.warm_up_time += time.perf_counter() - start_time
+
+    def discard_tiles(self, tile_numbers):
+        with self.lock:
+            for tile_lookup in [tile_lookup for tile_lookup in self.surfaces if tile_lookup[0] in tile_numbers]:
+                del self.surfaces[tile_lookup]
+                self.bytes -= self.sizes.pop(tile_lookup)
+
+    def clear(self):
+        with self.lock:
+            self.surfaces.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'surfaces': len(self.surfaces),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'warmed': self.warmed,
+            'build_ms': self.build_time * 1000,
+            'warm_up_ms': self.warm_up_time * 1000
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f'tile surfaces: {stats["surfaces"]} cached in {stats["bytes"]} of {stats["max_bytes"]} bytes, '
+                f'{stats["hits"]} hits, {stats["misses"]} misses built in {stats["build_ms"]:.2f} ms, '
+                f'{stats["evictions"]} evictions, {stats["warmed"]} warmed up in {stats["warm_up_ms"]:.2f} ms')
+
+
+def warm_up_order(tile_lookups):
+    # distinct lookups in first-seen order, with the unflipped surface a flip
+    # is made from ahead of it so warming a flip never misses
+    ordered = {}
+    for tile_number, attr in tile_lookups:
+        if 0 < attr >> 4 < tile.TRANSFORM_COUNT:
+            ordered.setdefault((tile_number, attr & 0xF), None)
+        ordered.setdefault((tile_number, attr), None)
+    return list(ordered)
+
+
+class SectionCache:
+    # fully rendered map sections, least recently used first. With
+    # prefetch_workers, sections asked for ahead of time are rendered on a
+    # thread pool and only picked up here when the scroll buffer needs them.
+    def __init__(self, renderer, max_sections=16, prefetch_workers=0):
+        self.renderer = renderer
+        self.max_sections = max_sections
+        self.surfaces = OrderedDict()
+        self.executor = concurrent.futures.ThreadPoolExecutor(prefetch_workers) if prefetch_workers > 0 else None
+        self.pending = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # misses split by how they were served
+        self.prefetch_hits = 0
+        self.prefetch_waits = 0
+        self.late_loads = 0
+        self.prefetch_wasted = 0
+
+    def get(self, idx_section):
+        # idx_section -1 is the blank area outside the map
+        surface = self.surfaces.get(idx_section)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(idx_section)
+            return surface
+        self.misses += 1
+        future = self.pending.pop(idx_section, None)
+        if future is not None:
+            if future.done():
+                self.prefetch_hits += 1
+            else:
+                self.prefetch_waits += 1
+            surface = future.result()
+        else:
+            self.late_loads += 1
+            surface = self.render_section(idx_section)
+        self.surfaces[idx_section] = surface
+        while len(self.surfaces) > self.max_sections:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def render_section(self, idx_section):
+        surface = self.renderer.new_surface((ScrollBuffer.quad_width, ScrollBuffer.quad_height))
+        surface.fill(self.renderer.background_fill())
+        if idx_section < 0:
+            return surface
+        game_map = self.renderer.cartridge.map
+        section_row, section_col = divmod(idx_section, game_map.map_width)
+        tile_data, attr_data = game_map.get_region(
+            section_row * map.Map.section_height,
+            section_col * map.Map.section_width,
+            map.Map.section_height,
+            map.Map.section_width
+        )
+        blits = []
+        for row, col in zip(*tile_data.nonzero()):
+            tile_surface = self.renderer.surface_for_tile(int(tile_data[row, col]), int(attr_data[row, col]))
+            blits.append((tile_surface, (int(col) * tile.TILE_SIZE, int(row) * tile.TILE_SIZE)))
+        surface.blits(blits, doreturn=False)
+        return surface
+
+    def prefetch(self, idx_sections):
+        if self.executor is None:
+            return
+        for idx_section in idx_sections:
+            if idx_section in self.surfaces or idx_section in self.pending:
+                continue
+            self.pending[idx_section] = self.executor.submit(self.build_section, idx_section)
+            # predictions that never came true make room for new ones
+            while len(self.pending) > self.max_sections:
+                _, future = self.pending.popitem(last=False)
+                future.cancel()
+                self.prefetch_wasted += 1
+
+    def build_section(self, idx_section):
+        # runs on a worker thread: decodes the section without touching the
+        # map's resident sections and composes it in numpy, so no surface
+        # other than the new one is used
+        renderer = self.renderer
+        tile_data, attr_data = renderer.cartridge.map.decode_section(idx_section)
+        pixels = atlas.render_section_pixels(renderer.cartridge, tile_data, attr_data, renderer.paletted)
+        surface = renderer.new_surface((ScrollBuffer.quad_width, ScrollBuffer.quad_height))
+        pygame.surfarray.blit_array(surface, pixels.swapaxes(0, 1))
+        return surface
+
+    def sections(self):
+        # every section rendered or being rendered
+        return list(self.surfaces) + list(self.pending)
+
+    def discard(self, idx_sections):
+        for idx_section in idx_sections:
+            self.surfaces.pop(idx_section, None)
+            future = self.pending.pop(idx_section, None)
+            if future is not None:
+                future.cancel()
+
+    def clear(self):
+        self.surfaces.clear()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def shutdown(self):
+        self.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            'sections': len(self.surfaces),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'prefetch_hits': self.prefetch_hits,
+            'prefetch_waits': self.prefetch_waits,
+            'late_loads': self.late_loads,
+            'prefetch_wasted': self.prefetch_wasted
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f'sections: {stats["hits"]} hits, {stats["misses"]} misses '
+                f'({stats["prefetch_hits"]} prefetched in time, {stats["prefetch_waits"]} waited on, '
+                f'{stats["late_loads"]} loaded late), {stats["prefetch_wasted"]} prefetches wasted')
+
+
+def split_span(start, length, size, map_offset):
+    # split [start, start + length) wherever it crosses a multiple of size,
+    # either in local coordinates or in map coordinates (shifted by map_offset)
+    end = start + length
+    while start < end:
+        next_local = (start // size + 1) * size
+        next_map = ((start + map_offset) // size + 1) * size - map_offset
+        piece_end = min(end, next_local, next_map)
+        yield start, piece_end - start
+        start = piece_end
+
+
+def new_player():
+    # the player sprite, starting in the middle of the first screen
+    return game.Entity(
+        LocalCoord().moved(map.Map.section_width / 2 * tile.TILE_SIZE, (map.Map.section_height / 2) * tile.TILE_SIZE),
+        tiled_area=map.TiledArea(
+            tile_data=[0xD, 0xE, 0xF, 0x10, 0x11, 0x12],
+            attr_data=[2, 2, 2, 2, 2, 2],
+            width=2,
+            height=3
+        )
+    )
+
+
+def load_input_script(filepath):
+    # one line per frame listing the keys held on that frame, e.g. "RIGHT SPACE"
+    input_script = []
+    with open(filepath, 'r') as script_file:
+        for line in script_file:
+            if line.startswith('#'):
+                continue
+            line = line.split('#', 1)[0]
+            frame_keys = set()
+            for key_name in line.split():
+                key = getattr(pygame, 'K_' + key_name, None)
+                if key is None:
+                    key = getattr(pygame, 'K_' + key_name.upper(), None)
+                if key is None:
+                    raise ValueError(f'unknown key in input script: {key_name}')
+                frame_keys.add(key)
+            input_script.append(frame_keys)
+    return input_script
 
 
 def clamp(n, min_n, max_n):
-    if n > max_n:
-        while n > max_n:
-            n -= (max_n - min_n + 1)
-        return n
-    elif n < min_n:
-        while n < min_n:
-            n += (max_n - min_n + 1)
-        return n
-    return n
+    # wrap n into [min_n, max_n]
+    return min_n + (n - min_n) % (max_n - min_n + 1)
 
 class LocalCoord():
-    def __init__(self):
-        self.quadrant = Point(0, 0)
-        self.tile = Point(0, 0)
-        self.pixel = Point(0, 0)
+    # one absolute pixel position per axis; quadrant, tile and pixel are
+    # derived on demand
+    __slots__ = ('x', 'y')
+
+    quad_pixel_width = map.Map.section_width * tile.TILE_SIZE
+    quad_pixel_height = map.Map.section_height * tile.TILE_SIZE
+
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+
+    @property
+    def quadrant(self):
+        return Point(int(self.x // LocalCoord.quad_pixel_width), int(self.y // LocalCoord.quad_pixel_height))
+
+    @property
+    def tile(self):
+        return Point(
+            int((self.x % LocalCoord.quad_pixel_width) // tile.TILE_SIZE),
+            int((self.y % LocalCoord.quad_pixel_height) // tile.TILE_SIZE)
+        )
+
+    @property
+    def pixel(self):
+        return Point(self.x % tile.TILE_SIZE, self.y % tile.TILE_SIZE)
+
+    def move(self, delta_x, delta_y):
+        # LocalCoord must stay positive, a move that would go below zero
+        # on an axis leaves that axis where it was
+        new_x = self.x + delta_x
+        if new_x >= 0:
+            self.x = new_x
+        new_y = self.y + delta_y
+        if new_y >= 0:
+            self.y = new_y
+        return self
 
     def moved(self, delta_x, delta_y):
-        new_coord = LocalCoord()
-        quadrant_x, quadrant_y = self.quadrant
-        tile_x, tile_y = self.tile
-        pixel_x, pixel_y = self.pixel
-        total_pixels_x, total_pixels_y = self.as_pixels()
-        # move in the x direction
-        if delta_x >= 0:
-            move_remain = abs(delta_x) + total_pixels_x
-        else:
-            move_remain = total_pixels_x - abs(delta_x)
-            if move_remain < 0:
-                move_remain = total_pixels_x
-        quadrant_x = tile_x = pixel_x = 0
-        while move_remain >= map.Map.section_width * tile.TILE_SIZE:
-            quadrant_x += 1
-            move_remain -= map.Map.section_width * tile.TILE_SIZE
-        while move_remain >= tile.TILE_SIZE:
-            tile_x += 1
-            move_remain -= tile.TILE_SIZE
-        pixel_x = move_remain
-        # move in the y direction
-        if delta_y >= 0:
-            move_remain = abs(delta_y) + total_pixels_y
-        else:
-            move_remain = total_pixels_y - abs(delta_y)
-        quadrant_y = tile_y = pixel_y = 0
-        while move_remain >= map.Map.section_height * tile.TILE_SIZE:
-            quadrant_y += 1
-            move_remain -= map.Map.section_height * tile.TILE_SIZE
-        while move_remain >= tile.TILE_SIZE:
-            tile_y += 1
-            move_remain -= tile.TILE_SIZE
-        pixel_y = move_remain
-        new_coord.quadrant = Point(quadrant_x, quadrant_y)
-        new_coord.tile = Point(tile_x, tile_y)
-        new_coord.pixel = Point(pixel_x, pixel_y)
-        return new_coord
+        return LocalCoord(self.x, self.y).move(delta_x, delta_y)
 
     def truncated_pixels(self):
-        new_coord = LocalCoord()
-        new_coord.quadrant = self.quadrant
-        new_coord.tile = self.tile
-        new_coord.pixel = Point(0, 0)
-        return new_coord
+        return LocalCoord(self.x - self.x % tile.TILE_SIZE, self.y - self.y % tile.TILE_SIZE)
 
     def as_pixels(self):
-        pixels_x = self.quadrant.x * map.Map.section_width * tile.TILE_SIZE + self.tile.x * tile.TILE_SIZE + self.pixel.x
-        pixels_y = self.quadrant.y * map.Map.section_height * tile.TILE_SIZE + self.tile.y * tile.TILE_SIZE + self.pixel.y
-        return Point(pixels_x, pixels_y)
+        return Point(self.x, self.y)
 
     def as_tiles(self):
-        tiles_x = self.quadrant.x * map.Map.section_width + self.tile.x
-        tiles_y = self.quadrant.y * map.Map.section_height + self.tile.y
-        return Point(tiles_x, tiles_y)
+        return Point(int(self.x // tile.TILE_SIZE), int(self.y // tile.TILE_SIZE))
 
     def __str__(self):
-        return f'quad: ({self.quadrant.x}, {self.quadrant.y}), tile: ({self.tile.x}, {self.tile.y}), pixel: ({self.pixel.x}, {self.pixel.y})'
+        quadrant = self.quadrant
+        tile_coord = self.tile
+        pixel = self.pixel
+        return f'quad: ({quadrant.x}, {quadrant.y}), tile: ({tile_coord.x}, {tile_coord.y}), pixel: ({pixel.x}, {pixel.y})'
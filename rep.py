@@ -4,16 +4,101 @@ import sys
 import argparse
 
 from cart import Cart
-from renderer import Renderer
+from hotreload import HotReloader
+from profiler import FrameProfiler
+from renderer import Renderer, load_input_script
+
+def print_reload(report):
+    if report['error']:
+        print(f'reload failed: {report["error"]}')
+    elif report['sections']:
+        print(f'reloaded {", ".join(report["sections"])} in {report["ms"]:.2f} ms '
+              f'({report["tiles"]} tiles, {report["map_sections"]} map sections changed)')
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('cart_file', help='Cartridige file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print load statistics')
+    parser.add_argument('--headless', action='store_true', help='Render without a window and without a frame cap')
+    parser.add_argument('--frames', type=int, help='Number of frames to render in headless mode')
+    parser.add_argument('--input', help='Input script for headless mode, one line of held keys per frame')
+    parser.add_argument('--dump-every', type=int, default=0, help='Dump the view surface every K frames')
+    parser.add_argument('--dump-dir', default='.', help='Directory for dumped frames')
+    parser.add_argument('--dump-format', choices=['png', 'rgb'], default='png', help='Dumped frame format')
+    parser.add_argument('--solid-tiles', type=int, nargs='*', default=[], help='Tile numbers entities cannot pass')
+    parser.add_argument('--solid-attr-mask', type=lambda value: int(value, 0), default=0,
+        help='Attr bits (e.g. 0x80) that make a map tile solid')
+    parser.add_argument('--tick-rate', type=int, default=60, help='Game ticks per second')
+    parser.add_argument('--max-frame-skip', type=int, default=5, help='Frames that may be skipped in a row to catch up')
+    parser.add_argument('--frame-rate', type=int, default=60, help='Frame cap, 0 for none')
+    parser.add_argument('--prefetch-workers', type=int, default=2, help='Threads rendering map sections ahead of the camera, 0 for none')
+    parser.add_argument('--tile-cache-kb', type=int, default=1024, help='Memory budget for cached tile surfaces')
+    parser.add_argument('--warm-up-thread', action='store_true',
+        help='Build tile surfaces for the map and sprites on a background thread instead of before the first frame')
+    parser.add_argument('--paletted', action='store_true', help='Render with 8-bit palette indices up to the final present')
+    parser.add_argument('--present', choices=['stretch', 'integer', 'letterbox'], default='stretch',
+        help='Scale the view to fill the window, by a whole multiple, or by a whole multiple between black bars')
+    parser.add_argument('--scale', type=int, help='Multiplier for integer and letterbox present')
+    parser.add_argument('--dirty-rects', action='store_true', help='Only update the parts of the window that changed')
+    parser.add_argument('--watch', metavar='SOURCE_FILE',
+        help='Dev mode: reload palette, tiles and map from this cart source whenever it is saved')
+    parser.add_argument('--profile', action='store_true', help='Time each phase of every frame')
+    parser.add_argument('--profile-overlay', action='store_true', help='Draw p50/p99 phase times on screen')
+    parser.add_argument('--profile-output', help='Write the frame timings to this .csv or .json file on exit')
     args = parser.parse_args()
     cart_file = args.cart_file
-    cart = Cart(cart_file)
-    renderer = Renderer(cart)
-    renderer.render()
+    cart = Cart(cart_file, solid_tiles=args.solid_tiles, solid_attr_mask=args.solid_attr_mask)
+    frame_profiler = None
+    if args.profile or args.profile_overlay or args.profile_output:
+        frame_profiler = FrameProfiler(keep_trace=args.profile_output is not None, overlay=args.profile_overlay)
+    renderer = Renderer(
+        cart,
+        frame_profiler=frame_profiler,
+        paletted=args.paletted,
+        present_mode=args.present,
+        present_scale=args.scale,
+        dirty_rects=args.dirty_rects,
+        prefetch_workers=args.prefetch_workers,
+        tile_cache_bytes=args.tile_cache_kb * 1024,
+        warm_up_thread=args.warm_up_thread
+    )
+    if args.watch:
+        renderer.reloader = HotReloader(renderer, args.watch, on_reload=print_reload)
+    if args.verbose:
+        print(cart.tile_catalog)
+        print(renderer.atlas)
+    if args.headless:
+        input_script = load_input_script(args.input) if args.input else []
+        frame_count = args.frames if args.frames is not None else len(input_script)
+        elapsed = renderer.render_headless(
+            frame_count,
+            input_script=input_script,
+            dump_every=args.dump_every,
+            dump_dir=args.dump_dir,
+            dump_format=args.dump_format
+        )
+        fps = frame_count / elapsed if elapsed > 0 else 0
+        print(f'{frame_count} frames in {elapsed:.3f} s ({fps:.1f} fps)')
+        if args.verbose:
+            print(renderer.presenter)
+            print(renderer.scroll_buffer.section_cache)
+            print(renderer.tile_surface_cache)
+    else:
+        stats = renderer.render(tick_rate=args.tick_rate, max_frame_skip=args.max_frame_skip, frame_rate=args.frame_rate)
+        if args.verbose:
+            print(renderer.presenter)
+            print(renderer.scroll_buffer.section_cache)
+            print(renderer.tile_surface_cache)
+            print(f'{stats["ticks"]} ticks, {stats["frames"]} frames, '
+                  f'{stats["skipped_frames"]} frames skipped, {stats["dropped_ticks"]} ticks dropped')
+    if frame_profiler is not None:
+        if args.profile_output:
+            frame_profiler.export(args.profile_output)
+        if args.verbose or args.profile:
+            for phase, (p50, p99) in frame_profiler.percentiles().items():
+                print(f'{phase:<14} p50 {p50 * 1000:8.3f} ms  p99 {p99 * 1000:8.3f} ms')
+    cart.close()
     return 0
 
 
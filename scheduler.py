@@ -0,0 +1,82 @@
+import collections
+import time
+
+
+class FixedStepScheduler:
+    # runs the simulation at tick_rate however fast frames are drawn. A slow
+    # frame is caught up on by running several ticks before the next frame,
+    # at most max_frame_skip frames in a row are skipped that way and any
+    # backlog beyond that is dropped so the game slows down instead of
+    # spiralling
+    def __init__(self, tick_rate=60, max_frame_skip=5, clock=time.perf_counter, rate_window=1.0):
+        self.tick_rate = tick_rate
+        self.tick_time = 1 / tick_rate
+        self.max_frame_skip = max_frame_skip
+        self.clock = clock
+        self.rate_window = rate_window
+        self.accumulator = 0.0
+        self.last_time = None
+        self.tick_count = 0
+        self.frame_count = 0
+        self.skipped_frames = 0
+        self.dropped_ticks = 0
+        self.tick_times = collections.deque()
+        self.frame_times = collections.deque()
+
+    def ticks_due(self):
+        # number of ticks to run before drawing the next frame
+        now = self.clock()
+        if self.last_time is not None:
+            self.accumulator += now - self.last_time
+        self.last_time = now
+        ticks = int(self.accumulator / self.tick_time)
+        max_ticks = self.max_frame_skip + 1
+        if ticks > max_ticks:
+            self.dropped_ticks += ticks - max_ticks
+            ticks = max_ticks
+            self.accumulator = self.tick_time * ticks
+        self.accumulator -= self.tick_time * ticks
+        if ticks > 1:
+            self.skipped_frames += ticks - 1
+        self.tick_count += ticks
+        self.tick_times.extend([now] * ticks)
+        self.prune(self.tick_times, now)
+        return ticks
+
+    @property
+    def alpha(self):
+        # how far between the last two ticks the next frame should be drawn
+        return min(self.accumulator / self.tick_time, 1.0)
+
+    def frame_done(self):
+        self.frame_count += 1
+        now = self.clock()
+        self.frame_times.append(now)
+        self.prune(self.frame_times, now)
+
+    def prune(self, times, now):
+        # only the last rate_window seconds are kept, however long the game runs
+        cutoff = now - self.rate_window
+        while times and times[0] < cutoff:
+            times.popleft()
+
+    def measured_rate(self, times):
+        if not times:
+            return 0.0
+        self.prune(times, self.clock())
+        return len(times) / self.rate_window
+
+    def stats(self):
+        return {
+            'ticks_per_second': self.measured_rate(self.tick_times),
+            'frames_per_second': self.measured_rate(self.frame_times),
+            'ticks': self.tick_count,
+            'frames': self.frame_count,
+            'skipped_frames': self.skipped_frames,
+            'dropped_ticks': self.dropped_ticks
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f'{stats["ticks_per_second"]:.1f} ticks/s, {stats["frames_per_second"]:.1f} frames/s, '
+                f'{stats["skipped_frames"]} frames skipped, {stats["dropped_ticks"]} ticks dropped')
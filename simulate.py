@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import random
+import sys
+import time
+
+import pygame
+
+import cart
+import game
+import physics
+import renderer
+
+HORIZONTAL_KEYS = [None, pygame.K_LEFT, pygame.K_RIGHT]
+VERTICAL_KEYS = [None, pygame.K_UP, pygame.K_DOWN]
+
+# carts already loaded by this process, a worker loads each cart once
+loaded_carts = {}
+
+
+def load_cart(cart_file, solid_tiles=(), solid_attr_mask=0):
+    key = (os.path.abspath(cart_file), tuple(solid_tiles), solid_attr_mask)
+    cartridge = loaded_carts.get(key)
+    if cartridge is None:
+        cartridge = cart.Cart(cart_file, solid_tiles=solid_tiles, solid_attr_mask=solid_attr_mask)
+        loaded_carts[key] = cartridge
+    return cartridge
+
+
+def random_input_script(seed, ticks, hold_ticks=15, jump_chance=0.1):
+    # keys held for hold_ticks at a time, the same script for the same seed
+    rng = random.Random(seed)
+    input_script = []
+    while len(input_script) < ticks:
+        frame_keys = {key for key in (rng.choice(HORIZONTAL_KEYS), rng.choice(VERTICAL_KEYS)) if key is not None}
+        if rng.random() < jump_chance:
+            frame_keys.add(pygame.K_SPACE)
+        input_script.extend([frame_keys] * hold_ticks)
+    return input_script[0:ticks]
+
+
+def add_walkers(sim, count, seed, max_speed=2.0):
+    # entities wandering in a straight line from random spots on the first screen
+    rng = random.Random(seed)
+    tiled_area = renderer.new_player().tiled_area
+    for _ in range(0, count):
+        walker = game.Entity(
+            renderer.LocalCoord(
+                rng.uniform(0, renderer.LocalCoord.quad_pixel_width),
+                rng.uniform(0, renderer.LocalCoord.quad_pixel_height)
+            ),
+            tiled_area=tiled_area
+        )
+        walker.vector = physics.Vector(x=rng.uniform(-max_speed, max_speed), y=rng.uniform(-max_speed, max_speed))
+        sim.add_entity(walker)
+
+
+def run_session(cart_file, ticks, input_script=None, seed=None, walkers=0, solid_tiles=(), solid_attr_mask=0,
+                session=0):
+    # one play session without rendering: the same input and advance order
+    # as Renderer.render_headless. Without an input script, seed picks a
+    # random one.
+    cartridge = load_cart(cart_file, solid_tiles, solid_attr_mask)
+    if input_script is None:
+        input_script = random_input_script(seed, ticks) if seed is not None else []
+    sim = game.Game(cartridge)
+    player = renderer.new_player()
+    sim.add_entity(player)
+    add_walkers(sim, walkers, seed)
+    controls = game.Controls(player)
+    no_keys = set()
+    start_time = time.perf_counter()
+    for tick in range(0, ticks):
+        controls.hold(input_script[tick] if tick < len(input_script) else no_keys)
+        controls.apply()
+        sim.advance()
+    elapsed = time.perf_counter() - start_time
+    store = sim.store
+    position = player.coord
+    vector = player.vector
+    return {
+        'session': session,
+        'ticks': ticks,
+        'seconds': elapsed,
+        'entities': len(store),
+        'player': (position.x, position.y),
+        'velocity': (vector.x, vector.y),
+        # every final position at once, to spot sessions that diverge
+        'digest': hashlib.blake2b(store.positions[0:store.count].tobytes(), digest_size=8).hexdigest()
+    }
+
+
+def run_sessions(specs):
+    return [run_session(**spec) for spec in specs]
+
+
+def simulate(specs, jobs=None, chunk_size=None):
+    # independent sessions run in parallel, chunk_size sessions per task so
+    # short sessions are not swamped by the cost of handing them out
+    if jobs == 1 or len(specs) <= 1:
+        return run_sessions(specs)
+    workers = jobs or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, len(specs) // (workers * 4))
+    chunks = [specs[idx:idx + chunk_size] for idx in range(0, len(specs), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return [result for results in executor.map(run_sessions, chunks) for result in results]
+
+
+def throughput(results, elapsed, jobs):
+    ticks = sum(result['ticks'] for result in results)
+    session_seconds = sum(result['seconds'] for result in results)
+    return {
+        'sessions': len(results),
+        'ticks': ticks,
+        'seconds': elapsed,
+        'jobs': jobs,
+        'ticks_per_second': ticks / elapsed if elapsed > 0 else 0,
+        # each session runs on a single core
+        'ticks_per_second_per_core': ticks / session_seconds if session_seconds > 0 else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cart_file', help='Cartridige file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the result of every session')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes, 1 to run in this process')
+    parser.add_argument('--sessions', type=int, default=1, help='Number of sessions to simulate')
+    parser.add_argument('--ticks', type=int, help='Game ticks per session, the input script length by default')
+    parser.add_argument('--input', nargs='*', default=[],
+        help='Input scripts, one line of held keys per tick; sessions take turns using them')
+    parser.add_argument('--seed', type=int, default=0, help='First seed for random input, one seed per session')
+    parser.add_argument('--walkers', type=int, default=0, help='Wandering entities added to every session')
+    parser.add_argument('--solid-tiles', type=int, nargs='*', default=[], help='Tile numbers the player cannot pass')
+    parser.add_argument('--solid-attr-mask', type=lambda value: int(value, 0), default=0,
+        help='Attr bits (e.g. 0x80) that make a map tile solid')
+    parser.add_argument('--chunk-size', type=int, help='Sessions handed to a worker at a time')
+    args = parser.parse_args()
+    input_scripts = [renderer.load_input_script(filepath) for filepath in args.input]
+    specs = []
+    for idx_session in range(0, args.sessions):
+        input_script = input_scripts[idx_session % len(input_scripts)] if input_scripts else None
+        ticks = args.ticks
+        if ticks is None:
+            ticks = len(input_script) if input_script is not None else 600
+        specs.append({
+            'cart_file': args.cart_file,
+            'ticks': ticks,
+            'input_script': input_script,
+            'seed': args.seed + idx_session,
+            'walkers': args.walkers,
+            'solid_tiles': args.solid_tiles,
+            'solid_attr_mask': args.solid_attr_mask,
+            'session': idx_session
+        })
+    jobs = 1 if args.jobs == 1 or args.sessions <= 1 else args.jobs or os.cpu_count() or 1
+    start_time = time.perf_counter()
+    results = simulate(specs, jobs=jobs, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - start_time
+    if args.verbose:
+        for result in results:
+            x, y = result['player']
+            print(f'session {result["session"]}: {result["ticks"]} ticks in {result["seconds"] * 1000:.2f} ms, '
+                  f'player at ({x:.1f}, {y:.1f}), digest {result["digest"]}')
+    stats = throughput(results, elapsed, jobs)
+    print(f'{stats["sessions"]} sessions, {stats["ticks"]} ticks in {elapsed:.3f} s on {jobs} processes '
+          f'({stats["ticks_per_second"]:.0f} ticks/s, {stats["ticks_per_second_per_core"]:.0f} ticks/s per core)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
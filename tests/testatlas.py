@@ -0,0 +1,62 @@
+import os
+import unittest
+
+import atlas
+import cart
+
+CART_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testcart.cart')
+
+class TestTileAtlas(unittest.TestCase):
+    def setUp(self):
+        self.cartridge = cart.Cart(CART_PATH)
+        self.atlas = atlas.TileAtlas(self.cartridge)
+        self.atlas.build()
+
+    def test_used_tiles(self):
+        used_tiles = self.atlas.used_tiles()
+        self.assertEqual(len(used_tiles), len(set(used_tiles)))
+        for tile_number, attr in used_tiles:
+            self.assertGreater(tile_number, 0)
+        catalog = self.cartridge.tile_catalog
+        self.assertEqual(set(self.atlas.rects), set(catalog.canonical_lookup(*tile_lookup) for tile_lookup in used_tiles))
+        # every section scanned once, none kept resident
+        game_map = self.cartridge.map
+        tile_layer, attr_layer = game_map.layers()
+        placed = tile_layer != 0
+        self.assertEqual(used_tiles, sorted(set(zip(tile_layer[placed].tolist(), attr_layer[placed].tolist()))))
+        decode_count = game_map.sections.decode_count
+        self.atlas.used_tiles()
+        self.assertEqual(game_map.sections.decode_count, decode_count)
+        self.assertEqual((len(game_map.sections.resident), len(game_map.attr_sections.resident)), (0, 0))
+
+    def test_shares_flipped_tiles(self):
+        # tile 0xE is tile 0xD flipped
+        self.atlas.build([(0xD, 0x02), (0xE, 0x12), (0xE, 0x02)])
+        self.assertEqual(len(self.atlas.rects), 2)
+        self.assertEqual(self.atlas.rects[(0xD, 0x02)], self.atlas.subsurface(0xE, 0x12).get_offset() + (8, 8))
+
+    def test_matches_palette_lookup(self):
+        for (tile_number, attr), rect in self.atlas.rects.items():
+            tile_data = self.cartridge.tile_catalog.patterns([tile_number - 1], attr >> 4)[0]
+            palette = attr & 0xF
+            for row in range(0, rect.height):
+                for col in range(0, rect.width):
+                    p = int(tile_data[row, col])
+                    if p > 0:
+                        expected = self.cartridge.lookup_background_color(palette, p)
+                    else:
+                        expected = atlas.COLOR_KEY
+                    self.assertEqual(tuple(self.atlas.surface.get_at((rect.x + col, rect.y + row)))[0:3], expected)
+
+    def test_report(self):
+        report = self.atlas.report()
+        self.assertEqual(report['tiles'], len(self.atlas.rects))
+        self.assertEqual(report['bytes'], self.atlas.surface.get_pitch() * self.atlas.surface.get_height())
+        self.assertGreaterEqual(report['build_ms'], 0)
+
+    def test_subsurface(self):
+        tile_number, attr = next(iter(self.atlas.rects))
+        surface = self.atlas.subsurface(tile_number, attr)
+        self.assertEqual(surface.get_size(), (8, 8))
+        self.assertEqual(surface.get_colorkey()[0:3], atlas.COLOR_KEY)
+        self.assertIsNone(self.atlas.subsurface(0, 0))
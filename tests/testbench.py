@@ -0,0 +1,27 @@
+import tempfile
+import unittest
+
+import bench
+import cart
+
+class TestBench(unittest.TestCase):
+    def test_synthetic_cart(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cartridge = cart.Cart(bench.write_synthetic_cart(temp_dir, 3, tile_count=5))
+        self.assertEqual(len(cartridge.tile_catalog), 5)
+        self.assertEqual(len(cartridge.map.sections), 3)
+        self.assertEqual((cartridge.map.map_width, cartridge.map.map_height), (3, 1))
+        self.assertLessEqual(int(cartridge.map.tile_layer.max()), 5)
+
+    def test_compare(self):
+        baseline = {'benchmarks': {'a': {'median': 1.0}, 'b': {'median': 1.0}}}
+        results = {'benchmarks': {'a': {'median': 1.1}, 'b': {'median': 1.5}, 'c': {'median': 1.0}}}
+        rows, regressions = bench.compare(results, baseline, 0.25)
+        self.assertEqual(regressions, ['b'])
+        self.assertEqual(rows[2], ('c', 1.0, None, None))
+
+    def test_time_operation(self):
+        calls = []
+        result = bench.time_operation(lambda: calls.append(1), repeat=3, min_time=0)
+        self.assertEqual(result['repeat'], 3)
+        self.assertEqual(len(calls), 3 * result['number'])
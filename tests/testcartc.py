@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cart
+import cartc
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+class TestCompileCart(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, 'testcart.source')
+        shutil.copy(os.path.join(ROOT_PATH, 'testcart.source'), self.source_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_matches_committed_cart(self):
+        stats = cartc.compile_cart(self.source_path, cart_format=1)
+        with open(os.path.join(self.temp_dir.name, 'testcart.cart'), 'rb') as cart_file:
+            compiled = cart_file.read()
+        with open(os.path.join(ROOT_PATH, 'testcart.cart'), 'rb') as cart_file:
+            self.assertEqual(compiled, cart_file.read())
+        self.assertEqual(stats['bytes'], len(compiled))
+        self.assertGreater(stats['lines'], 0)
+
+    def test_recompile_under_loaded_cart(self):
+        cartc.compile_cart(self.source_path, cart_format=1)
+        loaded = cart.Cart(os.path.join(self.temp_dir.name, 'testcart.cart'))
+        patterns = loaded.tile_catalog.patterns(range(0, len(loaded.tile_catalog))).copy()
+        first_tile = loaded.map.get_tile(0, 0)
+        with open(self.source_path, 'r') as source_file:
+            source = source_file.read()
+        with open(self.source_path, 'w') as source_file:
+            source_file.write(source.replace('02 02 02 02 02 02 02 02', '01 03 01 03 01 03 01 03'))
+        cartc.compile_cart(self.source_path, cart_format=1)
+        # the loaded cart still sees the file it was opened with
+        self.assertEqual(loaded.tile_catalog.patterns(range(0, len(loaded.tile_catalog))).tolist(), patterns.tolist())
+        self.assertEqual(loaded.map.get_tile(0, 0), first_tile)
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ['testcart.cart', 'testcart.source'])
+
+    def test_convert_to_bytes(self):
+        self.assertEqual(cartc.convert_to_bytes('0F 3d 2d\n'), b'\x0f\x3d\x2d')
+        self.assertEqual(cartc.convert_to_bytes('F 10  2'), b'\x0f\x10\x02')
+        with self.assertRaises(ValueError):
+            cartc.convert_to_bytes('0F zz')
+
+class TestIncrementalBuild(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, 'testcart.source')
+        self.cart_path = os.path.join(self.temp_dir.name, 'testcart.cart')
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+        shutil.copy(os.path.join(ROOT_PATH, 'testcart.source'), self.source_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_cart(self, filepath=None):
+        with open(filepath or self.cart_path, 'rb') as cart_file:
+            return cart_file.read()
+
+    def test_unchanged_source_uses_cache(self):
+        first = cartc.compile_cart(self.source_path, cache_dir=self.cache_dir)
+        self.assertEqual(first['encoded_blocks'], first['blocks'])
+        second = cartc.compile_cart(self.source_path, cache_dir=self.cache_dir, cart_format=1)
+        self.assertEqual(second['encoded_blocks'], 0)
+        self.assertEqual(second['cached_sections'], len(cartc.SECTIONS))
+        with open(os.path.join(ROOT_PATH, 'testcart.cart'), 'rb') as cart_file:
+            self.assertEqual(self.read_cart(), cart_file.read())
+
+    def test_changed_block_is_reencoded(self):
+        cartc.compile_cart(self.source_path, cache_dir=self.cache_dir)
+        with open(self.source_path, 'r') as source_file:
+            source = source_file.read()
+        with open(self.source_path, 'w') as source_file:
+            source_file.write(source.replace('- map\n09 00', '- map\n0A 00', 1))
+        stats = cartc.compile_cart(self.source_path, cache_dir=self.cache_dir)
+        self.assertEqual(stats['encoded_blocks'], 1)
+        self.assertEqual(stats['cached_sections'], len(cartc.SECTIONS) - 1)
+        incremental = self.read_cart()
+        cartc.compile_cart(self.source_path)
+        self.assertEqual(incremental, self.read_cart())
+
+    def test_block_added_to_single_block_section(self):
+        with open(self.source_path, 'r') as source_file:
+            lines = [line for line in source_file if line.strip() and not line.startswith('#')]
+        with open(self.source_path, 'w') as source_file:
+            source_file.writelines(lines)
+        cartc.compile_cart(self.source_path, cache_dir=self.cache_dir)
+        tiles_line = lines.index('- tiles\n')
+        with open(self.source_path, 'w') as source_file:
+            source_file.writelines(lines[0:tiles_line] + ['# more\n', '0F\n'] + lines[tiles_line:])
+        stats = cartc.compile_cart(self.source_path, cache_dir=self.cache_dir)
+        self.assertEqual(stats['encoded_blocks'], 1)
+        incremental = self.read_cart()
+        cartc.compile_cart(self.source_path)
+        self.assertEqual(incremental, self.read_cart())
+
+    def test_compile_carts_in_parallel(self):
+        other_path = os.path.join(self.temp_dir.name, 'other.source')
+        shutil.copy(self.source_path, other_path)
+        all_stats = cartc.compile_carts([self.source_path, other_path], jobs=2, cache_dir='cache')
+        self.assertEqual([stats['cart'] for stats in all_stats], [self.cart_path, os.path.join(self.temp_dir.name, 'other.cart')])
+        self.assertEqual(self.read_cart(), self.read_cart(os.path.join(self.temp_dir.name, 'other.cart')))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
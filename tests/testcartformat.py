@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cart
+import cartc
+import cartformat
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SECTION_SIZE = cartformat.MAP_SECTION_SIZE
+
+class TestRle(unittest.TestCase):
+    def test_round_trip(self):
+        for data in [b'', b'\x01', b'\x00' * 1000 + b'\x01\x02\x02' + b'\x03' * 255 + b'\x04' * 256]:
+            self.assertEqual(cartformat.rle_decode(cartformat.rle_encode(data)), data)
+
+    def test_long_runs_split(self):
+        self.assertEqual(cartformat.rle_encode(b'\x07' * 300), b'\xff\x07\x2d\x07')
+
+
+class TestCartV2(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, 'testcart.source')
+        shutil.copy(os.path.join(ROOT_PATH, 'testcart.source'), self.source_path)
+        cartc.compile_cart(self.source_path)
+        self.v1 = cart.Cart(os.path.join(ROOT_PATH, 'testcart.cart'))
+        self.v2 = cart.Cart(os.path.join(self.temp_dir.name, 'testcart.cart'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_loads_like_v1(self):
+        self.assertEqual(self.v1.toc, [])
+        self.assertGreater(len(self.v2.toc), 0)
+        self.assertEqual(self.v2.background_color, self.v1.background_color)
+        self.assertEqual(self.v2.background_palettes, self.v1.background_palettes)
+        all_tiles = range(0, len(self.v1.tile_catalog))
+        self.assertEqual(len(self.v2.tile_catalog), len(self.v1.tile_catalog))
+        self.assertEqual(self.v2.tile_catalog.patterns(all_tiles).tolist(), self.v1.tile_catalog.tiles.tolist())
+        self.assertEqual(self.v2.tile_catalog.report(), self.v1.tile_catalog.report())
+        self.assertEqual(self.v2.map.tile_layer.tolist(), self.v1.map.tile_layer.tolist())
+        self.assertEqual(self.v2.map.attr_layer.tolist(), self.v1.map.attr_layer.tolist())
+        self.assertEqual(self.v2.map.map_map, self.v1.map.map_map)
+
+    def test_random_section_access(self):
+        sections = self.v2.map.sections
+        self.assertEqual(sections.decode_count, 0)
+        self.assertEqual(self.v2.map.get_tile(0, 0), self.v1.map.get_tile(0, 0))
+        self.assertEqual(sections.decode_count, 1)
+        self.assertEqual(bytes(self.v2.read_section(cartformat.KIND_MAP, 2)), bytes(self.v1.map.sections.raw(2)))
+        with self.assertRaises(KeyError):
+            self.v2.read_section(cartformat.KIND_MAP, len(sections))
+
+    def test_deduplication(self):
+        section = bytes(range(0, 256)) * 3 + b'\x00' * (SECTION_SIZE - 768)
+        tile_map = section * 3
+        attr_map = b'\x00' * SECTION_SIZE * 3
+        parts = cartformat.build_v2(b'\x0f' * 13, b'', tile_map, attr_map, b'\x00\x03\x00\x01', compression='none')
+        # toc, palette, tiles, one map section, one attr section, mapmap
+        self.assertEqual(len(parts), 6)
+        cart_data = b''.join(parts)
+        entries = cartformat.read_toc(cart_data)
+        map_entries = [entry for entry in entries if entry.kind == cartformat.KIND_MAP]
+        self.assertEqual(len(map_entries), 3)
+        self.assertEqual(len(set(entry.offset for entry in map_entries)), 1)
+        self.assertEqual(bytes(cartformat.read_entry(cart_data, map_entries[2])), section)
+
+    def test_tile_index(self):
+        pattern = bytes(range(0, 64))
+        flipped = b''.join(pattern[row * 8:row * 8 + 8][::-1] for row in range(0, 8))
+        tiles = (pattern + flipped + b'\x01' * 64) * 10
+        args = (b'\x0f' * 13, tiles, b'\x00' * SECTION_SIZE, b'\x00' * SECTION_SIZE, b'\x00\x01\x00\x01')
+        cart_path = os.path.join(self.temp_dir.name, 'tiles.cart')
+        with open(cart_path, 'wb') as cart_file:
+            cart_file.writelines(cartformat.build_v2(*args, compression='none'))
+        cartridge = cart.Cart(cart_path)
+        self.assertIn(cartformat.KIND_TILE_INDEX, [entry.kind for entry in cartridge.toc])
+        self.assertEqual(len(cartridge.tile_catalog), 30)
+        self.assertEqual(len(cartridge.tile_catalog.tiles), 2)
+        self.assertEqual(cartridge.tile_catalog.patterns(range(0, 30)).tobytes(), tiles)
+        undeduplicated = b''.join(cartformat.build_v2(*args, compression='none', dedup_tiles=False))
+        self.assertNotIn(cartformat.KIND_TILE_INDEX, [entry.kind for entry in cartformat.read_toc(undeduplicated)])
+        self.assertLess(os.path.getsize(cart_path), len(undeduplicated))
+        # carts with an index are v3 so a v2-only reader turns them away
+        with open(cart_path, 'rb') as cart_file:
+            indexed = cart_file.read()
+        self.assertEqual(cartformat.PREAMBLE.unpack_from(indexed, 0)[1], cartformat.VERSION_TILE_INDEX)
+        self.assertEqual(cartformat.PREAMBLE.unpack_from(undeduplicated, 0)[1], cartformat.VERSION)
+        as_v2 = bytearray(indexed)
+        cartformat.PREAMBLE.pack_into(as_v2, 0, cartformat.MAGIC, cartformat.VERSION, 0, len(cartridge.toc))
+        with self.assertRaises(ValueError):
+            cartformat.read_toc(as_v2)
+
+
+class TestCartFile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        source_path = os.path.join(self.temp_dir.name, 'testcart.source')
+        shutil.copy(os.path.join(ROOT_PATH, 'testcart.source'), source_path)
+        cartc.compile_cart(source_path)
+        self.cart_paths = [os.path.join(ROOT_PATH, 'testcart.cart'), os.path.join(self.temp_dir.name, 'testcart.cart')]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_close(self):
+        for cart_path in self.cart_paths:
+            with cart.Cart(cart_path) as cartridge:
+                first_tile = cartridge.map.get_tile(0, 0)
+                # resident sections are copies, dropping them frees memory
+                self.assertTrue(cartridge.map.sections[0].flags.owndata)
+            self.assertIsNone(cartridge.cart_mmap)
+            self.assertEqual(cartridge.map.get_tile(0, 0), first_tile)
+            self.assertEqual(cartridge.tile_catalog[0].shape, (8, 8))
+            cartridge.close()
+
+    def test_short_files(self):
+        with open(self.cart_paths[0], 'rb') as cart_file:
+            v1_data = cart_file.read()
+        with open(self.cart_paths[1], 'rb') as cart_file:
+            v2_data = cart_file.read()
+        cart_path = os.path.join(self.temp_dir.name, 'short.cart')
+        for data in [b'', v1_data[0:10], v1_data[0:16], v1_data[0:100], v2_data[0:40], v2_data[0:-10]]:
+            with open(cart_path, 'wb') as cart_file:
+                cart_file.write(data)
+            with self.assertRaises(ValueError):
+                cart.Cart(cart_path)
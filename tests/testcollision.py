@@ -0,0 +1,124 @@
+import itertools
+import types
+import unittest
+
+import numpy as np
+import pygame
+
+import collision
+import game
+import map
+import physics
+import renderer
+
+class TestSpatialHash(unittest.TestCase):
+    def setUp(self):
+        self.rects = {}
+        self.spatial_hash = collision.SpatialHash(8, rect_of=self.rects.get)
+
+    def insert(self, handle, rect):
+        self.rects[handle] = rect
+        self.spatial_hash.insert(handle, tuple(collision.cell_spans(rect, 8)[0]))
+
+    def test_cell_spans(self):
+        spans = collision.cell_spans([(0, 0, 8, 8), (4, -4, 8, 8), (7.5, 8, 0, 0)], 8)
+        self.assertEqual(spans.tolist(), [[0, 0, 0, 0], [0, -1, 1, 0], [0, 1, 0, 1]])
+
+    def test_query_and_pairs_match_brute_force(self):
+        for handle in range(0, 60):
+            self.insert(handle, ((handle * 37) % 200, (handle * 53) % 150, 4 + handle % 13, 4 + handle % 7))
+        expected = {
+            (a, b) for a, b in itertools.combinations(range(0, 60), 2)
+            if pygame.Rect(self.rects[a]).colliderect(pygame.Rect(self.rects[b]))
+        }
+        self.assertEqual(set(self.spatial_hash.colliding_pairs()), expected)
+        area = (50, 40, 30, 30)
+        expected = {handle for handle, rect in self.rects.items() if pygame.Rect(rect).colliderect(pygame.Rect(area))}
+        self.assertEqual(set(self.spatial_hash.query(pygame.Rect(area))), expected)
+        stats = self.spatial_hash.stats()
+        self.assertGreater(stats['checks_skipped'], stats['checks_done'])
+
+    def test_remove(self):
+        self.insert(1, (0, 0, 10, 10))
+        self.insert(2, (5, 5, 10, 10))
+        self.assertEqual(self.spatial_hash.colliding_pairs(), [(1, 2)])
+        self.spatial_hash.remove(2)
+        self.assertEqual(self.spatial_hash.colliding_pairs(), [])
+        self.assertEqual(self.spatial_hash.stats()['cells'], 4)
+
+
+class TestGameCollision(unittest.TestCase):
+    def test_pairs_follow_movement(self):
+        g = game.Game(None)
+        area = map.TiledArea(tile_data=[1, 1], attr_data=[0, 0], width=2, height=1)
+        left = game.Entity(renderer.LocalCoord(0, 0), tiled_area=area)
+        right = game.Entity(renderer.LocalCoord(40, 0), tiled_area=area)
+        g.add_entity(left)
+        g.add_entity(right)
+        self.assertEqual(g.colliding_pairs(), [])
+        left.vector = physics.Vector(x=10, y=0)
+        for _ in range(0, 3):
+            g.advance()
+        self.assertEqual(g.colliding_pairs(), [(left, right)])
+        self.assertEqual(g.entities_in_rect(pygame.Rect(0, 0, 8, 8)), [])
+        self.assertEqual(set(g.entities_in_rect(pygame.Rect(36, 0, 8, 8))), {left, right})
+        g.remove_entity(right)
+        self.assertEqual(g.colliding_pairs(), [])
+        self.assertEqual(len(g.spatial_hash), 1)
+
+    def test_edited_tiled_area(self):
+        g = game.Game(None)
+        small = map.TiledArea(tile_data=[1, 0, 0, 0], attr_data=[0] * 4, width=2, height=2)
+        grower = game.Entity(renderer.LocalCoord(0, 0), tiled_area=small)
+        other = game.Entity(renderer.LocalCoord(12, 12), tiled_area=map.TiledArea(tile_data=[1], attr_data=[0], width=1, height=1))
+        g.add_entity(grower)
+        g.add_entity(other)
+        g.advance()
+        self.assertEqual(g.colliding_pairs(), [])
+        small.set_tile(1, 1, 1)
+        g.advance()
+        self.assertEqual(g.store.hitboxes[g.store.slots[grower.handle]].tolist(), [0, 0, 16, 16])
+        self.assertEqual(g.colliding_pairs(), [(grower, other)])
+
+
+class TestTileMotion(unittest.TestCase):
+    def setUp(self):
+        # a floor at row 10 and a one tile wide wall at column 6
+        self.grid = np.zeros((12, 12), dtype=bool)
+        self.grid[10, :] = True
+        self.grid[:, 6] = True
+
+    def solid_at(self, rows, cols):
+        rows, cols = np.broadcast_arrays(rows, cols)
+        inside = (rows >= 0) & (rows < 12) & (cols >= 0) & (cols < 12)
+        return inside & self.grid[np.clip(rows, 0, 11), np.clip(cols, 0, 11)]
+
+    def test_stops_flush(self):
+        rects = [(8, 60, 8, 16), (8, 8, 8, 8), (60, 8, 8, 8), (16, 8, 8, 8)]
+        deltas = [(0, 9), (40, 0), (-30, 0), (4, 4)]
+        allowed, stopped = collision.resolve_tile_motion(self.solid_at, rects, deltas)
+        self.assertEqual(allowed.tolist(), [[0, 4], [32, 0], [-4, 0], [4, 4]])
+        self.assertEqual(stopped.tolist(), [[False, True], [True, False], [True, False], [False, False]])
+
+    def test_no_tunneling(self):
+        # fast enough to skip over the wall in one step
+        allowed, stopped = collision.resolve_tile_motion(self.solid_at, [(30, 8, 8, 8)], [(40, 0)])
+        self.assertEqual(allowed.tolist(), [[10, 0]])
+        self.assertTrue(stopped[0, 0])
+
+    def test_game_stops_at_solid_tiles(self):
+        game_map = map.Map(solid_tiles=[1])
+        section = bytearray(map.Map.section_width * map.Map.section_height)
+        section[10 * map.Map.section_width:11 * map.Map.section_width] = b'\x01' * map.Map.section_width
+        game_map.load(bytes(section))
+        game_map.load_mapmap(b'\x00\x01\x00\x01')
+        game_map.build_solidity()
+        g = game.Game(types.SimpleNamespace(map=game_map))
+        area = map.TiledArea(tile_data=[1, 1, 1, 1], attr_data=[0] * 4, width=2, height=2)
+        origin_x, origin_y = (n * 8 for n in map.LOCAL_ORIGIN)
+        falling = game.Entity(renderer.LocalCoord(origin_x + 16, origin_y + 8), tiled_area=area)
+        g.add_entity(falling)
+        for _ in range(0, 20):
+            falling.accelerate(0, 1)
+            g.advance()
+        self.assertEqual(falling.coord.as_pixels(), (origin_x + 16, origin_y + 64))
@@ -0,0 +1,89 @@
+import unittest
+
+import game
+import map
+import physics
+import renderer
+
+class TestEntityStore(unittest.TestCase):
+    def test_handles_survive_removal(self):
+        store = game.EntityStore(capacity=2)
+        handles = [store.add(idx, idx * 2) for idx in range(0, 5)]
+        self.assertEqual(len(store), 5)
+        store.remove(handles[1])
+        store.remove(handles[3])
+        self.assertEqual(len(store), 3)
+        for idx in [0, 2, 4]:
+            self.assertEqual(store.position(handles[idx]), (idx, idx * 2))
+        with self.assertRaises(KeyError):
+            store.position(handles[1])
+
+    def test_integrate(self):
+        store = game.EntityStore()
+        first = store.add(10, 10, 3, -4)
+        second = store.add(1, 1, -2, 5)
+        store.integrate()
+        self.assertEqual(store.position(first), (13, 6))
+        # x would go negative so it stays put, like LocalCoord.move
+        self.assertEqual(store.position(second), (1, 6))
+        store.integrate()
+        self.assertEqual(store.position(first), (16, 2))
+
+
+class TestGame(unittest.TestCase):
+    def setUp(self):
+        self.game = game.Game(None)
+        self.area = map.TiledArea(tile_data=[1, 2], attr_data=[0, 0], width=2, height=1)
+        self.entity = game.Entity(renderer.LocalCoord(5, 5), tiled_area=self.area)
+
+    def test_entity_facade(self):
+        self.entity.vector = physics.Vector(x=2, y=0)
+        self.entity.move()
+        self.assertEqual(self.entity.coord.as_pixels(), (7, 5))
+        self.game.add_entity(self.entity)
+        self.assertIn(self.entity, self.game.entities)
+        self.assertIs(self.entity.tiled_area, self.area)
+        self.entity.accelerate(1, 3)
+        self.assertEqual((self.entity.vector.x, self.entity.vector.y), (3, 3))
+        self.game.advance()
+        self.assertEqual(self.entity.coord.as_pixels(), (10, 8))
+        self.entity.vector = self.entity.vector.add(physics.Vector(x=-3, y=0))
+        self.game.advance()
+        self.assertEqual(self.entity.coord.as_pixels(), (10, 11))
+
+    def test_in_place_changes_write_through(self):
+        self.game.add_entity(self.entity)
+        self.entity.coord.move(5, 0)
+        self.assertEqual(self.game.store.position(self.entity.handle), (10, 5))
+        self.entity.coord.y = 7
+        self.entity.vector.x = 3
+        self.assertEqual(self.game.store.velocity(self.entity.handle), (3, 0))
+        self.game.advance()
+        self.assertEqual(self.entity.coord.as_pixels(), (13, 7))
+        self.assertIsInstance(self.entity.coord, renderer.LocalCoord)
+        self.game.remove_entity(self.entity)
+        self.assertEqual((self.entity.coord.x, self.entity.coord.y), (13, 7))
+        self.assertIs(type(self.entity.coord), renderer.LocalCoord)
+
+    def test_interpolated_coord(self):
+        self.game.add_entity(self.entity)
+        self.entity.accelerate(4, 2)
+        self.game.advance()
+        coord = self.entity.interpolated_coord(0.25)
+        self.assertEqual((coord.x, coord.y), (6, 5.5))
+        self.assertEqual(self.entity.interpolated_coord(1.0).as_pixels(), (9, 7))
+
+    def test_remove_entity_keeps_state(self):
+        other = game.Entity(renderer.LocalCoord(0, 0), tiled_area=self.area)
+        self.game.add_entity(self.entity)
+        self.game.add_entity(other)
+        self.game.add_entity(self.entity)
+        self.assertEqual(len(self.game.entities), 2)
+        self.entity.accelerate(1, 1)
+        self.game.advance()
+        self.game.remove_entity(self.entity)
+        self.assertNotIn(self.entity, self.game.entities)
+        self.assertEqual(self.entity.coord.as_pixels(), (6, 6))
+        self.game.advance()
+        self.assertEqual(self.entity.coord.as_pixels(), (6, 6))
+        self.assertEqual(other.coord.as_pixels(), (0, 0))
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygame
+
+import cart
+import cartc
+import hotreload
+import renderer
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSourceWatcher(unittest.TestCase):
+    def test_poll(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, 'watched.source')
+            with open(filepath, 'w') as source_file:
+                source_file.write('- palette\n')
+            clock = FakeClock()
+            watcher = hotreload.SourceWatcher(filepath, interval=1.0, clock=clock)
+            self.assertFalse(watcher.poll())
+            with open(filepath, 'a') as source_file:
+                source_file.write('0F\n')
+            # not until the interval is up
+            self.assertFalse(watcher.poll())
+            clock.now = 1.0
+            self.assertTrue(watcher.poll())
+            clock.now = 2.0
+            self.assertFalse(watcher.poll())
+
+
+class TestHotReloader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, 'testcart.source')
+        shutil.copy(os.path.join(ROOT_PATH, 'testcart.source'), self.source_path)
+        cartc.compile_cart(self.source_path)
+        self.renderer = renderer.Renderer(cart.Cart(os.path.join(self.temp_dir.name, 'testcart.cart')), prefetch_workers=0)
+        self.renderer.start()
+        self.reloader = hotreload.HotReloader(self.renderer, self.source_path)
+        with open(self.source_path, 'r') as source_file:
+            self.lines = source_file.readlines()
+
+    def tearDown(self):
+        self.renderer.stop()
+        self.temp_dir.cleanup()
+
+    def edit(self, line_number, text):
+        self.lines[line_number - 1] = text + '\n'
+        with open(self.source_path, 'w') as source_file:
+            source_file.writelines(self.lines)
+
+    def assert_matches_fresh_build(self):
+        # the live view is what a restart with the recompiled cart would show
+        self.renderer.present_frame()
+        live = pygame.image.tostring(self.renderer.view_surface, 'RGB')
+        cartc.compile_cart(self.source_path)
+        fresh = renderer.Renderer(cart.Cart(os.path.join(self.temp_dir.name, 'testcart.cart')), prefetch_workers=0)
+        fresh.start()
+        fresh.present_frame()
+        self.assertEqual(live, pygame.image.tostring(fresh.view_surface, 'RGB'))
+
+    def test_unchanged(self):
+        report = self.reloader.reload()
+        self.assertEqual(report['sections'], [])
+        self.assertIsNone(report['error'])
+
+    def test_tiles(self):
+        # first row of tile 1, which the first map section uses
+        self.assertEqual(self.lines[27], '02 02 02 02 02 02 02 02\n')
+        self.edit(28, '01 03 01 03 01 03 01 03')
+        old_surface = self.renderer.surface_for_tile(1, 0)
+        report = self.reloader.reload()
+        self.assertEqual(report['sections'], ['tiles'])
+        self.assertEqual(report['tiles'], 1)
+        self.assertGreater(report['map_sections'], 0)
+        self.assertGreaterEqual(report['ms'], 0)
+        self.assertIsNot(self.renderer.surface_for_tile(1, 0), old_surface)
+        self.assert_matches_fresh_build()
+
+    def test_during_warm_up(self):
+        self.renderer.tile_surface_cache.clear()
+        self.renderer.warm_up([self.renderer.player.tiled_area], background=True)
+        self.edit(28, '01 03 01 03 01 03 01 03')
+        self.reloader.reload()
+        self.assertIsNone(self.renderer.warm_up_worker)
+        self.assert_matches_fresh_build()
+
+    def test_map(self):
+        map_line = self.lines.index('- map\n') + 2
+        self.edit(map_line, '01 02 03 04 ' + self.lines[map_line - 1][12:].rstrip('\n'))
+        report = self.reloader.reload()
+        self.assertEqual(report['sections'], ['map'])
+        self.assertEqual(report['map_sections'], 1)
+        self.assertEqual(self.renderer.cartridge.map.get_tile(0, 3), 4)
+        self.assert_matches_fresh_build()
+
+    def test_bad_edit(self):
+        # first background palette
+        self.assertEqual(self.lines[4], '20 10 00\n')
+        self.edit(5, '2A 16 00')
+        self.edit(28, '02 02 zz')
+        report = self.reloader.reload()
+        self.assertIsNotNone(report['error'])
+        self.assertEqual(report['sections'], [])
+        # the palette edit from the failed save lands with the fixed one
+        self.edit(28, '02 02 02 02 02 02 02 02')
+        report = self.reloader.reload()
+        self.assertIsNone(report['error'])
+        self.assertEqual(report['sections'], ['palette'])
+        self.assert_matches_fresh_build()
@@ -0,0 +1,57 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+import pygame
+
+import profiler
+
+class TestFrameProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = profiler.FrameProfiler(window=4, phases=['a', 'b'], keep_trace=True)
+        # fixed lap times instead of the clock
+        for frame in range(0, 6):
+            self.profiler.begin_frame()
+            self.profiler.current[:] = (frame, frame * 10)
+            self.profiler.end_frame()
+
+    def test_rolling_window(self):
+        self.assertEqual(self.profiler.recent_samples()[:, 0].tolist(), [2, 3, 4, 5])
+        percentiles = self.profiler.percentiles(q=(50, 100))
+        self.assertEqual(percentiles['a'], (3.5, 5))
+        self.assertEqual(percentiles['b'], (35, 50))
+        counts, edges = self.profiler.histogram('a', bins=2)
+        self.assertEqual(counts.tolist(), [2, 2])
+
+    def test_laps(self):
+        frame_profiler = profiler.FrameProfiler(phases=['a', 'b'])
+        frame_profiler.begin_frame()
+        frame_profiler.lap('a')
+        frame_profiler.lap('b')
+        frame_profiler.lap('a')
+        frame_profiler.end_frame()
+        self.assertEqual(frame_profiler.frame_count, 1)
+        self.assertTrue((frame_profiler.recent_samples() >= 0).all())
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            csv_path = os.path.join(temp_dir, 'trace.csv')
+            self.profiler.export(csv_path)
+            with open(csv_path, newline='') as trace_file:
+                rows = list(csv.reader(trace_file))
+            self.assertEqual(rows[0], ['frame', 'a', 'b'])
+            self.assertEqual(len(rows), 7)
+            json_path = os.path.join(temp_dir, 'trace.json')
+            self.profiler.export(json_path)
+            with open(json_path) as trace_file:
+                trace = json.load(trace_file)
+            self.assertEqual(trace['frames'], 6)
+            self.assertEqual(trace['trace'][5], [5, 50])
+
+    def test_overlay(self):
+        frame_profiler = profiler.FrameProfiler(overlay=True)
+        surface = pygame.Surface((320, 240))
+        frame_profiler.draw_overlay(surface)
+        self.assertGreater(pygame.surfarray.array3d(surface).max(), 0)
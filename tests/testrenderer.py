@@ -1,8 +1,18 @@
+import os
+import tempfile
 import unittest
+
+import numpy as np
+import pygame
+
+import atlas
+import cart
 import renderer
 import map
 import tile
 
+CART_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testcart.cart')
+
 class TestUtilities(unittest.TestCase):
     def test_clamp(self):
         self.assertEqual(renderer.clamp(50, 0, 100), 50)
@@ -12,6 +22,8 @@ class TestUtilities(unittest.TestCase):
         self.assertEqual(renderer.clamp(-1, 0, 1), 1)
         self.assertEqual(renderer.clamp(33, 0, 32), 0)
         self.assertEqual(renderer.clamp(-1, 0, 32), 32)
+        self.assertEqual(renderer.clamp(10 ** 9 + 1, 0, 1), 1)
+        self.assertEqual(renderer.clamp(7, 5, 6), 5)
 
 class TestMap(unittest.TestCase):
     def setUp(self):
@@ -28,6 +40,90 @@ class TestMap(unittest.TestCase):
         self.assertEqual(self.game_map.map_height, 1)
         self.assertEqual(len(self.game_map.sections), 2)
         self.assertEqual(len(self.game_map.attr_sections), 2)
+        self.assertEqual(self.game_map.tile_layer.shape, (map.Map.section_height, map.Map.section_width * 2))
+        self.assertEqual(self.game_map[1][0, 0], 1)
+
+    def test_lazy_sections(self):
+        self.assertEqual(self.game_map.sections.decode_count, 0)
+        self.assertEqual(self.game_map.get_tile(0, map.Map.section_width), 1)
+        self.assertEqual(list(self.game_map.sections.resident), [1])
+        self.assertEqual(self.game_map.sections.decode_count, 1)
+        self.game_map.get_tile(1, map.Map.section_width + 1)
+        self.assertEqual(self.game_map.sections.decode_count, 1)
+        self.game_map.get_tile(0, 0)
+        self.game_map.release_cold_sections(keep=1)
+        self.assertEqual(list(self.game_map.sections.resident), [0])
+        self.assertEqual(self.game_map.get_tile(0, map.Map.section_width), 1)
+        self.assertEqual(self.game_map.sections.decode_count, 3)
+        self.assertEqual(len(self.game_map.sections.raw(1)), map.Map.section_width * map.Map.section_height)
+
+    def test_solidity(self):
+        self.assertFalse(self.game_map.has_solidity)
+        self.assertFalse(self.game_map.solid_at(0, map.Map.section_width))
+        attr_data = bytearray(map.Map.section_width * map.Map.section_height * 2)
+        attr_data[3 * map.Map.section_width + 5] = 0x80
+        self.game_map.load_attr_map(bytes(attr_data))
+        self.game_map.set_solidity(solid_tiles=[1], solid_attr_mask=0x80)
+        self.assertEqual(self.game_map.solid_bits.shape, (2, map.Map.section_height, map.Map.section_width // 8))
+        rows, cols = np.mgrid[-2:map.Map.section_height + 2, -2:map.Map.section_width * 2 + 2]
+        expected = (cols >= map.Map.section_width) & (cols < map.Map.section_width * 2) & (rows >= 0) & (rows < map.Map.section_height)
+        expected[3 + 2, 5 + 2] = True
+        self.assertTrue((self.game_map.solid_at(rows, cols) == expected).all())
+        # bitmaps are built without keeping sections resident
+        self.assertEqual(len(self.game_map.sections.resident), 0)
+
+    def test_max_resident_sections(self):
+        game_map = map.Map(max_resident_sections=1)
+        game_map.load(b'\x00' * (map.Map.section_width * map.Map.section_height * 3))
+        game_map.load_mapmap(b'\x00\x03\x00\x01')
+        game_map.get_region(0, 0, 1, map.Map.section_width * 3)
+        self.assertEqual(len(game_map.sections.resident), 1)
+        self.assertEqual(game_map.sections.decode_count, 3)
+
+    def test_get_tile(self):
+        self.assertEqual(self.game_map.get_tile(0, 0), 0)
+        self.assertEqual(self.game_map.get_tile(0, map.Map.section_width), 1)
+        self.assertEqual(self.game_map.get_tile(-1, map.Map.section_width), 0)
+        self.assertEqual(self.game_map.get_tile(map.Map.section_height, map.Map.section_width), 0)
+        self.assertEqual(self.game_map.get_attr(0, map.Map.section_width * 2), 0)
+
+    def test_get_region(self):
+        tile_data, attr_data = self.game_map.get_region(-2, map.Map.section_width - 2, 4, 4)
+        self.assertEqual(tile_data.shape, (4, 4))
+        self.assertEqual(attr_data.shape, (4, 4))
+        self.assertEqual(tile_data[0:2].tolist(), [[0, 0, 0, 0], [0, 0, 0, 0]])
+        self.assertEqual(tile_data[2:4].tolist(), [[0, 0, 1, 1], [0, 0, 1, 1]])
+        tile_data, attr_data = self.game_map.get_region(0, map.Map.section_width * 2, 2, 2)
+        self.assertFalse(tile_data.any())
+
+    def test_get_tiles_in_area(self):
+        area = self.game_map.get_tiles_in_area(range(0, 3), range(map.Map.section_width - 1, map.Map.section_width + 1))
+        self.assertEqual(area.width, 2)
+        self.assertEqual(area.height, 3)
+        self.assertEqual(area.tiles[0], [(0, 0), (1, 0)])
+
+class TestTiledArea(unittest.TestCase):
+    def test_hitbox(self):
+        area = map.TiledArea(tile_data=[0, 0, 0, 0, 3, 0, 0, 5, 0], attr_data=[1] * 9, width=3, height=3)
+        self.assertEqual(area.bounds, pygame.Rect(0, 0, 3 * tile.TILE_SIZE, 3 * tile.TILE_SIZE))
+        self.assertEqual(area.hitbox, pygame.Rect(tile.TILE_SIZE, tile.TILE_SIZE, tile.TILE_SIZE, 2 * tile.TILE_SIZE))
+        self.assertIs(area.hitbox, area.hitbox)
+        area.set_tile(0, 2, 7)
+        self.assertEqual(area.hitbox, pygame.Rect(tile.TILE_SIZE, 0, 2 * tile.TILE_SIZE, 3 * tile.TILE_SIZE))
+        self.assertEqual(area.tiles[0], [(0, 1), (0, 1), (7, 0)])
+        self.assertFalse(area.is_empty())
+        empty = map.TiledArea(tile_data=[0, 0], attr_data=[4, 4], width=2, height=1)
+        self.assertTrue(empty.is_empty())
+        self.assertEqual(empty.hitbox, pygame.Rect(0, 0, 0, 0))
+
+    def test_content_key(self):
+        area = map.TiledArea(tile_data=[1, 2], attr_data=[0, 0], width=2, height=1)
+        same = map.TiledArea(tile_data=[1, 2], attr_data=[0, 0], width=2, height=1)
+        self.assertEqual(area.content_key(), same.content_key())
+        self.assertNotEqual(area.content_key(), map.TiledArea(tile_data=[1, 2], attr_data=[0, 0], width=1, height=2).content_key())
+        area.set_tile(0, 1, 2, attr=1)
+        self.assertEqual(area.version, 1)
+        self.assertNotEqual(area.content_key(), same.content_key())
 
 class TestLocalCoord(unittest.TestCase):
     def test_moved(self):
@@ -58,6 +154,25 @@ class TestLocalCoord(unittest.TestCase):
         self.assertEqual(moved_2_pixels_left.tile.x, 1)
         self.assertEqual(moved_2_pixels_left.pixel.x, tile.TILE_SIZE - 1)
 
+    def test_move_in_place(self):
+        l = renderer.LocalCoord()
+        moved = l.move(map.Map.section_width * tile.TILE_SIZE * 3 + tile.TILE_SIZE * 2 + 5, 7)
+        self.assertIs(moved, l)
+        self.assertEqual(l.quadrant, (3, 0))
+        self.assertEqual(l.tile, (2, 0))
+        self.assertEqual(l.pixel, (5, 7))
+        l.move(-l.x - 1, -8)
+        self.assertEqual(l.as_pixels(), (map.Map.section_width * tile.TILE_SIZE * 3 + tile.TILE_SIZE * 2 + 5, 7))
+        with self.assertRaises(AttributeError):
+            l.quadrant_x = 0
+
+    def test_truncated_pixels(self):
+        l = renderer.LocalCoord().moved(tile.TILE_SIZE * 3 + 2, tile.TILE_SIZE + 6)
+        truncated = l.truncated_pixels()
+        self.assertEqual(truncated.tile, (3, 1))
+        self.assertEqual(truncated.pixel, (0, 0))
+        self.assertEqual(l.pixel, (2, 6))
+
     def test_as_pixels(self):
         l = renderer.LocalCoord()
         moved_one_pixel = l.moved(1, 0)
@@ -81,3 +196,282 @@ class TestLocalCoord(unittest.TestCase):
         moved_one_screen = l.moved(map.Map.section_width * tile.TILE_SIZE, 0)
         tile_x, tile_y = moved_one_screen.as_tiles()
         self.assertEqual(tile_x, map.Map.section_width)
+
+class TestHeadless(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.script_path = os.path.join(self.temp_dir.name, 'input.txt')
+        with open(self.script_path, 'w') as script_file:
+            script_file.write('# frame keys\nRIGHT\nRIGHT SPACE\n\nLEFT\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_load_input_script(self):
+        input_script = renderer.load_input_script(self.script_path)
+        self.assertEqual(input_script, [
+            {pygame.K_RIGHT},
+            {pygame.K_RIGHT, pygame.K_SPACE},
+            set(),
+            {pygame.K_LEFT}
+        ])
+
+    def test_render_headless(self):
+        r = renderer.Renderer(cart.Cart(CART_PATH))
+        input_script = renderer.load_input_script(self.script_path)
+        r.render_headless(6, input_script=input_script, dump_every=3, dump_dir=self.temp_dir.name, dump_format='rgb')
+        dumps = sorted(f for f in os.listdir(self.temp_dir.name) if f.endswith('.rgb'))
+        self.assertEqual(dumps, ['frame_000003.rgb', 'frame_000006.rgb'])
+        with open(os.path.join(self.temp_dir.name, dumps[0]), 'rb') as dump_file:
+            self.assertEqual(len(dump_file.read()), r.view_surface.get_width() * r.view_surface.get_height() * 3)
+        self.assertEqual(r.player.vector.y, -25)
+
+class TestRenderEntities(unittest.TestCase):
+    def setUp(self):
+        self.renderer = renderer.Renderer(cart.Cart(CART_PATH))
+        self.renderer.start()
+
+    def tearDown(self):
+        pygame.quit()
+
+    def test_matches_tile_by_tile(self):
+        surface = pygame.Surface((renderer.ScrollBuffer.quad_width, renderer.ScrollBuffer.quad_height))
+        self.renderer.render_entities(surface)
+        expected = pygame.Surface(surface.get_size())
+        x, y = self.renderer.player.coord.as_pixels()
+        for row, row_data in enumerate(self.renderer.player.tiled_area.tiles):
+            for col, (tile_number, attr) in enumerate(row_data):
+                tile_surface = self.renderer.surface_for_tile(tile_number, attr)
+                if tile_surface:
+                    expected.blit(tile_surface, (x + col * tile.TILE_SIZE, y + row * tile.TILE_SIZE))
+        self.assertEqual(pygame.image.tostring(surface, 'RGB'), pygame.image.tostring(expected, 'RGB'))
+
+    def test_composite_cache(self):
+        tiled_area = self.renderer.player.tiled_area
+        surface = self.renderer.composite_surface(tiled_area)
+        self.assertIs(self.renderer.composite_surface(tiled_area), surface)
+        same_tiles = map.TiledArea(
+            tile_data=[0xD, 0xE, 0xF, 0x10, 0x11, 0x12],
+            attr_data=[2, 2, 2, 2, 2, 2],
+            width=2,
+            height=3
+        )
+        self.assertIs(self.renderer.composite_surface(same_tiles), surface)
+        tiled_area.set_tile(0, 0, 0)
+        self.assertIsNot(self.renderer.composite_surface(tiled_area), surface)
+        self.assertEqual(self.renderer.composite_surface(map.TiledArea(tile_data=[0], attr_data=[0], width=1, height=1)), None)
+
+    def test_composite_surfaces_bounded(self):
+        self.renderer.max_composite_surfaces = 2
+        area = map.TiledArea(tile_data=[0xD], attr_data=[2], width=1, height=1)
+        for tile_number in [0xD, 0xF, 0x10, 0x11, 0xF]:
+            area.set_tile(0, 0, tile_number, attr=2)
+            surface = self.renderer.composite_surface(area)
+            self.assertEqual(
+                pygame.image.tostring(surface, 'RGB'),
+                pygame.image.tostring(self.renderer.surface_for_tile(tile_number, 2), 'RGB')
+            )
+            self.assertLessEqual(len(self.renderer.composite_surfaces), 2)
+
+    def test_flipped_tiles_share_surfaces(self):
+        # tile 0xE is tile 0xD flipped, so flipping it back draws 0xD
+        surface = self.renderer.surface_for_tile(0xE, 0x12)
+        self.assertIs(self.renderer.surface_for_tile(0xD, 0x02), surface)
+        for transform in range(0, 4):
+            pixels = atlas.render_tile_pixels(self.renderer.cartridge, [0xE], [0x02 | transform << 4])[0]
+            surface = self.renderer.surface_for_tile(0xE, 0x02 | transform << 4)
+            self.assertEqual(pygame.surfarray.array3d(surface).swapaxes(0, 1).tolist(), pixels.tolist())
+
+
+class TestTileSurfaceCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        surface_bytes = pygame.Surface((tile.TILE_SIZE, tile.TILE_SIZE)).get_pitch() * tile.TILE_SIZE
+        cache = renderer.TileSurfaceCache(max_bytes=surface_bytes * 2)
+        built = []
+
+        def build(tile_lookup):
+            built.append(tile_lookup)
+            return pygame.Surface((tile.TILE_SIZE, tile.TILE_SIZE))
+        first = cache.get((1, 0), build)
+        cache.get((2, 0), build)
+        self.assertIs(cache.get((1, 0), build), first)
+        cache.get((3, 0), build)
+        self.assertEqual(built, [(1, 0), (2, 0), (3, 0)])
+        self.assertIn((1, 0), cache)
+        self.assertNotIn((2, 0), cache)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1))
+        self.assertEqual(stats['bytes'], surface_bytes * 2)
+        # subsurfaces share their parent's pixels
+        cache.get((4, 0), lambda tile_lookup: first.subsurface((0, 0, 1, 1)))
+        self.assertEqual(cache.stats()['bytes'], surface_bytes * 2)
+        cache.discard_tiles({1, 4})
+        self.assertEqual((len(cache), cache.stats()['bytes']), (1, surface_bytes))
+
+    def test_warm_up_counts_no_lookups(self):
+        r = renderer.Renderer(cart.Cart(CART_PATH), prefetch_workers=0)
+        flipped = map.TiledArea(tile_data=[0xD, 0xF], attr_data=[0x12, 0x22], width=2, height=1)
+        r.warm_up([flipped])
+        stats = r.tile_surface_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 0))
+        self.assertEqual(stats['warmed'], len(r.tile_surface_cache))
+        # a flip missed mid-frame is one miss, however its base was found
+        r.tile_surface_cache.clear()
+        r.surface_for_tile(0xF, 0x32)
+        stats = r.tile_surface_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 1))
+
+    def test_warm_up(self):
+        for warm_up_thread in [False, True]:
+            r = renderer.Renderer(cart.Cart(CART_PATH), prefetch_workers=0, warm_up_thread=warm_up_thread)
+            r.start()
+            r.wait_for_warm_up()
+            cache = r.tile_surface_cache
+            catalog = r.cartridge.tile_catalog
+            for row_data in r.player.tiled_area.tiles:
+                for tile_number, attr in row_data:
+                    if tile_number > 0:
+                        self.assertIn(catalog.canonical_lookup(tile_number, attr), cache)
+            for tile_lookup in r.atlas.used_tiles():
+                self.assertIn(catalog.canonical_lookup(*tile_lookup), cache)
+            stats = cache.stats()
+            if warm_up_thread:
+                # the first sections drawn race the warm-up for some tiles
+                self.assertGreaterEqual(stats['warmed'] + stats['misses'], len(cache))
+            else:
+                # the first sections drawn found everything built
+                self.assertEqual((stats['warmed'], stats['misses']), (len(cache), 0))
+            r.stop()
+
+
+class TestPaletted(unittest.TestCase):
+    def run_frames(self, r, frame_count):
+        frames = []
+        r.press_key(pygame.K_RIGHT)
+        for frame in range(0, frame_count):
+            r.apply_input()
+            r.draw_frame()
+            frames.append(pygame.image.tostring(r.present_surface, 'RGB'))
+        return frames
+
+    def test_matches_full_color(self):
+        full_color = renderer.Renderer(cart.Cart(CART_PATH))
+        full_color.start()
+        paletted = renderer.Renderer(cart.Cart(CART_PATH), paletted=True)
+        paletted.start()
+        self.assertEqual(paletted.view_surface.get_bitsize(), 8)
+        self.assertEqual(self.run_frames(paletted, 40), self.run_frames(full_color, 40))
+        for r in [full_color, paletted]:
+            r.cycle_palette(0)
+            r.cycle_palette(2, step=2)
+        self.assertEqual(self.run_frames(paletted, 5), self.run_frames(full_color, 5))
+        pygame.quit()
+
+
+class TestPresenter(unittest.TestCase):
+    def setUp(self):
+        pygame.init()
+        self.display_surface = pygame.display.set_mode((1024, 768))
+        self.view_surface = pygame.Surface((256, 240))
+        self.view_surface.fill((10, 20, 30))
+
+    def tearDown(self):
+        pygame.quit()
+
+    def test_letterbox(self):
+        presenter = renderer.Presenter(self.display_surface, (256, 240), mode='letterbox')
+        self.assertEqual(presenter.dest_rect, pygame.Rect(128, 24, 768, 720))
+        self.assertEqual(renderer.Presenter.window_size((256, 240), (1024, 768), 'integer'), (1024, 960))
+        with self.assertRaises(ValueError):
+            renderer.Presenter(self.display_surface, (256, 240), mode='letterbox', scale=4)
+        with self.assertRaises(ValueError):
+            renderer.Presenter(self.display_surface, (256, 240), dirty_rects=True)
+
+    def test_dirty_rects(self):
+        presenter = renderer.Presenter(self.display_surface, (256, 240), mode='letterbox', dirty_rects=True)
+        presenter.scale(self.view_surface)
+        presenter.update()
+        presenter.scale(self.view_surface)
+        presenter.update()
+        self.assertEqual(presenter.stats()['static_frames'], 1)
+        self.view_surface.fill((200, 0, 0), (40, 40, 30, 2))
+        presenter.scale(self.view_surface)
+        presenter.update()
+        # two blocks of 32x30 view pixels at 3x
+        self.assertEqual(presenter.update_rects, [pygame.Rect(128 + 96, 24 + 90, 192, 90)])
+        expected = pygame.Surface((768, 720))
+        pygame.transform.scale(self.view_surface, (768, 720), expected)
+        self.assertEqual(
+            pygame.image.tostring(self.display_surface.subsurface(presenter.dest_rect), 'RGB'),
+            pygame.image.tostring(expected, 'RGB')
+        )
+
+
+class TestScrollBuffer(unittest.TestCase):
+    def setUp(self):
+        self.renderer = renderer.Renderer(cart.Cart(CART_PATH))
+        self.scroll_buffer = renderer.ScrollBuffer(renderer=self.renderer, section_cache_size=3)
+        self.view_surface = pygame.Surface((renderer.ScrollBuffer.quad_width, renderer.ScrollBuffer.quad_height))
+
+    def reference_view(self):
+        # draw the visible map area tile by tile, straight from the map
+        surface = pygame.Surface((renderer.ScrollBuffer.quad_width, renderer.ScrollBuffer.quad_height))
+        surface.fill(self.renderer.cartridge.lookup_universal_background_color())
+        map_offset_x, map_offset_y = self.scroll_buffer.map_offset
+        pixels_x, pixels_y = self.scroll_buffer.coord.as_pixels()
+        tiles_x, tiles_y = self.scroll_buffer.coord.as_tiles()
+        for row in range(tiles_y, tiles_y + map.Map.section_height + 1):
+            for col in range(tiles_x, tiles_x + map.Map.section_width + 1):
+                tile_surface = self.renderer.surface_for_map_tile(col + map_offset_x, row + map_offset_y)
+                if tile_surface:
+                    surface.blit(tile_surface, (col * tile.TILE_SIZE - pixels_x, row * tile.TILE_SIZE - pixels_y))
+        return pygame.image.tostring(surface, 'RGB')
+
+    def test_scroll_matches_map(self):
+        moves = [(0, 0), (3, 0), (13, 0), (250, 0), (-9, 0), (0, 17), (0, -30), (40, 41), (-300, 0), (700, 5), (-64, -3)]
+        for delta_x, delta_y in moves:
+            self.scroll_buffer.scroll(delta_x, delta_y)
+            self.scroll_buffer.render(self.view_surface)
+            self.assertEqual(pygame.image.tostring(self.view_surface, 'RGB'), self.reference_view(), (delta_x, delta_y))
+
+    def test_section_cache(self):
+        section_cache = self.scroll_buffer.section_cache
+        self.assertGreater(section_cache.misses, 0)
+        misses = section_cache.misses
+        self.scroll_buffer.scroll(tile.TILE_SIZE, 0)
+        self.assertEqual(section_cache.misses, misses)
+        self.assertGreater(section_cache.hits, 0)
+        for step in range(0, 4):
+            self.scroll_buffer.scroll(map.Map.section_width * tile.TILE_SIZE, 0)
+        stats = section_cache.stats()
+        self.assertEqual(stats['sections'], 3)
+        self.assertEqual(stats['evictions'], stats['misses'] - 3)
+
+    def test_prefetch(self):
+        for paletted in [False, True]:
+            r = renderer.Renderer(cart.Cart(CART_PATH), paletted=paletted)
+            section_cache = renderer.SectionCache(r, prefetch_workers=2)
+            # the worker thread path draws the same sections as the blits
+            for idx_section in range(0, len(r.cartridge.map.sections)):
+                self.assertEqual(
+                    pygame.image.tostring(section_cache.build_section(idx_section), 'RGB'),
+                    pygame.image.tostring(section_cache.render_section(idx_section), 'RGB')
+                )
+            section_cache.shutdown()
+        scroll_buffer = renderer.ScrollBuffer(renderer=self.renderer, section_cache_size=8, prefetch_workers=1)
+        section_cache = scroll_buffer.section_cache
+        scroll_buffer.prefetch_ahead(tile.TILE_SIZE * 2, 0)
+        pending = list(section_cache.pending.values())
+        self.assertGreater(len(pending), 0)
+        for future in pending:
+            future.result()
+        for step in range(0, 30):
+            scroll_buffer.scroll(tile.TILE_SIZE * 2, 0)
+        stats = section_cache.stats()
+        self.assertEqual(stats['prefetch_hits'], len(pending))
+        self.assertEqual(stats['misses'], stats['prefetch_hits'] + stats['prefetch_waits'] + stats['late_loads'])
+        section_cache.shutdown()
+
+    def test_split_span(self):
+        self.assertEqual(list(renderer.split_span(10, 40, 32, -16)), [(10, 6), (16, 16), (32, 16), (48, 2)])
+        self.assertEqual(list(renderer.split_span(0, 0, 32, 0)), [])
@@ -0,0 +1,51 @@
+import unittest
+
+import scheduler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFixedStepScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = scheduler.FixedStepScheduler(tick_rate=10, max_frame_skip=2, clock=self.clock)
+        self.assertEqual(self.scheduler.ticks_due(), 0)
+
+    def run_frame(self, seconds):
+        self.clock.now += seconds
+        ticks = self.scheduler.ticks_due()
+        self.scheduler.frame_done()
+        return ticks
+
+    def test_fixed_ticks_and_alpha(self):
+        self.assertEqual(self.run_frame(0.05), 0)
+        self.assertAlmostEqual(self.scheduler.alpha, 0.5)
+        self.assertEqual(self.run_frame(0.07), 1)
+        self.assertAlmostEqual(self.scheduler.alpha, 0.2)
+        self.assertEqual(self.scheduler.skipped_frames, 0)
+
+    def test_catch_up_and_drop(self):
+        # a slow frame is caught up on by skipping frames
+        self.assertEqual(self.run_frame(0.25), 2)
+        self.assertEqual(self.scheduler.skipped_frames, 1)
+        # beyond max_frame_skip the backlog is dropped
+        self.assertEqual(self.run_frame(1.0), 3)
+        self.assertEqual(self.scheduler.dropped_ticks, 7)
+        self.assertAlmostEqual(self.scheduler.alpha, 0.0)
+
+    def test_rates(self):
+        for _ in range(0, 80):
+            self.run_frame(0.025)
+        # timestamps older than the rate window are not kept around
+        self.assertLessEqual(len(self.scheduler.frame_times), 41)
+        self.assertLessEqual(len(self.scheduler.tick_times), 11)
+        stats = self.scheduler.stats()
+        self.assertAlmostEqual(stats['ticks'], 20, delta=1)
+        self.assertEqual(stats['frames'], 80)
+        self.assertAlmostEqual(stats['ticks_per_second'], 10, delta=1)
+        self.assertAlmostEqual(stats['frames_per_second'], 40, delta=1)
@@ -0,0 +1,45 @@
+import os
+import unittest
+
+import pygame
+
+import cart
+import renderer
+import simulate
+
+CART_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testcart.cart')
+
+class TestSimulate(unittest.TestCase):
+    def test_matches_headless_renderer(self):
+        input_script = [{pygame.K_RIGHT}] * 20 + [{pygame.K_DOWN, pygame.K_SPACE}] * 10 + [{pygame.K_LEFT}] * 15
+        r = renderer.Renderer(cart.Cart(CART_PATH), prefetch_workers=0)
+        r.render_headless(50, input_script=input_script)
+        result = simulate.run_session(CART_PATH, 50, input_script=input_script)
+        self.assertEqual(result['ticks'], 50)
+        self.assertEqual(result['entities'], 1)
+        self.assertEqual(result['player'], (r.player.coord.x, r.player.coord.y))
+        self.assertEqual(result['velocity'], (r.player.vector.x, r.player.vector.y))
+
+    def test_random_input_script(self):
+        input_script = simulate.random_input_script(7, 100, hold_ticks=10)
+        self.assertEqual(len(input_script), 100)
+        self.assertEqual(input_script, simulate.random_input_script(7, 100, hold_ticks=10))
+        self.assertEqual(input_script[0], input_script[9])
+        self.assertNotEqual(input_script, simulate.random_input_script(8, 100, hold_ticks=10))
+
+    def test_process_pool_matches_serial(self):
+        specs = [
+            {'cart_file': CART_PATH, 'ticks': 40, 'seed': seed, 'walkers': 5, 'session': seed}
+            for seed in range(0, 6)
+        ]
+        serial = simulate.simulate(specs, jobs=1)
+        parallel = simulate.simulate(specs, jobs=2, chunk_size=2)
+        self.assertEqual([result['session'] for result in parallel], list(range(0, 6)))
+        for result_serial, result_parallel in zip(serial, parallel):
+            self.assertEqual(result_serial['digest'], result_parallel['digest'])
+            self.assertEqual(result_serial['player'], result_parallel['player'])
+            self.assertEqual(result_parallel['entities'], 6)
+        stats = simulate.throughput(parallel, 1.0, 2)
+        self.assertEqual(stats['ticks'], 240)
+        self.assertEqual(stats['ticks_per_second'], 240)
+        self.assertGreater(stats['ticks_per_second_per_core'], 0)
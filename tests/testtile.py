@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import tile
+
+class TestTileCatalog(unittest.TestCase):
+    def setUp(self):
+        tile_data_size = tile.TILE_SIZE * tile.TILE_SIZE
+        self.raw_data = bytes(range(0, tile_data_size)) + b'\x02' * tile_data_size
+        self.catalog = tile.TileCatalog()
+        self.catalog.load(self.raw_data)
+
+    def test_load(self):
+        self.assertEqual(len(self.catalog), 2)
+        self.assertEqual(self.catalog.tiles.shape, (2, tile.TILE_SIZE, tile.TILE_SIZE))
+        self.assertEqual(self.catalog[0][0, 3], 3)
+        self.assertEqual(self.catalog[0][1, 0], tile.TILE_SIZE)
+        self.assertTrue((self.catalog[1] == 2).all())
+
+    def test_partial_tile_ignored(self):
+        self.catalog.load(self.raw_data + b'\x01' * 10)
+        self.assertEqual(len(self.catalog), 2)
+        self.catalog.load(b'')
+        self.assertEqual(len(self.catalog), 0)
+
+    def test_getitem_returns_view(self):
+        self.assertTrue(np.shares_memory(self.catalog[1], self.catalog.tiles))
+        with self.assertRaises(IndexError):
+            self.catalog[2]
+        with self.assertRaises(IndexError):
+            self.catalog[-1]
+
+
+class TestDeduplication(unittest.TestCase):
+    def setUp(self):
+        pattern = np.arange(0, tile.TILE_SIZE * tile.TILE_SIZE, dtype=np.uint8).reshape((tile.TILE_SIZE, tile.TILE_SIZE))
+        # a pattern, a copy, its flips, then something else
+        tiles = [pattern, pattern, pattern[:, ::-1], pattern[::-1, :], pattern[::-1, ::-1], pattern * 0 + 1]
+        self.raw_data = b''.join(t.tobytes() for t in tiles)
+        self.catalog = tile.TileCatalog()
+        self.catalog.load(self.raw_data)
+
+    def test_deduplicate(self):
+        self.assertEqual(self.catalog.leaders.tolist(), [0, 0, 0, 0, 0, 5])
+        self.assertEqual(self.catalog.transforms.tolist(), [0, 0, 1, 2, 3, 0])
+        self.assertEqual(self.catalog.canonical_lookup(3, 0x12), (1, 0x02))
+        self.assertEqual(self.catalog.canonical_lookup(4, 0x12), (1, 0x32))
+        self.assertEqual(self.catalog.canonical_lookup(5, 0x32), (1, 0x02))
+        # not a flip, so not shared
+        self.assertEqual(self.catalog.canonical_lookup(5, 0x42), (5, 0x42))
+        report = self.catalog.report()
+        self.assertEqual((report['tiles'], report['distinct'], report['duplicates'], report['flipped']), (6, 2, 1, 3))
+        self.assertEqual(report['repeat_bytes'], 4 * tile.TILE_SIZE * tile.TILE_SIZE)
+
+    def test_pack_distinct(self):
+        distinct_data, index_data = tile.pack_distinct(self.raw_data)
+        self.assertEqual(len(distinct_data), 2 * tile.TILE_SIZE * tile.TILE_SIZE)
+        packed = tile.TileCatalog()
+        packed.load(distinct_data, index_data)
+        self.assertEqual(len(packed), 6)
+        self.assertEqual(packed.patterns(range(0, 6)).tolist(), self.catalog.patterns(range(0, 6)).tolist())
+        self.assertEqual(packed[4].tolist(), self.catalog[4].tolist())
+        self.assertEqual(tile.pack_distinct(distinct_data), (distinct_data, None))
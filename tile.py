@@ -1,26 +1,169 @@
-import math
+import numpy as np
 
 TILE_SIZE = 8
 
+# transform bits, as found in the high nibble of an attr byte
+FLIP_HORIZONTAL = 1
+FLIP_VERTICAL = 2
+TRANSFORM_COUNT = 4
+
+# odd multipliers for hashing tile pixels, one per 8 byte word of a tile
+HASH_MULTIPLIERS = np.array([
+    1272169043175792511, 9133081275179539225, 2052307127035339617, 5810609535542551683,
+    4503384722687335127, 972811482394475051, 7334244702156737151, 513932366202644427
+], dtype=np.uint64)
+
+
+def orient(patterns, transforms):
+    # (..., 8, 8) patterns flipped by transforms, one per pattern or one for all
+    transforms = np.asarray(transforms)
+    horizontal = ((transforms & FLIP_HORIZONTAL) != 0)[..., np.newaxis, np.newaxis]
+    vertical = ((transforms & FLIP_VERTICAL) != 0)[..., np.newaxis, np.newaxis]
+    patterns = np.where(horizontal, patterns[..., :, ::-1], patterns)
+    return np.where(vertical, patterns[..., ::-1, :], patterns)
+
+
+def orientations(tiles):
+    # (N, 4, 8, 8): every tile under each transform
+    return np.stack([tiles, tiles[:, :, ::-1], tiles[:, ::-1, :], tiles[:, ::-1, ::-1]], axis=1)
+
+
+def deduplicate(tiles):
+    # for (N, 8, 8) tiles: the index of the first tile each one is a copy or
+    # a flip of, and the transform that turns that first tile into it
+    tile_count = len(tiles)
+    if tile_count == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.uint8)
+    oriented = orientations(tiles)
+    rows = oriented.reshape((tile_count * TRANSFORM_COUNT, TILE_SIZE * TILE_SIZE))
+    # a 64 bit hash of every orientation of every tile
+    words = rows.view(np.uint64)
+    keys = ((words ^ (words >> np.uint64(31))) * HASH_MULTIPLIERS).sum(axis=1, dtype=np.uint64)
+    leaders, transforms = group_orientations(keys.reshape((tile_count, TRANSFORM_COUNT)))
+    if not (oriented[leaders, transforms] == tiles).all():
+        # two different tiles hashed the same, group on the pixels themselves
+        _, keys = np.unique(rows.view(np.dtype((np.void, TILE_SIZE * TILE_SIZE))).ravel(), return_inverse=True)
+        leaders, transforms = group_orientations(keys.reshape((tile_count, TRANSFORM_COUNT)))
+    return leaders, transforms
+
+
+def group_orientations(keys):
+    # (N, 4) keys of each tile's orientations; the lowest names the tile's
+    # group whichever way the tile is flipped
+    tile_count = len(keys)
+    to_group = keys.argmin(axis=1)
+    groups = keys[np.arange(0, tile_count), to_group]
+    _, first_in_group, group_of_tile = np.unique(groups, return_index=True, return_inverse=True)
+    leaders = first_in_group[group_of_tile]
+    # flips are their own inverse and commute, so going from the leader to
+    # the group's orientation and back out to the tile is one xor
+    transforms = (to_group ^ to_group[leaders]).astype(np.uint8)
+    return leaders.astype(np.intp), transforms
+
+
 class TileCatalog:
+    # tile patterns as stored, plus for every tile number which stored
+    # pattern it is drawn from and how that pattern is flipped
     def __init__(self):
-        self.tiles = []
+        self.tiles = np.zeros((0, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        self.indices = np.zeros(0, dtype=np.intp)
+        self.transforms = np.zeros(0, dtype=np.uint8)
+        self.leaders = np.zeros(0, dtype=np.intp)
 
-    def load(self, raw_data):
-        self.tiles = []
+    def load(self, raw_data, index_data=None):
+        # one (N, 8, 8) array over the raw cart bytes, no per-tile decoding.
+        # Without index_data every tile is stored and duplicates are found
+        # here; with it, raw_data holds only the distinct patterns.
         tile_data_size = TILE_SIZE * TILE_SIZE
-        tile_count = math.floor(len(raw_data) / tile_data_size)
-        for idx_tile in range(0, tile_count):
-            tile_data = raw_data[idx_tile * tile_data_size:(idx_tile + 1) * tile_data_size]
-            tile = []
-            for row in range(0, TILE_SIZE):
-                row_data = tile_data[row * TILE_SIZE:(row + 1) * TILE_SIZE]
-                tile_row = [p for p in row_data]
-                tile.append(tile_row)
-            self.tiles.append(tile)
+        tile_count = len(raw_data) // tile_data_size
+        self.tiles = np.frombuffer(raw_data, dtype=np.uint8, count=tile_count * tile_data_size).reshape(
+            (tile_count, TILE_SIZE, TILE_SIZE)
+        )
+        if index_data is None:
+            self.indices, self.transforms = deduplicate(self.tiles)
+            self.leaders = self.indices
+        else:
+            self.indices, self.transforms = decode_index(index_data)
+            _, first_use, pattern_of_tile = np.unique(self.indices, return_index=True, return_inverse=True)
+            self.leaders = first_use[pattern_of_tile].astype(np.intp)
+
+    def __len__(self):
+        return len(self.indices)
 
     def __getitem__(self, idx):
-        if idx in range(0, len(self.tiles)):
-            return self.tiles[idx]
+        if idx in range(0, len(self.indices)):
+            return self.oriented(self.tiles[self.indices[idx]], self.transforms[idx])
         else:
             raise IndexError
+
+    @staticmethod
+    def oriented(pattern, transform):
+        # a flipped view, not a copy
+        if transform & FLIP_HORIZONTAL:
+            pattern = pattern[:, ::-1]
+        if transform & FLIP_VERTICAL:
+            pattern = pattern[::-1, :]
+        return pattern
+
+    def patterns(self, tile_indices, transforms=0):
+        # (K, 8, 8) patterns of many tiles, each flipped again by transforms
+        tile_indices = np.asarray(tile_indices, dtype=np.intp)
+        transforms = self.transforms[tile_indices] ^ np.asarray(transforms, dtype=np.uint8)
+        return orient(self.tiles[self.indices[tile_indices]], transforms)
+
+    def canonical_lookup(self, tile_number, attr=0):
+        # the (tile_number, attr) that draws the same pixels with the first
+        # tile sharing this one's pattern; attrs whose transform is not a
+        # flip are left alone
+        transform = attr >> 4
+        if tile_number <= 0 or tile_number > len(self.indices) or transform >= TRANSFORM_COUNT:
+            return tile_number, attr
+        idx = tile_number - 1
+        leader = int(self.leaders[idx])
+        transform ^= int(self.transforms[idx]) ^ int(self.transforms[leader])
+        return leader + 1, (attr & 0xF) | transform << 4
+
+    def report(self):
+        distinct = len(np.unique(self.leaders))
+        flipped = int(np.count_nonzero(self.transforms ^ self.transforms[self.leaders]))
+        return {
+            'tiles': len(self.indices),
+            'distinct': distinct,
+            'duplicates': len(self.indices) - distinct - flipped,
+            'flipped': flipped,
+            # what storing each pattern once saves
+            'repeat_bytes': (len(self.indices) - distinct) * TILE_SIZE * TILE_SIZE
+        }
+
+    def __str__(self):
+        report = self.report()
+        return (f'tiles: {report["tiles"]}, {report["distinct"]} distinct, {report["duplicates"]} duplicates, '
+                f'{report["flipped"]} flipped, {report["repeat_bytes"]} bytes of repeats')
+
+
+def pack_distinct(raw_data):
+    # raw tile data -> the distinct patterns, leaders unflipped, and the
+    # index that rebuilds every tile from them; data without repeats comes
+    # back as it was, with no index
+    tile_data_size = TILE_SIZE * TILE_SIZE
+    tile_count = len(raw_data) // tile_data_size
+    tiles = np.frombuffer(raw_data, dtype=np.uint8, count=tile_count * tile_data_size).reshape(
+        (tile_count, TILE_SIZE, TILE_SIZE)
+    )
+    leaders, transforms = deduplicate(tiles)
+    distinct = np.unique(leaders)
+    if len(distinct) == tile_count:
+        return raw_data, None
+    return tiles[distinct].tobytes(), encode_index(np.searchsorted(distinct, leaders), transforms)
+
+
+def encode_index(indices, transforms):
+    # big-endian u16 pattern index per tile, then a u8 transform per tile
+    return np.asarray(indices, dtype='>u2').tobytes() + np.asarray(transforms, dtype=np.uint8).tobytes()
+
+
+def decode_index(index_data):
+    tile_count = len(index_data) // 3
+    indices = np.frombuffer(index_data, dtype='>u2', count=tile_count).astype(np.intp)
+    transforms = np.frombuffer(index_data, dtype=np.uint8, count=tile_count, offset=tile_count * 2).copy()
+    return indices, transforms